@@ -0,0 +1,151 @@
+"""
+Benchmark the SQLite PRAGMA profile against the old connection settings.
+
+Runs the same synthetic workload on a fresh temporary database twice: once with
+only WAL + busy_timeout (what connections used to set) and once with
+schema.PRAGMA_PROFILE. The workload ingests shop pages the way the poll loop does,
+one transaction per page, while a second connection answers the reads slash
+commands make. Halfway through, a reader holds a snapshot open for the rest of the
+ingest, like a long web request, so the WAL can't be checkpointed back.
+
+Usage:
+    python scripts/bench_sqlite_profile.py [--pages 400] [--page-size 25]
+    SQLITE_PRAGMAS="mmap_size=0" python scripts/bench_sqlite_profile.py
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from src import schema  # noqa: E402
+from src.bot import db  # noqa: E402
+
+SHOP_ID = 1
+BASELINE = {"journal_mode": "WAL", "foreign_keys": "ON", "busy_timeout": 5000}
+WORDS = "brass ring mug print candle scarf poster card linen oak silver vase".split()
+
+
+def _connect(path: str, pragmas: dict) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def _page(first_id: int, size: int, rng: random.Random) -> list[dict]:
+    receipts = []
+    for receipt_id in range(first_id, first_id + size):
+        title = " ".join(rng.sample(WORDS, 2)).title()
+        buyer = rng.randrange(1, size * 20)
+        receipts.append({
+            "receipt_id": receipt_id,
+            "shop_id": SHOP_ID,
+            "seller_user_id": 9,
+            "buyer_user_id": buyer,
+            "name": f"Buyer {buyer}",
+            "status": rng.choice(["paid", "paid", "completed", "canceled"]),
+            "is_paid": True,
+            "grandtotal": {"amount": rng.randrange(500, 9000), "divisor": 100, "currency_code": "USD"},
+            "create_timestamp": int(time.time()) - rng.randrange(0, 90 * 86400),
+            "transactions": [{
+                "transaction_id": receipt_id * 10,
+                "listing_id": rng.randrange(1, 200),
+                "title": title,
+                "quantity": rng.randrange(1, 4),
+                "price": {"amount": rng.randrange(500, 3000), "divisor": 100, "currency_code": "USD"},
+                "create_timestamp": 1,
+            }],
+        })
+    return receipts
+
+
+def _reads(conn: sqlite3.Connection, rng: random.Random) -> None:
+    db._sales_since(conn, SHOP_ID, int(time.time()) - 30 * 86400)
+    db._open_order_count(conn, SHOP_ID)
+    db._receipts_due_within(conn, SHOP_ID, 7 * 86400, int(time.time()))
+    conn.execute("SELECT * FROM receipts WHERE receipt_id = ?", (rng.randrange(1, 10_000),)).fetchone()
+    match = db._fts_match(SHOP_ID, rng.choice(WORDS))
+    conn.execute(
+        "SELECT rowid FROM orders_fts WHERE orders_fts MATCH ? LIMIT 25", (match,)
+    ).fetchall()
+
+
+def run(pragmas: dict, pages: int, page_size: int) -> dict:
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        writer = _connect(path, pragmas)
+        with contextlib.redirect_stdout(io.StringIO()):
+            schema.migrate(writer)
+        db._upsert_shop(writer, {"shop_id": SHOP_ID, "shop_name": "Bench", "user_id": 9})
+        reader = _connect(path, pragmas)
+        snapshot = _connect(path, pragmas)
+
+        write_ms, read_ms = [], []
+        for n in range(pages):
+            receipts = _page(n * page_size + 1, page_size, rng)
+            start = time.perf_counter()
+            writer.execute("BEGIN IMMEDIATE")
+            db._upsert_receipts(writer, receipts)
+            db._upsert_receipts_transactions(writer, receipts)
+            writer.execute("COMMIT")
+            write_ms.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            _reads(reader, rng)
+            read_ms.append((time.perf_counter() - start) * 1000)
+
+            if n == pages // 2:
+                snapshot.execute("BEGIN")
+                snapshot.execute("SELECT count(*) FROM receipts").fetchone()
+
+        wal_peak = os.path.getsize(path + "-wal")
+        snapshot.execute("COMMIT")
+        start = time.perf_counter()
+        result = db._checkpoint(writer, 0)
+        checkpoint_ms = (time.perf_counter() - start) * 1000
+        for conn in (writer, reader, snapshot):
+            conn.close()
+
+    return {
+        "write_p50": statistics.median(write_ms),
+        "write_p95": statistics.quantiles(write_ms, n=20)[18],
+        "read_p50": statistics.median(read_ms),
+        "read_p95": statistics.quantiles(read_ms, n=20)[18],
+        "total_s": (sum(write_ms) + sum(read_ms)) / 1000,
+        "wal_peak_mb": wal_peak / 1024 / 1024,
+        "checkpoint_ms": checkpoint_ms,
+        "checkpointed": result["checkpointed_frames"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=400)
+    parser.add_argument("--page-size", type=int, default=25)
+    args = parser.parse_args()
+
+    schema.configure_pragmas(os.getenv("SQLITE_PRAGMAS", ""))
+    print(f"{args.pages} pages x {args.page_size} receipts, SQLite {sqlite3.sqlite_version}")
+    print(f"{'':10} {'write p50/p95 ms':>18} {'read p50/p95 ms':>18} {'total s':>8} {'WAL MB':>7} {'ckpt ms':>8}")
+    for label, pragmas in (("baseline", BASELINE), ("profile", schema.PRAGMA_PROFILE)):
+        r = run(pragmas, args.pages, args.page_size)
+        print(
+            f"{label:10} {r['write_p50']:8.2f} / {r['write_p95']:7.2f} "
+            f"{r['read_p50']:8.2f} / {r['read_p95']:7.2f} {r['total_s']:8.2f} "
+            f"{r['wal_peak_mb']:7.1f} {r['checkpoint_ms']:8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
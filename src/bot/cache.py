@@ -0,0 +1,68 @@
+"""
+Small in-process caches with an explicit size budget.
+Used for per-guild state that would otherwise grow with every server the bot joins.
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable, Iterator, MutableMapping
+from typing import Generic, TypeVar
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class LRUDict(MutableMapping, Generic[K, V]):
+    """Dict that evicts the least recently used entry once it holds more than maxsize items.
+
+    maxsize=None means unbounded. on_evict(key, value) is called for every evicted entry,
+    e.g. to close a shop database's connections. Keys for which pinned(key) is true are
+    never evicted, e.g. those of the guilds being polled, and neither is the key just set;
+    while too many are pinned the dict holds more than maxsize items.
+    """
+
+    def __init__(
+        self,
+        maxsize: int | None = None,
+        on_evict: Callable[[K, V], None] | None = None,
+        pinned: Callable[[K], bool] | None = None,
+    ):
+        self.maxsize = maxsize
+        self.on_evict = on_evict
+        self.pinned = pinned
+        self._data: OrderedDict[K, V] = OrderedDict()
+
+    def __getitem__(self, key: K) -> V:
+        value = self._data[key]
+        self._data.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: K, value: V) -> None:
+        self._data[key] = value
+        self._data.move_to_end(key)
+        skipped = 0
+        while (
+            self.maxsize is not None
+            and len(self._data) > self.maxsize
+            and skipped < len(self._data)
+        ):
+            old_key = next(iter(self._data))
+            if old_key == key or (self.pinned and self.pinned(old_key)):
+                # Treat it as just used so the next pass starts with an unpinned key
+                self._data.move_to_end(old_key)
+                skipped += 1
+                continue
+            old_value = self._data.pop(old_key)
+            if self.on_evict:
+                self.on_evict(old_key, old_value)
+
+    def __delitem__(self, key: K) -> None:
+        del self._data[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._data
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self._data)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -3,321 +3,713 @@ SQLite persistence layer for Shopkeep bot.
 Stores shops, listings, receipts, and per-guild Etsy connections.
 """
 
+import asyncio
+import datetime
+import functools
 import json
+import os
+import pathlib
+import re
+import sqlite3
 import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+from typing import Concatenate, ParamSpec, TypeVar
 
 import aiosqlite
 
+from src import schema
+from src.bot.cache import LRUDict
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
 # Set by discord_bot.py before init_db() is called
 DB_PATH: str = "./shopkeep.db"
+# Cold archive for old orders (see copy_orders_to_archive()); attached to every connection
+# when set. Left empty, nothing is archived and history reads only see DB_PATH.
+ARCHIVE_DB_PATH: str = ""
+# Storage layout. "single" keeps everything in DB_PATH. "per_shop" keeps each shop's
+# orders, listings, reviews and rollups in SHOP_DB_DIR/<shop_id>.db, so shops never
+# wait on each other's write lock; DB_PATH then only holds guilds, tokens and settings.
+DB_LAYOUT: str = "single"
+SHOP_DB_DIR: str = "./shops"
 
-_CREATE_GUILDS = """
-CREATE TABLE IF NOT EXISTS guilds (
-    guild_id         INTEGER PRIMARY KEY,
-    guild_name       TEXT,
-    etsy_shop_id     INTEGER,
-    order_channel_id INTEGER,
-    setup_token      TEXT    UNIQUE,
-    setup_token_exp  INTEGER,
-    connected_at     INTEGER,
-    created_at       INTEGER NOT NULL
-)
-"""
+async def init_db() -> None:
+    """Bring the database schema up to date (see src/schema.py)."""
 
-_CREATE_ETSY_TOKENS = """
-CREATE TABLE IF NOT EXISTS etsy_tokens (
-    guild_id      INTEGER PRIMARY KEY REFERENCES guilds(guild_id),
-    access_token  TEXT    NOT NULL,
-    refresh_token TEXT    NOT NULL,
-    expires_at    INTEGER NOT NULL
-)
-"""
+    def _migrate() -> None:
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            schema.migrate(conn)
+        finally:
+            conn.close()
 
-_CREATE_PKCE_STATE = """
-CREATE TABLE IF NOT EXISTS pkce_state (
-    state         TEXT    PRIMARY KEY,
-    code_verifier TEXT    NOT NULL,
-    setup_token   TEXT    NOT NULL,
-    guild_id      INTEGER NOT NULL,
-    expires_at    INTEGER NOT NULL
-)
-"""
+    await asyncio.to_thread(_migrate)
 
-_CREATE_SHOPS = """
-CREATE TABLE IF NOT EXISTS shops (
-    shop_id                   INTEGER PRIMARY KEY,
-    shop_name                 TEXT    NOT NULL,
-    user_id                   INTEGER NOT NULL,
-    title                     TEXT,
-    announcement              TEXT,
-    currency_code             TEXT    NOT NULL DEFAULT 'USD',
-    is_vacation               INTEGER NOT NULL DEFAULT 0,
-    listing_active_count      INTEGER,
-    digital_listing_count     INTEGER,
-    login_name                TEXT,
-    accepts_custom_requests   INTEGER DEFAULT 0,
-    url                       TEXT,
-    num_favorers              INTEGER DEFAULT 0,
-    languages                 TEXT,
-    shop_location_country_iso TEXT,
-    create_date               INTEGER,
-    fetched_at                INTEGER NOT NULL
-)
-"""
 
-_CREATE_LISTINGS = """
-CREATE TABLE IF NOT EXISTS listings (
-    listing_id              INTEGER PRIMARY KEY,
-    shop_id                 INTEGER NOT NULL REFERENCES shops(shop_id),
-    user_id                 INTEGER NOT NULL,
-    title                   TEXT    NOT NULL,
-    description             TEXT,
-    state                   TEXT    NOT NULL DEFAULT 'active',
-    quantity                INTEGER NOT NULL DEFAULT 0,
-    url                     TEXT,
-    num_favorers            INTEGER DEFAULT 0,
-    is_customizable         INTEGER DEFAULT 0,
-    is_personalizable       INTEGER DEFAULT 0,
-    listing_type            TEXT,
-    tags                    TEXT,
-    materials               TEXT,
-    price_amount            INTEGER NOT NULL,
-    price_divisor           INTEGER NOT NULL DEFAULT 100,
-    price_currency_code     TEXT    NOT NULL DEFAULT 'USD',
-    views                   INTEGER DEFAULT 0,
-    is_digital              INTEGER DEFAULT 0,
-    who_made                TEXT,
-    when_made               TEXT,
-    creation_timestamp      INTEGER,
-    last_modified_timestamp INTEGER,
-    image_url               TEXT,
-    fetched_at              INTEGER NOT NULL
-)
-"""
+# ── Connection pool ───────────────────────────────────────────────────────────
 
-_CREATE_SHIPPING_PRESETS = """
-CREATE TABLE IF NOT EXISTS shipping_presets (
-    id           INTEGER PRIMARY KEY AUTOINCREMENT,
-    guild_id     INTEGER NOT NULL REFERENCES guilds(guild_id),
-    name         TEXT    NOT NULL,
-    carrier      TEXT    NOT NULL,
-    mail_class   TEXT    NOT NULL,
-    package_type TEXT    NOT NULL DEFAULT '',
-    weight_oz    REAL    NOT NULL,
-    length_in    REAL    NOT NULL,
-    width_in     REAL    NOT NULL,
-    height_in    REAL    NOT NULL,
-    created_at   INTEGER NOT NULL,
-    UNIQUE(guild_id, name)
-)
-"""
+class _Connection(aiosqlite.Connection):
+    """An aiosqlite connection that keeps its sqlite3 connection at hand for run()."""
 
-_CREATE_SHIPPO_KEYS = """
-CREATE TABLE IF NOT EXISTS shippo_keys (
-    guild_id     INTEGER PRIMARY KEY REFERENCES guilds(guild_id),
-    api_key      TEXT    NOT NULL,
-    addr_name    TEXT,
-    addr_street1 TEXT,
-    addr_street2 TEXT,
-    addr_city    TEXT,
-    addr_state   TEXT,
-    addr_zip     TEXT,
-    addr_country TEXT    NOT NULL DEFAULT 'US',
-    addr_phone   TEXT,
-    created_at   INTEGER NOT NULL
-)
-"""
+    def __init__(self, database: str, **kwargs):
+        self.sqlite: sqlite3.Connection | None = None
 
-_CREATE_RECEIPTS = """
-CREATE TABLE IF NOT EXISTS receipts (
-    receipt_id            INTEGER PRIMARY KEY,
-    shop_id               INTEGER NOT NULL REFERENCES shops(shop_id),
-    receipt_type          INTEGER NOT NULL DEFAULT 0,
-    seller_user_id        INTEGER NOT NULL,
-    buyer_user_id         INTEGER,
-    buyer_email           TEXT,
-    name                  TEXT,
-    first_line            TEXT,
-    second_line           TEXT,
-    city                  TEXT,
-    state                 TEXT,
-    zip                   TEXT,
-    country_iso           TEXT,
-    status                TEXT    NOT NULL,
-    payment_method        TEXT,
-    is_paid               INTEGER NOT NULL DEFAULT 0,
-    is_shipped            INTEGER NOT NULL DEFAULT 0,
-    is_gift               INTEGER NOT NULL DEFAULT 0,
-    gift_message          TEXT,
-    grandtotal_amount     INTEGER NOT NULL,
-    grandtotal_divisor    INTEGER NOT NULL DEFAULT 100,
-    grandtotal_currency   TEXT    NOT NULL DEFAULT 'USD',
-    subtotal_amount       INTEGER,
-    total_shipping_amount INTEGER,
-    total_tax_amount      INTEGER,
-    discount_amount       INTEGER DEFAULT 0,
-    create_timestamp      INTEGER NOT NULL,
-    update_timestamp      INTEGER,
-    expected_ship_date    INTEGER,
-    fetched_at            INTEGER NOT NULL,
-    notified_at           INTEGER
-)
-"""
+        def connector() -> sqlite3.Connection:
+            # run() uses it from its own worker thread, never while aiosqlite is
+            self.sqlite = sqlite3.connect(database, check_same_thread=False, **kwargs)
+            return self.sqlite
 
-_CREATE_SHIPPING_REMINDERS = """
-CREATE TABLE IF NOT EXISTS shipping_reminders (
-    receipt_id  INTEGER NOT NULL REFERENCES receipts(receipt_id),
-    days_before INTEGER NOT NULL,
-    sent_at     INTEGER NOT NULL,
-    PRIMARY KEY (receipt_id, days_before)
-)
-"""
+        super().__init__(connector, iter_chunk_size=64)
 
-_CREATE_TRANSACTIONS = """
-CREATE TABLE IF NOT EXISTS transactions (
-    transaction_id      INTEGER PRIMARY KEY,
-    receipt_id          INTEGER NOT NULL REFERENCES receipts(receipt_id),
-    shop_id             INTEGER NOT NULL REFERENCES shops(shop_id),
-    listing_id          INTEGER,
-    title               TEXT,
-    quantity            INTEGER NOT NULL DEFAULT 1,
-    price_amount        INTEGER NOT NULL DEFAULT 0,
-    price_divisor       INTEGER NOT NULL DEFAULT 100,
-    price_currency      TEXT    NOT NULL DEFAULT 'USD',
-    create_timestamp    INTEGER NOT NULL,
-    image_url           TEXT,
-    selected_variations  TEXT,
-    personalization_msg  TEXT,
-    fetched_at           INTEGER NOT NULL
-)
-"""
 
-_CREATE_REVIEWS = """
-CREATE TABLE IF NOT EXISTS reviews (
-    transaction_id   INTEGER PRIMARY KEY,
-    shop_id          INTEGER NOT NULL REFERENCES shops(shop_id),
-    listing_id       INTEGER,
-    buyer_user_id    INTEGER,
-    rating           INTEGER NOT NULL,
-    review           TEXT,
-    language         TEXT,
-    image_url        TEXT,
-    create_timestamp INTEGER NOT NULL,
-    update_timestamp INTEGER,
-    fetched_at       INTEGER NOT NULL,
-    notified_at      INTEGER
-)
-"""
+async def _connect(
+    path: str | None = None, archive_path: str | None = None, read_only: bool = False
+) -> aiosqlite.Connection:
+    """Open a connection and apply the per-connection settings (schema.PRAGMA_PROFILE) once.
 
+    Defaults to DB_PATH with ARCHIVE_DB_PATH attached; shop databases pass their own.
+    read_only opens the files with mode=ro and sets query_only, for get_read_db().
+    """
+    if path is None:
+        path = DB_PATH
+        archive_path = ARCHIVE_DB_PATH if DB_LAYOUT != "per_shop" else ""
+    if not read_only:
+        conn = await _Connection(path)
+        await run(conn, schema.apply_pragmas)
+        if archive_path:
+            await run(conn, schema.attach_archive, archive_path)
+    else:
+        conn = await _Connection(_read_only_uri(path), uri=True)
+        await run(conn, schema.apply_pragmas)
+        await conn.execute("PRAGMA query_only=ON")
+        # The archive's tables are created by read-write connections; until one has,
+        # there is nothing to read from it
+        if archive_path and os.path.exists(archive_path):
+            await conn.execute("ATTACH DATABASE ? AS archive", (_read_only_uri(archive_path),))
+    conn.row_factory = aiosqlite.Row
+    return conn
+
+
+def _read_only_uri(path: str) -> str:
+    return pathlib.Path(path).absolute().as_uri() + "?mode=ro"
+
+
+# How long the writer waits for more jobs before committing a batch, and the
+# most jobs it folds into one transaction
+WRITE_BATCH_WINDOW_SECS = 0.02
+WRITE_BATCH_MAX = 100
+
+
+class _Writer:
+    """Single writer task that applies queued write jobs with group commit.
+
+    Jobs are `async fn(conn, *args)` coroutines that must not commit. The writer
+    collects whatever arrives within WRITE_BATCH_WINDOW_SECS, runs the batch in one
+    BEGIN IMMEDIATE transaction with a SAVEPOINT per job, and commits once. A job
+    that raises is rolled back to its savepoint and its caller gets the exception;
+    the rest of the batch still commits.
+    """
 
-async def init_db() -> None:
-    """Create all tables if they don't exist."""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("PRAGMA journal_mode=WAL")
-        await db.execute("PRAGMA foreign_keys=ON")
-        await db.execute(_CREATE_GUILDS)
-        await db.execute(_CREATE_ETSY_TOKENS)
-        await db.execute(_CREATE_PKCE_STATE)
-        await db.execute(_CREATE_SHOPS)
-        await db.execute(_CREATE_LISTINGS)
-        await db.execute(_CREATE_RECEIPTS)
-        await db.execute(_CREATE_SHIPPING_PRESETS)
-        await db.execute(_CREATE_SHIPPING_REMINDERS)
-        await db.execute(_CREATE_TRANSACTIONS)
-        await db.execute(_CREATE_REVIEWS)
-        await db.execute(_CREATE_SHIPPO_KEYS)
-        try:
-            await db.execute("ALTER TABLE shippo_keys ADD COLUMN addr_phone TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE listings ADD COLUMN image_url TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE receipts ADD COLUMN expected_ship_date INTEGER")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN ship_reminder_days TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN ship_reminder_time TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN ship_reminder_tz TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN backlog_threshold INTEGER")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN backlog_warned INTEGER NOT NULL DEFAULT 0")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN digest_time TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN digest_tz TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN digest_last_sent INTEGER")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN goal_amount INTEGER")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN goal_milestones_sent TEXT")
-        except Exception:
-            pass  # column already exists
-        try:
-            await db.execute("ALTER TABLE guilds ADD COLUMN goal_month TEXT")
-        except Exception:
-            pass  # column already exists
+    def __init__(self, conn: aiosqlite.Connection):
+        self.conn = conn
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+
+    def submit(self, fn, args: tuple) -> asyncio.Future:
+        if self.task.done():
+            raise RuntimeError("database writer is not running")
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((fn, args, future))
+        return future
+
+    async def close(self) -> None:
+        self.queue.put_nowait(None)
+        await self.task
+
+    async def _run(self) -> None:
+        while True:
+            job = await self.queue.get()
+            if job is None:
+                return
+            await asyncio.sleep(WRITE_BATCH_WINDOW_SECS)
+            batch = [job]
+            stopping = False
+            while len(batch) < WRITE_BATCH_MAX and not self.queue.empty():
+                job = self.queue.get_nowait()
+                if job is None:
+                    stopping = True
+                    break
+                batch.append(job)
+            try:
+                await self._apply(batch)
+            except Exception as exc:
+                # _apply resolves its futures itself; never let one bad batch
+                # take the writer down with every later write() stuck behind it.
+                print(f"[db] writer error, continuing: {exc}")
+            if stopping:
+                return
+
+    async def _apply(self, batch: list) -> None:
+        conn = self.conn
+        outcomes: list[tuple[asyncio.Future, object, Exception | None]] = []
+        failure: Exception | None = None
         try:
-            await db.execute("ALTER TABLE transactions ADD COLUMN selected_variations TEXT")
-        except Exception:
-            pass  # column already exists
+            if conn.in_transaction:
+                # A previous batch's rollback failed; clear it before starting anew
+                await conn.rollback()
+            await conn.execute("BEGIN IMMEDIATE")
+            for fn, args, future in batch:
+                if future.cancelled():
+                    continue
+                await conn.execute("SAVEPOINT write_job")
+                try:
+                    result = await fn(conn, *args)
+                except Exception as exc:
+                    await conn.execute("ROLLBACK TO write_job")
+                    outcomes.append((future, None, exc))
+                else:
+                    outcomes.append((future, result, None))
+                await conn.execute("RELEASE write_job")
+            await conn.commit()
+        except Exception as exc:
+            failure = exc
+            print(f"[db] write batch of {len(batch)} failed: {exc}")
+            try:
+                if conn.in_transaction:
+                    await conn.rollback()
+            except Exception as rollback_exc:
+                print(f"[db] rollback after failed batch also failed: {rollback_exc}")
+        finally:
+            if failure is None:
+                for future, result, job_exc in outcomes:
+                    if future.done():
+                        continue
+                    if job_exc is not None:
+                        future.set_exception(job_exc)
+                    else:
+                        future.set_result(result)
+            error = failure or RuntimeError("write batch was interrupted")
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+
+
+# Temporary connections a pool may open on top of its own when all are checked
+# out, and how long a caller then waits for one to come free before giving up
+POOL_OVERFLOW = 8
+POOL_TIMEOUT_SECS = 30
+
+
+class _ConnectionPool:
+    """A fixed set of long-lived connections plus one dedicated writer.
+
+    Connections are opened and configured once. When every pooled connection is
+    checked out, get_db() opens a temporary overflow connection instead of waiting,
+    so nested get_db() calls don't deadlock; at most POOL_OVERFLOW of those are
+    open at once, after which callers wait. All writes go through the writer (see
+    write()). `readers` are read-only connections for get_read_db().
+    """
+
+    def __init__(
+        self,
+        conns: list[aiosqlite.Connection],
+        writer: _Writer,
+        readers: list[aiosqlite.Connection] | None = None,
+    ):
+        self.idle = conns
+        self.writer = writer
+        self.readers = readers or []
+        self.slots = asyncio.Semaphore(len(self.idle) + POOL_OVERFLOW)
+        self.reader_slots = asyncio.Semaphore(len(self.readers) + POOL_OVERFLOW)
+
+
+_pool: _ConnectionPool | None = None
+
+
+async def open_pool(size: int = 4, readers: int = 4) -> None:
+    """Open the shared connection pool and start the writer. Call once at startup,
+    after init_db()."""
+    global _pool, _shop_pools, _shop_pools_lock
+    if _pool is not None:
+        return
+    conns = [await _connect() for _ in range(size)]
+    writer = _Writer(await _connect())
+    _pool = _ConnectionPool(conns, writer, [await _connect(read_only=True) for _ in range(readers)])
+    _shop_pools = LRUDict(
+        SHOP_DB_CACHE_SIZE,
+        on_evict=_evict_shop_pool,
+        pinned=lambda shop_id: shop_id in _pinned_shops,
+    )
+    _shop_pools_lock = asyncio.Lock()
+
+
+async def close_pool() -> None:
+    global _pool, _shop_pools
+    pool, _pool = _pool, None
+    shop_pools, _shop_pools = _shop_pools, None
+    if pool is None:
+        return
+    assert shop_pools is not None  # opened together with _pool
+    for shop_id in list(shop_pools):
+        await _close_connections(shop_pools[shop_id])
+    await asyncio.gather(*_closing)
+    await _close_connections(pool)
+
+
+async def _close_connections(pool: _ConnectionPool) -> None:
+    await pool.writer.close()  # flushes jobs already queued
+    # Lets SQLite re-analyze tables whose size has shifted since the last ANALYZE,
+    # judged by the queries this connection ran
+    await pool.writer.conn.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+    await pool.writer.conn.execute("PRAGMA optimize")
+    for conn in [*pool.idle, *pool.readers, pool.writer.conn]:
+        await conn.close()
+
+
+async def _release(conn: aiosqlite.Connection) -> None:
+    # Never hand the next caller a connection with a half-finished transaction;
+    # uncommitted work is discarded exactly as closing a connection would.
+    if conn.in_transaction:
+        await conn.rollback()
+
+
+@asynccontextmanager
+async def _checkout(free: list, slots: asyncio.Semaphore, connect, still_pooled):
+    # Take a connection from `free`, or open an overflow one if it is empty; `slots`
+    # caps how many are out at once. still_pooled() says whether the pool is still
+    # the live one when the connection comes back.
+    try:
+        await asyncio.wait_for(slots.acquire(), POOL_TIMEOUT_SECS)
+    except asyncio.TimeoutError:
+        raise RuntimeError(
+            f"no database connection came free within {POOL_TIMEOUT_SECS}s"
+        ) from None
+    try:
+        if not free:
+            conn = await connect()
+            try:
+                yield conn
+            finally:
+                await conn.close()
+            return
+
+        conn = free.pop()
         try:
-            await db.execute("ALTER TABLE transactions ADD COLUMN personalization_msg TEXT")
-        except Exception:
-            pass  # column already exists
+            yield conn
+        finally:
+            await _release(conn)
+            if still_pooled():
+                free.append(conn)
+            else:
+                await conn.close()  # pool closed or evicted while this connection was out
+    finally:
+        slots.release()
+
+
+@asynccontextmanager
+async def get_db():
+    """Yield a WAL-mode connection with foreign keys enabled and Row factory set.
+
+    Uses the shared pool when open_pool() has been called, otherwise opens a
+    one-off connection. Writes belong in write(), not here.
+    """
+    pool = _pool
+    if pool is None:
+        conn = await _connect()
         try:
-            await db.execute("ALTER TABLE receipts ADD COLUMN first_line TEXT")
-        except Exception:
-            pass  # column already exists
+            yield conn
+        finally:
+            await conn.close()
+        return
+
+    async with _checkout(pool.idle, pool.slots, _connect, lambda: _pool is pool) as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def get_read_db(shop_id: int | None = None):
+    """Yield a read-only connection holding one snapshot for the whole block.
+
+    For interactive reads (slash commands, autocompletes): the connection is opened
+    with mode=ro and query_only, so it never takes the write lock or waits on the
+    writer, and every query in the block sees the same committed state. With a
+    shop_id it reads that shop's database (see get_shop_db()). Overflow and no-pool
+    behaviour match get_db().
+    """
+    pool = _pool
+    if shop_id is not None and DB_LAYOUT == "per_shop":
+        pool = await _open_shop_pool(shop_id)
+        if pool is None:
+            await _migrate_shop(shop_id)
+        connect = functools.partial(
+            _connect, shop_db_path(shop_id), _shop_archive_path(shop_id), read_only=True
+        )
+    else:
+        connect = functools.partial(_connect, read_only=True)
+
+    if pool is None:
+        conn = await connect()
         try:
-            await db.execute("ALTER TABLE receipts ADD COLUMN second_line TEXT")
-        except Exception:
-            pass  # column already exists
+            await conn.execute("BEGIN")
+            yield conn
+        finally:
+            await conn.close()
+        return
+
+    def still_pooled() -> bool:
+        shop_pools = _shop_pools
+        return pool is _pool or (
+            shop_id is not None
+            and shop_pools is not None
+            and shop_id in shop_pools
+            and shop_pools[shop_id] is pool
+        )
+
+    async with _checkout(pool.readers, pool.reader_slots, connect, still_pooled) as conn:
+        await conn.execute("BEGIN")
+        yield conn
+
+
+async def write(fn, *args, **kwargs):
+    """Run `await fn(conn, *args, **kwargs)` as one job on the writer and return its result.
+
+    fn must not commit: the writer commits it together with other jobs queued in
+    the same window. Never call write() from inside a job. Without a pool (tests,
+    scripts) the job runs on a one-off connection and is committed on its own.
+    """
+    pool = _pool
+    if pool is None:
+        async with get_db() as conn:
+            result = await fn(conn, *args, **kwargs)
+            await conn.commit()
+            return result
+    if kwargs:
+        fn = functools.partial(fn, **kwargs)
+    return await pool.writer.submit(fn, args)
+
+
+# ── Per-shop databases ────────────────────────────────────────────────────────
+
+# Most shop databases kept open at once besides the pinned ones; the least recently
+# used is closed past this
+SHOP_DB_CACHE_SIZE = 64
+
+# shop_id -> that shop's readers and writer, while the pool is open
+_shop_pools: LRUDict[int, _ConnectionPool] | None = None
+_shop_pools_lock: asyncio.Lock | None = None
+# Shop databases already migrated by this process
+_migrated_shops: set[int] = set()
+# Evicted shop pools still flushing their writer
+_closing: set[asyncio.Task] = set()
+# Shops whose pools are never evicted; see pin_shops()
+_pinned_shops: set[int] = set()
+
+
+def pin_shops(shop_ids: Iterable[int]) -> None:
+    """Keep the pools of shop_ids open however many other shops are opened.
+
+    The bot pins the shops it polls, since evicting one would close and reopen its
+    database (and PRAGMA optimize it) every poll cycle; SHOP_DB_CACHE_SIZE then only
+    bounds the rest. Replaces the previously pinned set.
+    """
+    global _pinned_shops
+    _pinned_shops = set(shop_ids)
+
+
+def shop_db_path(shop_id: int) -> str:
+    return os.path.join(SHOP_DB_DIR, f"{shop_id}.db")
+
+
+def _shop_archive_path(shop_id: int) -> str:
+    # Archiving is switched on by ARCHIVE_DB_PATH; each shop keeps its own cold file
+    return os.path.join(SHOP_DB_DIR, f"{shop_id}-archive.db") if ARCHIVE_DB_PATH else ""
+
+
+async def _migrate_shop(shop_id: int) -> None:
+    if shop_id in _migrated_shops:
+        return
+
+    def _migrate() -> None:
+        os.makedirs(SHOP_DB_DIR, exist_ok=True)
+        conn = sqlite3.connect(shop_db_path(shop_id))
         try:
-            await db.execute(
-                "ALTER TABLE shipping_presets ADD COLUMN package_type TEXT NOT NULL DEFAULT ''"
+            schema.migrate(conn)
+        finally:
+            conn.close()
+
+    await asyncio.to_thread(_migrate)
+    _migrated_shops.add(shop_id)
+
+
+async def _connect_shop(shop_id: int, read_only: bool = False) -> aiosqlite.Connection:
+    await _migrate_shop(shop_id)
+    return await _connect(shop_db_path(shop_id), _shop_archive_path(shop_id), read_only)
+
+
+def _evict_shop_pool(shop_id: int, shop: _ConnectionPool) -> None:
+    task = asyncio.create_task(_close_connections(shop))
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+async def _open_shop_pool(shop_id: int) -> _ConnectionPool | None:
+    """Return shop_id's pool, opening it (and evicting the LRU one) if needed.
+
+    None when the main pool isn't open; callers then use one-off connections.
+    """
+    shop_pools, lock = _shop_pools, _shop_pools_lock
+    if shop_pools is None or lock is None:
+        return None
+    shop: _ConnectionPool | None = shop_pools.get(shop_id)
+    if shop is not None:
+        return shop
+    async with lock:
+        shop = shop_pools.get(shop_id)
+        if shop is None:
+            shop = _ConnectionPool(
+                [await _connect_shop(shop_id)],
+                _Writer(await _connect_shop(shop_id)),
+                [await _connect_shop(shop_id, read_only=True)],
             )
-        except Exception:
-            pass  # column already exists
-        await db.commit()
+            shop_pools[shop_id] = shop
+    return shop
 
 
 @asynccontextmanager
-async def get_db():
-    """Open a WAL-mode connection with foreign keys enabled and Row factory set."""
-    async with aiosqlite.connect(DB_PATH) as conn:
-        await conn.execute("PRAGMA journal_mode=WAL")
-        await conn.execute("PRAGMA foreign_keys=ON")
-        conn.row_factory = aiosqlite.Row
+async def get_shop_db(shop_id: int):
+    """Yield a connection to the database holding shop_id's orders, listings and reviews.
+
+    That is get_db() in the single layout. In the per_shop layout the shop's own file
+    is opened on first use and kept, with its writer, in an LRU of SHOP_DB_CACHE_SIZE
+    shops plus the pinned ones (pin_shops()). Writes belong in write_shop().
+    """
+    if DB_LAYOUT != "per_shop":
+        async with get_db() as conn:
+            yield conn
+        return
+
+    shop = await _open_shop_pool(shop_id)
+    if shop is None:
+        conn = await _connect_shop(shop_id)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+        return
+
+    def still_pooled() -> bool:
+        shop_pools = _shop_pools
+        return shop_pools is not None and shop_id in shop_pools and shop_pools[shop_id] is shop
+
+    async with _checkout(
+        shop.idle, shop.slots, functools.partial(_connect_shop, shop_id), still_pooled
+    ) as conn:
         yield conn
 
 
+async def write_shop(shop_id: int, fn, *args, **kwargs):
+    """Like write(), but for jobs touching shop_id's data.
+
+    In the per_shop layout every shop has its own writer, so jobs for different
+    shops commit in parallel.
+    """
+    if DB_LAYOUT != "per_shop":
+        return await write(fn, *args, **kwargs)
+    shop = await _open_shop_pool(shop_id)
+    if shop is None:
+        async with get_shop_db(shop_id) as conn:
+            result = await fn(conn, *args, **kwargs)
+            await conn.commit()
+            return result
+    if kwargs:
+        fn = functools.partial(fn, **kwargs)
+    return await shop.writer.submit(fn, args)
+
+
+async def drop_shop_database(shop_id: int) -> bool:
+    """Delete shop_id's database files once no guild is connected to the shop.
+
+    Only the per_shop layout has files to delete; returns True if they were removed.
+    Call after disconnect_guild() has committed.
+    """
+    if DB_LAYOUT != "per_shop":
+        return False
+    async with get_db() as conn:
+        cursor = await conn.execute("SELECT 1 FROM guilds WHERE etsy_shop_id = ?", (shop_id,))
+        if await cursor.fetchone():
+            return False
+    if _shop_pools is not None and shop_id in _shop_pools:
+        shop = _shop_pools[shop_id]
+        del _shop_pools[shop_id]
+        await _close_connections(shop)
+    _migrated_shops.discard(shop_id)
+    removed = False
+    for path in (shop_db_path(shop_id), _shop_archive_path(shop_id)):
+        for suffix in ("", "-wal", "-shm"):
+            if path and os.path.exists(path + suffix):
+                os.remove(path + suffix)
+                removed = True
+    return removed
+
+
+# ── WAL checkpoints ───────────────────────────────────────────────────────────
+
+def _checkpoint(conn: sqlite3.Connection, truncate_above: int) -> dict:
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    try:
+        wal_bytes = os.path.getsize(path + "-wal")
+    except OSError:
+        wal_bytes = 0
+    mode = "TRUNCATE" if wal_bytes > truncate_above else "PASSIVE"
+    busy, log_frames, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    return {
+        "path": path,
+        "mode": mode,
+        "wal_bytes": wal_bytes,
+        "busy": bool(busy),
+        "log_frames": log_frames,
+        "checkpointed_frames": checkpointed,
+    }
+
+
+async def checkpoint_databases(truncate_above: int) -> list[dict]:
+    """Checkpoint the WAL of DB_PATH and of every shop database currently open.
+
+    A PASSIVE checkpoint copies what it can without waiting on anyone. Once a WAL
+    has grown past truncate_above bytes (readers kept SQLite's automatic checkpoints
+    from catching up), a TRUNCATE checkpoint waits up to busy_timeout for them and
+    shrinks the file back to zero. Returns one dict per database: path, mode,
+    wal_bytes (before), busy, log_frames and checkpointed_frames.
+    """
+    results = []
+    async with get_db() as conn:
+        results.append(await run(conn, _checkpoint, truncate_above))
+    for shop_id in list(_shop_pools or ()):
+        async with get_shop_db(shop_id) as conn:
+            results.append(await run(conn, _checkpoint, truncate_above))
+    return results
+
+
+# ── Maintenance ───────────────────────────────────────────────────────────────
+
+# Rows ANALYZE samples per index, which keeps it fast however large the tables get
+ANALYSIS_LIMIT = 1000
+# Conservative VACUUM throughput, used to tell whether a one-off conversion fits the budget
+VACUUM_BYTES_PER_SEC = 20 * 1024 * 1024
+
+def _storage_stats(conn: sqlite3.Connection) -> dict:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return {
+        "path": conn.execute("PRAGMA database_list").fetchone()[2],
+        "bytes": conn.execute("PRAGMA page_count").fetchone()[0] * page_size,
+        "free_bytes": conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size,
+    }
+
+
+def _analyze(conn: sqlite3.Connection, analysis_limit: int) -> None:
+    """Refresh the query planner's statistics, sampling at most analysis_limit rows per index.
+
+    Without them SQLite guesses, and e.g. get_buyer_orders() walks every receipt
+    of the shop instead of starting from the buyer. Runs daily (maintain_databases()).
+    """
+    conn.execute(f"PRAGMA analysis_limit={int(analysis_limit)}")
+    conn.execute("ANALYZE")
+
+
+def _incremental_vacuum(conn: sqlite3.Connection, pages: int) -> int:
+    free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+    # incremental_vacuum frees one page per step, and sqlite3 only steps a statement
+    # without result columns once, so free them one statement at a time
+    for _ in range(min(pages, free)):
+        conn.execute("PRAGMA incremental_vacuum(1)")
+    return int(free - conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+
+async def _run_job(
+    conn: aiosqlite.Connection,
+    fn: Callable[Concatenate[sqlite3.Connection, P], T],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> T:
+    return await run(conn, fn, *args, **kwargs)
+
+
+def _enable_incremental_vacuum(path: str, budget_secs: float) -> bool:
+    # VACUUM can't run inside the writer's transaction, so it gets its own connection
+    if not os.path.exists(path):
+        return False
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        schema.apply_pragmas(conn)
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        # The VACUUM holds the write lock until it finishes, and the writer's batches
+        # give up after busy_timeout, so only start one that fits what's left
+        size = os.path.getsize(path)
+        if size > budget_secs * VACUUM_BYTES_PER_SEC:
+            print(
+                f"[maintenance] Skipped enabling incremental vacuum on {os.path.basename(path)}: "
+                f"{size / 1024 / 1024:.1f} MB needs ~{size / VACUUM_BYTES_PER_SEC:.0f}s, "
+                f"{budget_secs:.0f}s left"
+            )
+            return False
+        return schema.enable_incremental_vacuum(conn)
+    finally:
+        conn.close()
+
+
+async def maintain_databases(
+    shop_ids: list[int],
+    budget_secs: float,
+    analysis_limit: int = ANALYSIS_LIMIT,
+    vacuum_pages: int = 256,
+) -> list[dict]:
+    """Refresh planner statistics and give free pages back to the filesystem.
+
+    Runs on DB_PATH and, in the per_shop layout, on each of shop_ids. Every step is
+    a separate write job of bounded size, so polling writes interleave with it:
+    ANALYZE, sampling at most analysis_limit rows per index, then incremental_vacuum
+    in chunks of vacuum_pages until the freelist is empty or budget_secs have
+    passed; databases not reached by then wait for the next run. A database created
+    before auto_vacuum was set is first switched over with one full VACUUM (see
+    schema.enable_incremental_vacuum()), but only if the remaining budget covers
+    the file at VACUUM_BYTES_PER_SEC; otherwise it is skipped with a log line and
+    the database keeps its free pages. Returns one dict per database: path, bytes
+    and free_bytes before and after, and seconds taken.
+    """
+    targets = [(DB_PATH, write)]
+    if DB_LAYOUT == "per_shop":
+        targets += [
+            (shop_db_path(shop_id), functools.partial(write_shop, shop_id))
+            for shop_id in shop_ids
+        ]
+    deadline = time.monotonic() + budget_secs
+    results = []
+    for path, writer in targets:
+        if time.monotonic() >= deadline:
+            break
+        start = time.monotonic()
+        await asyncio.to_thread(_enable_incremental_vacuum, path, deadline - start)
+        before = await writer(_run_job, _storage_stats)
+        await writer(_run_job, _analyze, analysis_limit)
+        while time.monotonic() < deadline:
+            if not await writer(_run_job, _incremental_vacuum, vacuum_pages):
+                break
+        after = await writer(_run_job, _storage_stats)
+        results.append({
+            "path": before["path"],
+            "bytes_before": before["bytes"],
+            "free_bytes_before": before["free_bytes"],
+            "bytes_after": after["bytes"],
+            "free_bytes_after": after["free_bytes"],
+            "seconds": time.monotonic() - start,
+        })
+    return results
+
+
 # ── Guild helpers ─────────────────────────────────────────────────────────────
 
 async def create_guild(
@@ -337,9 +729,57 @@ async def create_guild(
     )
 
 
+async def create_guilds(db: aiosqlite.Connection, guilds: list[tuple]) -> None:
+    """Insert many guild rows in one statement (ignores existing).
+
+    guilds is a list of (guild_id, guild_name, setup_token, setup_token_exp) tuples.
+    """
+    now = int(time.time())
+    await db.executemany(
+        """
+        INSERT OR IGNORE INTO guilds (guild_id, guild_name, setup_token, setup_token_exp, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [(*g, now) for g in guilds],
+    )
+
+
+async def get_guild_ids(db: aiosqlite.Connection) -> set[int]:
+    """Return the IDs of every guild the bot has a row for."""
+    rows = await db.execute_fetchall("SELECT guild_id FROM guilds")
+    return {row[0] for row in rows}
+
+
 async def get_guild(db: aiosqlite.Connection, guild_id: int) -> aiosqlite.Row | None:
-    cursor = await db.execute("SELECT * FROM guilds WHERE guild_id = ?", (guild_id,))
-    return await cursor.fetchone()
+    return await run(db, _get_guild, guild_id)
+
+
+def _get_guild(conn: sqlite3.Connection, guild_id: int) -> sqlite3.Row | None:
+    cursor = conn.execute("SELECT * FROM guilds WHERE guild_id = ?", (guild_id,))
+    row: sqlite3.Row | None = cursor.fetchone()
+    return row
+
+
+async def get_guild_overview(db: aiosqlite.Connection, guild_id: int) -> dict | None:
+    """Load a guild with its feature configs in a single thread hop (for /status).
+
+    Returns None for unknown guilds, otherwise a dict with keys: guild, reminders,
+    backlog, digest, goal. The shop itself lives in the shop's database (get_shop()).
+    """
+    return await run(db, _guild_overview, guild_id)
+
+
+def _guild_overview(conn: sqlite3.Connection, guild_id: int) -> dict | None:
+    guild = _get_guild(conn, guild_id)
+    if guild is None:
+        return None
+    return {
+        "guild": guild,
+        "reminders": _reminder_config(conn, guild_id),
+        "backlog": _backlog_config(conn, guild_id),
+        "digest": _digest_config(conn, guild_id),
+        "goal": _goal_config(conn, guild_id),
+    }
 
 
 async def get_guild_by_setup_token(
@@ -351,14 +791,26 @@ async def get_guild_by_setup_token(
     return await cursor.fetchone()
 
 
-async def get_connected_guilds(db: aiosqlite.Connection) -> list:
-    """Return all guilds that have a connected Etsy shop and an order channel set."""
-    cursor = await db.execute(
-        """
+async def get_connected_guilds(
+    db: aiosqlite.Connection,
+    shard_count: int | None = None,
+    shard_ids: list[int] | None = None,
+) -> list:
+    """Return all guilds that have a connected Etsy shop and an order channel set.
+
+    When shard_count and shard_ids are given, only guilds owned by those shards are
+    returned, using Discord's (guild_id >> 22) % shard_count mapping.
+    """
+    sql = """
         SELECT * FROM guilds
         WHERE etsy_shop_id IS NOT NULL AND order_channel_id IS NOT NULL
         """
-    )
+    params: list = []
+    if shard_count and shard_ids is not None:
+        placeholders = ",".join("?" * len(shard_ids)) or "NULL"
+        sql += f" AND ((guild_id >> 22) % ?) IN ({placeholders})"
+        params = [shard_count, *shard_ids]
+    cursor = await db.execute(sql, params)
     return await cursor.fetchall()
 
 
@@ -394,6 +846,24 @@ async def update_guild_channel(
     )
 
 
+# ── Bot state helpers ─────────────────────────────────────────────────────────
+
+async def get_bot_state(db: aiosqlite.Connection, key: str) -> str | None:
+    cursor = await db.execute("SELECT value FROM bot_state WHERE key = ?", (key,))
+    row = await cursor.fetchone()
+    return row[0] if row else None
+
+
+async def set_bot_state(db: aiosqlite.Connection, key: str, value: str) -> None:
+    await db.execute(
+        """
+        INSERT INTO bot_state (key, value, updated_at) VALUES (?, ?, ?)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        """,
+        (key, value, int(time.time())),
+    )
+
+
 # ── Etsy token helpers ────────────────────────────────────────────────────────
 
 async def get_guild_tokens(
@@ -419,7 +889,58 @@ async def save_guild_tokens(
         """,
         (guild_id, access_token, refresh_token, expires_at),
     )
-    await db.commit()
+
+
+async def connect_guild(
+    db: aiosqlite.Connection,
+    guild_id: int,
+    etsy_shop_id: int,
+    access_token: str,
+    refresh_token: str,
+    expires_at: int,
+) -> None:
+    """Store the tokens and shop from a finished OAuth flow (both or neither, in write()).
+
+    Also records a guild event, so a bot process picks the connection up at once.
+    """
+    await save_guild_tokens(db, guild_id, access_token, refresh_token, expires_at)
+    await update_guild_etsy(db, guild_id, etsy_shop_id)
+    await add_guild_event(db, guild_id)
+
+
+# ── Guild event helpers ───────────────────────────────────────────────────────
+# guild_events is an outbox: the web server adds a row in the same transaction as
+# the change, and the bot reads whatever is newer than the last event_id it saw.
+
+async def add_guild_event(db: aiosqlite.Connection, guild_id: int) -> None:
+    await db.execute(
+        "INSERT INTO guild_events (guild_id, created_at) VALUES (?, ?)",
+        (guild_id, int(time.time())),
+    )
+
+
+async def get_guild_events(
+    db: aiosqlite.Connection, after_event_id: int, limit: int = 100
+) -> list:
+    """Return up to `limit` events newer than after_event_id, oldest first."""
+    cursor = await db.execute(
+        "SELECT * FROM guild_events WHERE event_id > ? ORDER BY event_id LIMIT ?",
+        (after_event_id, limit),
+    )
+    return await cursor.fetchall()
+
+
+async def get_last_guild_event_id(db: aiosqlite.Connection) -> int:
+    cursor = await db.execute("SELECT COALESCE(MAX(event_id), 0) FROM guild_events")
+    row = await cursor.fetchone()
+    assert row is not None  # an aggregate always returns a row
+    return int(row[0])
+
+
+async def delete_guild_events(db: aiosqlite.Connection, before: int) -> int:
+    """Drop events created before the `before` timestamp. Returns how many were removed."""
+    cursor = await db.execute("DELETE FROM guild_events WHERE created_at < ?", (before,))
+    return cursor.rowcount
 
 
 # ── PKCE state helpers ────────────────────────────────────────────────────────
@@ -442,302 +963,572 @@ async def save_pkce_state(
     await db.execute("DELETE FROM pkce_state WHERE expires_at <= ?", (int(time.time()),))
 
 
-async def get_pkce_state(db: aiosqlite.Connection, state: str) -> aiosqlite.Row | None:
-    cursor = await db.execute(
-        "SELECT * FROM pkce_state WHERE state = ? AND expires_at > ?",
-        (state, int(time.time())),
-    )
-    return await cursor.fetchone()
+async def get_pkce_state(db: aiosqlite.Connection, state: str) -> aiosqlite.Row | None:
+    cursor = await db.execute(
+        "SELECT * FROM pkce_state WHERE state = ? AND expires_at > ?",
+        (state, int(time.time())),
+    )
+    return await cursor.fetchone()
+
+
+async def delete_pkce_state(db: aiosqlite.Connection, state: str) -> None:
+    await db.execute("DELETE FROM pkce_state WHERE state = ?", (state,))
+
+
+async def consume_pkce_state(db: aiosqlite.Connection, state: str) -> aiosqlite.Row | None:
+    """Delete an unexpired PKCE state and return it, so it can only be used once."""
+    cursor = await db.execute(
+        "DELETE FROM pkce_state WHERE state = ? AND expires_at > ? RETURNING *",
+        (state, int(time.time())),
+    )
+    return await cursor.fetchone()
+
+
+async def delete_expired_pkce_states(db: aiosqlite.Connection, now: int) -> int:
+    """Drop OAuth states that expired unused. Returns how many were removed."""
+    cursor = await db.execute("DELETE FROM pkce_state WHERE expires_at <= ?", (now,))
+    return cursor.rowcount
+
+
+# ── Batched execution ─────────────────────────────────────────────────────────
+
+# Threads for run(), kept apart from the default executor so blocking Etsy calls
+# never queue in front of database work
+_sync_executor = ThreadPoolExecutor(thread_name_prefix="sqlite")
+
+
+async def run(
+    db: aiosqlite.Connection,
+    fn: Callable[Concatenate[sqlite3.Connection, P], T],
+    *args: P.args,
+    **kwargs: P.kwargs,
+) -> T:
+    """Run a synchronous `fn(conn, *args, **kwargs)` on db's worker thread and return its result.
+
+    Every `await db.execute()` / `fetch*()` is a separate round trip to aiosqlite's
+    thread; helpers that issue several statements put them in a plain function over
+    the underlying sqlite3.Connection and pay for a single hop instead. aiosqlite has
+    no public hook for running a function on its thread, so db must come from
+    _connect(), which keeps the sqlite3 connection, and fn runs on _sync_executor.
+    As with any statement on db, don't overlap it with other use of the connection.
+    """
+    if not isinstance(db, _Connection) or db.sqlite is None:
+        raise TypeError("run() needs a connection opened by get_db() or write()")
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _sync_executor, functools.partial(fn, db.sqlite, *args, **kwargs)
+    )
+
+
+# ── Bulk upsert helpers ───────────────────────────────────────────────────────
+
+# SQLite's default cap on bound parameters per statement (3.32+)
+_MAX_VARIABLES = 32766
+
+
+def _upsert_rows(
+    conn: sqlite3.Connection,
+    table: str,
+    columns: tuple[str, ...],
+    rows: list[tuple],
+    update: tuple[str, ...],
+    keep_existing: bool = False,
+    track: tuple[str, ...] = (),
+) -> dict[int, sqlite3.Row]:
+    """Insert rows with multi-row VALUES statements and return the touched rows.
+
+    The first column is the primary key. On conflict the `update` columns are
+    overwritten (or, with keep_existing, only filled in where the new value is
+    non-NULL), and only when something actually differs, so RETURNING yields
+    exactly the inserted and changed rows and unchanged rows cost no page writes.
+    An empty `update` ignores conflicts.
+
+    Each `track` column has a prev_<column> companion that the update sets to the
+    old value, so the returned rows carry both old and new values and change
+    detection needs no separate snapshot read. prev_* is NULL for inserted rows.
+    """
+    if not rows:
+        return {}
+    key = columns[0]
+    if not update:
+        conflict = "DO NOTHING"
+    else:
+        if keep_existing:
+            new = [f"COALESCE(excluded.{c}, {c})" for c in update]
+        else:
+            new = [f"excluded.{c}" for c in update]
+        # Unqualified column names on the right-hand side of SET read the old row
+        assignments = [f"prev_{c} = {c}" for c in track]
+        assignments += [f"{c} = {v}" for c, v in zip(update, new, strict=True)]
+        conflict = (
+            "DO UPDATE SET "
+            + ", ".join(assignments)
+            + f" WHERE ({', '.join(update)}) IS NOT ({', '.join(new)})"
+        )
+    returning = ", ".join([key, *track, *(f"prev_{c}" for c in track)])
+    row_sql = "(" + ", ".join("?" * len(columns)) + ")"
+    per_statement = max(1, _MAX_VARIABLES // len(columns))
+
+    touched: dict[int, sqlite3.Row] = {}
+    for i in range(0, len(rows), per_statement):
+        chunk = rows[i:i + per_statement]
+        cursor = conn.execute(
+            f"INSERT INTO {table} ({', '.join(columns)}) "
+            f"VALUES {', '.join([row_sql] * len(chunk))} "
+            f"ON CONFLICT({key}) {conflict} RETURNING {returning}",
+            [value for row in chunk for value in row],
+        )
+        touched.update((row[0], row) for row in cursor.fetchall())
+    return touched
+
+
+# ── Shop / listing / receipt helpers ─────────────────────────────────────────
+
+_SHOP_COLUMNS = (
+    "shop_id", "shop_name", "user_id", "title", "announcement", "currency_code",
+    "is_vacation", "listing_active_count", "digital_listing_count", "login_name",
+    "accepts_custom_requests", "url", "num_favorers", "languages",
+    "shop_location_country_iso", "create_date", "fetched_at",
+)
+
+
+async def upsert_shop(db: aiosqlite.Connection, shop: dict) -> bool:
+    """Insert or refresh a shop row, writing only if its data changed.
+
+    fetched_at records when the row was first stored; per-poll freshness lives in
+    shop_sync (see mark_shop_synced). Returns True if anything was written.
+    """
+    return await run(db, _upsert_shop, shop)
+
+
+def _shop_row(shop: dict, now: int) -> tuple:
+    return (
+        shop["shop_id"],
+        shop["shop_name"],
+        shop["user_id"],
+        shop.get("title"),
+        shop.get("announcement"),
+        shop.get("currency_code", "USD"),
+        1 if shop.get("is_vacation") else 0,
+        shop.get("listing_active_count"),
+        shop.get("digital_listing_count"),
+        shop.get("login_name"),
+        1 if shop.get("accepts_custom_requests") else 0,
+        shop.get("url"),
+        shop.get("num_favorers", 0),
+        json.dumps(shop.get("languages", [])),
+        shop.get("shop_location_country_iso"),
+        shop.get("create_date"),
+        now,
+    )
+
+
+def _upsert_shop(conn: sqlite3.Connection, shop: dict) -> bool:
+    row = _shop_row(shop, int(time.time()))
+    return bool(_upsert_rows(conn, "shops", _SHOP_COLUMNS, [row], update=_SHOP_COLUMNS[1:-1]))
+
+
+_SYNC_STAGES = ("listings", "receipts", "reviews")
+
+
+async def mark_shop_synced(db: aiosqlite.Connection, shop_id: int, *stages: str) -> None:
+    """Record that the given stages ("listings", "receipts", "reviews") were just fetched."""
+    await run(db, _mark_shop_synced, shop_id, *stages)
+
+
+def _mark_shop_synced(conn: sqlite3.Connection, shop_id: int, *stages: str) -> None:
+    if not stages:
+        return
+    for stage in stages:
+        if stage not in _SYNC_STAGES:
+            raise ValueError(f"unknown sync stage: {stage}")
+    now = int(time.time())
+    columns = [f"{stage}_synced_at" for stage in stages]
+    conn.execute(
+        f"""
+        INSERT INTO shop_sync (shop_id, {", ".join(columns)})
+        VALUES (?, {", ".join("?" * len(columns))})
+        ON CONFLICT(shop_id) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in columns)}
+        """,
+        (shop_id, *([now] * len(columns))),
+    )
+
+
+async def get_shop_sync(db: aiosqlite.Connection, shop_id: int) -> aiosqlite.Row | None:
+    cursor = await db.execute("SELECT * FROM shop_sync WHERE shop_id = ?", (shop_id,))
+    return await cursor.fetchone()
+
+
+async def get_shop(db: aiosqlite.Connection, shop_id: int) -> aiosqlite.Row | None:
+    cursor = await db.execute("SELECT * FROM shops WHERE shop_id = ?", (shop_id,))
+    return await cursor.fetchone()
+
+
+async def get_shop_name(db: aiosqlite.Connection, shop_id: int) -> str | None:
+    cursor = await db.execute("SELECT shop_name FROM shops WHERE shop_id = ?", (shop_id,))
+    row = await cursor.fetchone()
+    return row["shop_name"] if row else None
+
+
+_LISTING_COLUMNS = (
+    "listing_id", "shop_id", "user_id", "title", "description", "state", "quantity",
+    "url", "num_favorers", "is_customizable", "is_personalizable", "listing_type",
+    "tags", "materials", "price_amount", "price_divisor", "price_currency_code",
+    "views", "is_digital", "who_made", "when_made", "creation_timestamp",
+    "last_modified_timestamp", "image_url", "fetched_at",
+)
+
+
+def _listing_row(listing: dict, now: int) -> tuple:
+    price = listing.get("price", {})
+    first_image = (listing.get("images") or [{}])[0]
+    return (
+        listing["listing_id"],
+        listing["shop_id"],
+        listing["user_id"],
+        listing["title"],
+        listing.get("description"),
+        listing.get("state", "active"),
+        listing.get("quantity", 0),
+        listing.get("url"),
+        listing.get("num_favorers", 0),
+        1 if listing.get("is_customizable") else 0,
+        1 if listing.get("is_personalizable") else 0,
+        listing.get("listing_type"),
+        json.dumps(listing.get("tags", [])),
+        json.dumps(listing.get("materials", [])),
+        price.get("amount", 0),
+        price.get("divisor", 100),
+        price.get("currency_code", "USD"),
+        listing.get("views", 0),
+        1 if listing.get("is_digital") else 0,
+        listing.get("who_made"),
+        listing.get("when_made"),
+        listing.get("creation_timestamp"),
+        listing.get("last_modified_timestamp"),
+        first_image.get("url_570xN") or first_image.get("url_170x135"),
+        now,
+    )
+
+
+async def upsert_listing(db: aiosqlite.Connection, listing: dict) -> None:
+    await upsert_listings(db, [listing])
+
+
+async def upsert_listings(db: aiosqlite.Connection, listings: list) -> dict[int, sqlite3.Row]:
+    """Upsert a page of listings in one statement per chunk.
 
+    Returns {listing_id: row} for listings that were inserted or whose data
+    changed, each row carrying quantity and prev_quantity (NULL when new).
+    Unchanged rows are left untouched.
+    """
+    return await run(db, _upsert_listings, listings)
 
-async def delete_pkce_state(db: aiosqlite.Connection, state: str) -> None:
-    await db.execute("DELETE FROM pkce_state WHERE state = ?", (state,))
 
+def _upsert_listings(conn: sqlite3.Connection, listings: list) -> dict[int, sqlite3.Row]:
+    now = int(time.time())
+    return _upsert_rows(
+        conn,
+        "listings",
+        _LISTING_COLUMNS,
+        [_listing_row(listing, now) for listing in listings],
+        update=_LISTING_COLUMNS[1:-1],
+        track=("quantity",),
+    )
 
-# ── Shop / listing / receipt helpers ─────────────────────────────────────────
 
-async def upsert_shop(db: aiosqlite.Connection, shop: dict) -> None:
-    await db.execute(
-        """
-        INSERT OR REPLACE INTO shops (
-            shop_id, shop_name, user_id, title, announcement, currency_code,
-            is_vacation, listing_active_count, digital_listing_count, login_name,
-            accepts_custom_requests, url, num_favorers, languages,
-            shop_location_country_iso, create_date, fetched_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            shop["shop_id"],
-            shop["shop_name"],
-            shop["user_id"],
-            shop.get("title"),
-            shop.get("announcement"),
-            shop.get("currency_code", "USD"),
-            1 if shop.get("is_vacation") else 0,
-            shop.get("listing_active_count"),
-            shop.get("digital_listing_count"),
-            shop.get("login_name"),
-            1 if shop.get("accepts_custom_requests") else 0,
-            shop.get("url"),
-            shop.get("num_favorers", 0),
-            json.dumps(shop.get("languages", [])),
-            shop.get("shop_location_country_iso"),
-            shop.get("create_date"),
-            int(time.time()),
-        ),
+_TRANSACTION_COLUMNS = (
+    "transaction_id", "receipt_id", "shop_id", "listing_id", "title",
+    "quantity", "price_amount", "price_divisor", "price_currency",
+    "create_timestamp", "image_url", "selected_variations", "personalization_msg", "fetched_at",
+)
+
+
+def _transaction_row(t: dict, receipt_id: int, shop_id: int, now: int) -> tuple:
+    price = t.get("price") or {}
+    image = (t.get("listing_image") or {})
+    variations = t.get("selected_variations") or t.get("variations")
+    return (
+        t["transaction_id"],
+        receipt_id,
+        shop_id,
+        t.get("listing_id"),
+        t.get("title"),
+        t.get("quantity", 1),
+        price.get("amount", 0),
+        price.get("divisor", 100),
+        price.get("currency_code", "USD"),
+        t.get("create_timestamp", now),
+        image.get("url_75x75") or image.get("url_170x135"),
+        json.dumps(variations) if variations is not None else None,
+        t.get("personalization_message") or None,
+        now,
     )
 
 
-async def upsert_listing(db: aiosqlite.Connection, listing: dict) -> None:
-    price = listing.get("price", {})
-    await db.execute(
-        """
-        INSERT OR REPLACE INTO listings (
-            listing_id, shop_id, user_id, title, description, state, quantity,
-            url, num_favorers, is_customizable, is_personalizable, listing_type,
-            tags, materials, price_amount, price_divisor, price_currency_code,
-            views, is_digital, who_made, when_made, creation_timestamp,
-            last_modified_timestamp, image_url, fetched_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            listing["listing_id"],
-            listing["shop_id"],
-            listing["user_id"],
-            listing["title"],
-            listing.get("description"),
-            listing.get("state", "active"),
-            listing.get("quantity", 0),
-            listing.get("url"),
-            listing.get("num_favorers", 0),
-            1 if listing.get("is_customizable") else 0,
-            1 if listing.get("is_personalizable") else 0,
-            listing.get("listing_type"),
-            json.dumps(listing.get("tags", [])),
-            json.dumps(listing.get("materials", [])),
-            price.get("amount", 0),
-            price.get("divisor", 100),
-            price.get("currency_code", "USD"),
-            listing.get("views", 0),
-            1 if listing.get("is_digital") else 0,
-            listing.get("who_made"),
-            listing.get("when_made"),
-            listing.get("creation_timestamp"),
-            listing.get("last_modified_timestamp"),
-            ((listing.get("images") or [{}])[0]).get("url_570xN")
-            or ((listing.get("images") or [{}])[0]).get("url_170x135"),
-            int(time.time()),
-        ),
-    )
-
-
-async def upsert_listings(db: aiosqlite.Connection, listings: list) -> None:
-    for listing in listings:
-        await upsert_listing(db, listing)
+def _upsert_transaction_rows(conn: sqlite3.Connection, rows: list[tuple]) -> dict[int, sqlite3.Row]:
+    # Line items are write-once except for the detail fields Etsy fills in later
+    return _upsert_rows(
+        conn,
+        "transactions",
+        _TRANSACTION_COLUMNS,
+        rows,
+        update=("selected_variations", "personalization_msg", "image_url"),
+        keep_existing=True,
+    )
 
 
 async def upsert_transactions(
     db: aiosqlite.Connection, receipt_id: int, shop_id: int, transactions: list
-) -> None:
-    """Upsert line-item transactions from a receipt. Ignores conflicts (write-once)."""
+) -> dict[int, sqlite3.Row]:
+    """Upsert line-item transactions from a receipt. Returns new/changed transaction IDs."""
     now = int(time.time())
-    for t in transactions:
-        price = t.get("price") or {}
-        image = (t.get("listing_image") or {})
-        image_url = image.get("url_75x75") or image.get("url_170x135")
-        variations = t.get("selected_variations") or t.get("variations")
-        variations_json = json.dumps(variations) if variations is not None else None
-        personalization_msg = t.get("personalization_message") or None
-        await db.execute(
-            """
-            INSERT INTO transactions (
-                transaction_id, receipt_id, shop_id, listing_id, title,
-                quantity, price_amount, price_divisor, price_currency,
-                create_timestamp, image_url, selected_variations, personalization_msg, fetched_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(transaction_id) DO UPDATE SET
-                selected_variations = COALESCE(excluded.selected_variations, selected_variations),
-                personalization_msg = COALESCE(excluded.personalization_msg, personalization_msg),
-                image_url = COALESCE(excluded.image_url, image_url)
-            """,
-            (
-                t["transaction_id"],
-                receipt_id,
-                shop_id,
-                t.get("listing_id"),
-                t.get("title"),
-                t.get("quantity", 1),
-                price.get("amount", 0),
-                price.get("divisor", 100),
-                price.get("currency_code", "USD"),
-                t.get("create_timestamp", now),
-                image_url,
-                variations_json,
-                personalization_msg,
-                now,
-            ),
-        )
+    rows = [_transaction_row(t, receipt_id, shop_id, now) for t in transactions]
+    return await run(db, _upsert_transaction_rows, rows)
+
+
+async def upsert_receipts_transactions(
+    db: aiosqlite.Connection, receipts: list
+) -> dict[int, sqlite3.Row]:
+    """Upsert the line items embedded in a page of receipts in one pass."""
+    return await run(db, _upsert_receipts_transactions, receipts)
+
+
+def _upsert_receipts_transactions(conn: sqlite3.Connection, receipts: list) -> dict[int, sqlite3.Row]:
+    now = int(time.time())
+    return _upsert_transaction_rows(
+        conn,
+        [
+            _transaction_row(t, receipt["receipt_id"], receipt["shop_id"], now)
+            for receipt in receipts
+            for t in receipt.get("transactions", [])
+        ],
+    )
 
 
 async def get_bestsellers(
     db: aiosqlite.Connection,
     shop_id: int,
-    since_timestamp: int,
+    period: str,
     ranked_by: str = "units",
     limit: int = 5,
 ) -> list:
-    """Return top listings by units sold or revenue for a shop since a given timestamp.
+    """Return top listings by units sold or revenue for a shop in a period.
 
+    period: "all", a year ("2026") or a month ("2026-03"), in UTC.
     ranked_by: "units" (default) or "revenue".
-    Excludes transactions from canceled receipts.
+    Reads the listing_sales rollup, which excludes canceled receipts, so the cost
+    doesn't grow with the shop's history.
     """
-    order_col = "units_sold" if ranked_by == "units" else "total_revenue"
+    order_col = "units" if ranked_by == "units" else "revenue_minor_units"
     cursor = await db.execute(
         f"""
         SELECT
-            t.listing_id,
-            t.title,
-            t.image_url,
-            SUM(t.quantity) AS units_sold,
-            SUM(t.quantity * CAST(t.price_amount AS REAL) / t.price_divisor) AS total_revenue,
-            t.price_currency AS currency
-        FROM transactions t
-        JOIN receipts r ON r.receipt_id = t.receipt_id
-        WHERE t.shop_id = ?
-          AND t.listing_id IS NOT NULL
-          AND t.create_timestamp >= ?
-          AND LOWER(r.status) != 'canceled'
-        GROUP BY t.listing_id, t.title
+            listing_id,
+            title,
+            image_url,
+            units AS units_sold,
+            revenue_minor_units * 1.0 / divisor AS total_revenue,
+            currency
+        FROM listing_sales
+        WHERE shop_id = ? AND period = ? AND {order_col} > 0
         ORDER BY {order_col} DESC
         LIMIT ?
         """,
-        (shop_id, since_timestamp, limit),
+        (shop_id, period, limit),
     )
     return await cursor.fetchall()
 
 
-async def upsert_receipt(
-    db: aiosqlite.Connection, receipt: dict, already_seen: bool = False
-) -> bool:
-    """
-    Insert a new receipt row, ignoring conflicts to preserve notified_at.
-    Returns True if a new row was inserted.
-    """
+_RECEIPT_COLUMNS = (
+    "receipt_id", "shop_id", "receipt_type", "seller_user_id", "buyer_user_id",
+    "buyer_email", "name", "first_line", "second_line", "city", "state", "zip",
+    "country_iso", "status", "payment_method", "is_paid", "is_shipped", "is_gift",
+    "gift_message", "grandtotal_amount", "grandtotal_divisor", "grandtotal_currency",
+    "subtotal_amount", "total_shipping_amount", "total_tax_amount",
+    "discount_amount", "create_timestamp", "update_timestamp", "expected_ship_date",
+    "fetched_at", "notified_at",
+)
+
+# Fields that change after an order is placed; everything else (and notified_at)
+# is preserved on conflict.
+_RECEIPT_MUTABLE_COLUMNS = (
+    "name", "first_line", "second_line", "city", "state", "zip", "country_iso",
+    "is_shipped", "status", "update_timestamp", "expected_ship_date",
+)
+
+
+def _receipt_row(receipt: dict, notified_at: int | None, now: int) -> tuple:
     grandtotal = receipt.get("grandtotal", {})
     subtotal = receipt.get("subtotal", {})
     shipping = receipt.get("total_shipping_cost", {})
     tax = receipt.get("total_tax_cost", {})
     discount = receipt.get("discount_amt", {})
-    notified_at = int(time.time()) if already_seen else None
     expected_ship_date = receipt.get("expected_ship_date") or max(
         (t.get("expected_ship_date") for t in receipt.get("transactions", []) if t.get("expected_ship_date")),
         default=None,
     )
+    return (
+        receipt["receipt_id"],
+        receipt.get("shop_id"),
+        receipt.get("receipt_type", 0),
+        receipt["seller_user_id"],
+        receipt.get("buyer_user_id"),
+        receipt.get("buyer_email"),
+        receipt.get("name"),
+        receipt.get("first_line"),
+        receipt.get("second_line"),
+        receipt.get("city"),
+        receipt.get("state"),
+        receipt.get("zip"),
+        receipt.get("country_iso"),
+        receipt.get("status", ""),
+        receipt.get("payment_method"),
+        1 if receipt.get("is_paid") else 0,
+        1 if receipt.get("is_shipped") else 0,
+        1 if receipt.get("is_gift") else 0,
+        receipt.get("gift_message"),
+        grandtotal.get("amount", 0),
+        grandtotal.get("divisor", 100),
+        grandtotal.get("currency_code", "USD"),
+        subtotal.get("amount"),
+        shipping.get("amount"),
+        tax.get("amount"),
+        discount.get("amount", 0),
+        receipt.get("create_timestamp", now),
+        receipt.get("update_timestamp"),
+        expected_ship_date,
+        now,
+        notified_at,
+    )
 
-    cursor = await db.execute(
-        """
-        INSERT OR IGNORE INTO receipts (
-            receipt_id, shop_id, receipt_type, seller_user_id, buyer_user_id,
-            buyer_email, name, first_line, second_line, city, state, zip, country_iso, status,
-            payment_method, is_paid, is_shipped, is_gift, gift_message,
-            grandtotal_amount, grandtotal_divisor, grandtotal_currency,
-            subtotal_amount, total_shipping_amount, total_tax_amount,
-            discount_amount, create_timestamp, update_timestamp, expected_ship_date,
-            fetched_at, notified_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            receipt["receipt_id"],
-            receipt.get("shop_id"),
-            receipt.get("receipt_type", 0),
-            receipt["seller_user_id"],
-            receipt.get("buyer_user_id"),
-            receipt.get("buyer_email"),
-            receipt.get("name"),
-            receipt.get("first_line"),
-            receipt.get("second_line"),
-            receipt.get("city"),
-            receipt.get("state"),
-            receipt.get("zip"),
-            receipt.get("country_iso"),
-            receipt.get("status", ""),
-            receipt.get("payment_method"),
-            1 if receipt.get("is_paid") else 0,
-            1 if receipt.get("is_shipped") else 0,
-            1 if receipt.get("is_gift") else 0,
-            receipt.get("gift_message"),
-            grandtotal.get("amount", 0),
-            grandtotal.get("divisor", 100),
-            grandtotal.get("currency_code", "USD"),
-            subtotal.get("amount"),
-            shipping.get("amount"),
-            tax.get("amount"),
-            discount.get("amount", 0),
-            receipt.get("create_timestamp", int(time.time())),
-            receipt.get("update_timestamp"),
-            expected_ship_date,
-            int(time.time()),
-            notified_at,
-        ),
-    )
-    is_new = cursor.rowcount == 1
-
-    # For existing rows, keep mutable fields current (notified_at is preserved by INSERT OR IGNORE)
-    if not is_new:
-        await db.execute(
-            """
-            UPDATE receipts
-            SET name=?, first_line=?, second_line=?, city=?, state=?, zip=?, country_iso=?,
-                is_shipped=?, status=?, update_timestamp=?, expected_ship_date=?, fetched_at=?
-            WHERE receipt_id = ?
-            """,
-            (
-                receipt.get("name"),
-                receipt.get("first_line"),
-                receipt.get("second_line"),
-                receipt.get("city"),
-                receipt.get("state"),
-                receipt.get("zip"),
-                receipt.get("country_iso"),
-                1 if receipt.get("is_shipped") else 0,
-                receipt.get("status", ""),
-                receipt.get("update_timestamp"),
-                expected_ship_date,
-                int(time.time()),
-                receipt["receipt_id"],
-            ),
-        )
 
-    return is_new
+async def upsert_receipts(
+    db: aiosqlite.Connection, receipts: list, already_seen: bool = False
+) -> dict[int, sqlite3.Row]:
+    """Upsert a page of receipts in one statement per chunk.
 
+    New rows get notified_at set only when already_seen; existing rows keep their
+    notified_at and only have the mutable fields refreshed. Returns
+    {receipt_id: row} for receipts that were inserted or changed, each row carrying
+    status/is_shipped and prev_status/prev_is_shipped (NULL when new).
+    """
+    return await run(db, _upsert_receipts, receipts, already_seen)
 
-async def get_receipts_status_snapshot(
-    db: aiosqlite.Connection, receipt_ids: list
-) -> dict:
-    """Return {receipt_id: {"is_shipped": int, "status": str}} for all known receipt IDs."""
-    if not receipt_ids:
-        return {}
-    placeholders = ",".join("?" * len(receipt_ids))
+
+def _upsert_receipts(
+    conn: sqlite3.Connection, receipts: list, already_seen: bool = False
+) -> dict[int, sqlite3.Row]:
+    now = int(time.time())
+    notified_at = now if already_seen else None
+    return _upsert_rows(
+        conn,
+        "receipts",
+        _RECEIPT_COLUMNS,
+        [_receipt_row(receipt, notified_at, now) for receipt in receipts],
+        update=_RECEIPT_MUTABLE_COLUMNS,
+        track=("status", "is_shipped"),
+    )
+
+
+async def upsert_receipt(
+    db: aiosqlite.Connection, receipt: dict, already_seen: bool = False
+) -> bool:
+    """
+    Insert or refresh a single receipt, preserving notified_at.
+    Returns True if a new row was inserted.
+    """
+    changed = await upsert_receipts(db, [receipt], already_seen=already_seen)
+    row = changed.get(receipt["receipt_id"])
+    return row is not None and row["prev_status"] is None
+
+
+async def ingest_shop_page(
+    db: aiosqlite.Connection,
+    shop_id: int,
+    shop: dict,
+    listings: list,
+    receipts: list,
+    reviews: list | None = None,
+    already_seen: bool = False,
+) -> tuple[dict[int, sqlite3.Row], dict[int, sqlite3.Row]]:
+    """Store one poll's worth of Etsy data in a single thread hop.
+
+    Upserts the shop, listings, receipts with their line items and, when given,
+    reviews, then records the fetched stages in shop_sync. Receipts and reviews
+    must already carry shop_id. Returns (listing_changes, receipt_changes) as
+    reported by upsert_listings / upsert_receipts.
+    """
+    return await run(
+        db, _ingest_shop_page, shop_id, shop, listings, receipts, reviews, already_seen
+    )
+
+
+def _ingest_shop_page(
+    conn: sqlite3.Connection,
+    shop_id: int,
+    shop: dict,
+    listings: list,
+    receipts: list,
+    reviews: list | None,
+    already_seen: bool,
+) -> tuple[dict[int, sqlite3.Row], dict[int, sqlite3.Row]]:
+    _upsert_shop(conn, shop)
+    listing_changes = _upsert_listings(conn, listings)
+    receipt_changes = _upsert_receipts(conn, receipts, already_seen)
+    _upsert_receipts_transactions(conn, receipts)
+    stages = ["listings", "receipts"]
+    if reviews is not None:
+        _upsert_reviews(conn, reviews, already_seen)
+        stages.append("reviews")
+    _mark_shop_synced(conn, shop_id, *stages)
+    return listing_changes, receipt_changes
+
+
+async def get_receipt(
+    db: aiosqlite.Connection, shop_id: int, receipt_id: int
+) -> aiosqlite.Row | None:
+    """Return one of a shop's receipts, or None."""
     cursor = await db.execute(
-        f"SELECT receipt_id, is_shipped, status FROM receipts WHERE receipt_id IN ({placeholders})",
-        receipt_ids,
+        "SELECT * FROM receipts WHERE receipt_id = ? AND shop_id = ?", (receipt_id, shop_id)
     )
-    rows = await cursor.fetchall()
-    return {row["receipt_id"]: {"is_shipped": row["is_shipped"], "status": row["status"]} for row in rows}
+    return await cursor.fetchone()
 
 
 async def get_unnotified_receipts(db: aiosqlite.Connection, shop_id: int) -> list:
+    """Return receipts awaiting a notification, oldest first.
+
+    Each row also carries `is_returning`: 1 when the buyer had an earlier order.
+    """
     cursor = await db.execute(
         """
-        SELECT * FROM receipts
-        WHERE shop_id = ? AND notified_at IS NULL
-        ORDER BY create_timestamp ASC
+        SELECT r.*, b.first_receipt_id IS NOT NULL
+                    AND b.first_receipt_id != r.receipt_id AS is_returning
+        FROM receipts r
+        LEFT JOIN buyers b ON b.shop_id = r.shop_id AND b.buyer_user_id = r.buyer_user_id
+        WHERE r.shop_id = ? AND r.notified_at IS NULL
+        ORDER BY r.create_timestamp ASC
         """,
         (shop_id,),
     )
     return await cursor.fetchall()
 
 
+async def get_shop_counters(db: aiosqlite.Connection, shop_id: int) -> dict:
+    """Return the trigger-maintained open_orders, unnotified_receipts and unnotified_reviews."""
+    cursor = await db.execute(
+        """
+        SELECT open_orders, unnotified_receipts, unnotified_reviews
+        FROM shop_counters WHERE shop_id = ?
+        """,
+        (shop_id,),
+    )
+    row = await cursor.fetchone()
+    if row is None:
+        return {"open_orders": 0, "unnotified_receipts": 0, "unnotified_reviews": 0}
+    return dict(row)
+
+
 async def mark_receipt_notified(db: aiosqlite.Connection, receipt_id: int) -> None:
     await db.execute(
         "UPDATE receipts SET notified_at = ? WHERE receipt_id = ?",
@@ -824,11 +1615,15 @@ async def get_guild_reminder_config(
 
     Returns a dict with keys: days (list[int]), time (str | None), tz (str | None).
     """
-    cursor = await db.execute(
+    return await run(db, _reminder_config, guild_id)
+
+
+def _reminder_config(conn: sqlite3.Connection, guild_id: int) -> dict | None:
+    cursor = conn.execute(
         "SELECT ship_reminder_days, ship_reminder_time, ship_reminder_tz FROM guilds WHERE guild_id = ?",
         (guild_id,),
     )
-    row = await cursor.fetchone()
+    row = cursor.fetchone()
     if row is None or row[0] is None:
         return None
     return {
@@ -871,21 +1666,6 @@ async def disable_guild_reminders(
     )
 
 
-async def get_listing_quantity_snapshot(
-    db: aiosqlite.Connection, listing_ids: list[int]
-) -> dict[int, int]:
-    """Return {listing_id: quantity} for all known listing IDs."""
-    if not listing_ids:
-        return {}
-    placeholders = ",".join("?" * len(listing_ids))
-    cursor = await db.execute(
-        f"SELECT listing_id, quantity FROM listings WHERE listing_id IN ({placeholders})",
-        listing_ids,
-    )
-    rows = await cursor.fetchall()
-    return {row["listing_id"]: row["quantity"] for row in rows}
-
-
 async def get_active_listings(db: aiosqlite.Connection, shop_id: int) -> list:
     """Return all active listings for a shop, ordered by title."""
     cursor = await db.execute(
@@ -901,19 +1681,65 @@ async def get_active_listings(db: aiosqlite.Connection, shop_id: int) -> list:
     return await cursor.fetchall()
 
 
-async def get_receipts_since(
+async def get_sales_since(
     db: aiosqlite.Connection, shop_id: int, since_timestamp: int
-) -> list:
-    """Return all non-canceled receipts for a shop created on or after since_timestamp."""
-    cursor = await db.execute(
+) -> dict:
+    """Return {"orders", "revenue", "currency"} for non-canceled receipts since since_timestamp.
+
+    Reads the daily_sales rollup, so the window is whole UTC days: since_timestamp
+    is rounded down to midnight. revenue is in major units; currency is the one with
+    the most orders, or None when there were none.
+    """
+    return await run(db, _sales_since, shop_id, since_timestamp)
+
+
+def _sales_since(conn: sqlite3.Connection, shop_id: int, since_timestamp: int) -> dict:
+    rows = conn.execute(
         """
-        SELECT grandtotal_amount, grandtotal_divisor, grandtotal_currency
-        FROM receipts
-        WHERE shop_id = ? AND create_timestamp >= ? AND LOWER(status) != 'canceled'
+        SELECT currency, SUM(orders) AS orders,
+               SUM(revenue_minor_units * 1.0 / divisor) AS revenue
+        FROM daily_sales
+        WHERE shop_id = ? AND day >= date(?, 'unixepoch')
+        GROUP BY currency
+        ORDER BY orders DESC
         """,
         (shop_id, since_timestamp),
-    )
-    return await cursor.fetchall()
+    ).fetchall()
+    rows = [r for r in rows if r["orders"]]
+    return {
+        "orders": sum(r["orders"] for r in rows),
+        "revenue": sum(r["revenue"] for r in rows),
+        "currency": rows[0]["currency"] if rows else None,
+    }
+
+
+async def get_receipt_totals_since(
+    db: aiosqlite.Connection, shop_id: int, since_timestamp: int
+) -> dict:
+    """Like get_sales_since, but to the second, for rolling windows such as the last 24h.
+
+    Aggregates receipts directly, so keep the window short.
+    """
+    return await run(db, _receipt_totals_since, shop_id, since_timestamp)
+
+
+def _receipt_totals_since(conn: sqlite3.Connection, shop_id: int, since_timestamp: int) -> dict:
+    rows = conn.execute(
+        """
+        SELECT grandtotal_currency AS currency, COUNT(*) AS orders,
+               SUM(grandtotal_amount * 1.0 / grandtotal_divisor) AS revenue
+        FROM receipts
+        WHERE shop_id = ? AND create_timestamp >= ? AND status_code != ?
+        GROUP BY grandtotal_currency
+        ORDER BY orders DESC
+        """,
+        (shop_id, since_timestamp, schema.STATUS_CANCELED),
+    ).fetchall()
+    return {
+        "orders": sum(r["orders"] for r in rows),
+        "revenue": sum(r["revenue"] for r in rows),
+        "currency": rows[0]["currency"] if rows else None,
+    }
 
 
 # ── Shipping preset helpers ───────────────────────────────────────────────────
@@ -960,10 +1786,16 @@ async def delete_preset(db: aiosqlite.Connection, guild_id: int, name: str) -> b
     return cursor.rowcount == 1
 
 
-async def get_labelable_receipts(db: aiosqlite.Connection, shop_id: int) -> list:
-    """Return paid, unshipped receipts for label autocomplete, newest first."""
+async def get_labelable_receipts(
+    db: aiosqlite.Connection, shop_id: int, search: str = ""
+) -> list:
+    """Return paid, unshipped receipts for label autocomplete, newest first.
+
+    With `search`, only receipts whose ID, buyer or items match it (see search_orders).
+    """
+    match = _fts_match(shop_id, search)
     cursor = await db.execute(
-        """
+        f"""
         SELECT r.receipt_id, r.name, r.create_timestamp,
                GROUP_CONCAT(
                    CASE WHEN t.quantity > 1 THEN t.quantity || 'x ' || t.title ELSE t.title END,
@@ -971,13 +1803,13 @@ async def get_labelable_receipts(db: aiosqlite.Connection, shop_id: int) -> list
                ) AS items
         FROM receipts r
         LEFT JOIN transactions t ON t.receipt_id = r.receipt_id AND t.shop_id = r.shop_id
-        WHERE r.shop_id = ? AND r.is_paid = 1 AND r.is_shipped = 0
-          AND LOWER(r.status) != 'canceled'
+        WHERE r.shop_id = ? AND r.is_open = 1 AND r.is_paid = 1
+          {"AND r.receipt_id IN (SELECT rowid FROM orders_fts WHERE orders_fts MATCH ?)" if match else ""}
         GROUP BY r.receipt_id
         ORDER BY r.create_timestamp DESC
         LIMIT 25
         """,
-        (shop_id,),
+        (shop_id, match) if match else (shop_id,),
     )
     return await cursor.fetchall()
 
@@ -993,6 +1825,49 @@ async def get_preset_by_name(db: aiosqlite.Connection, guild_id: int, name: str)
 
 # ── Review helpers ────────────────────────────────────────────────────────────
 
+_REVIEW_COLUMNS = (
+    "transaction_id", "shop_id", "listing_id", "buyer_user_id",
+    "rating", "review", "language", "image_url",
+    "create_timestamp", "update_timestamp", "fetched_at", "notified_at",
+)
+
+
+def _review_row(review: dict, notified_at: int | None, now: int) -> tuple:
+    return (
+        review["transaction_id"],
+        review["shop_id"],
+        review.get("listing_id"),
+        review.get("buyer_user_id"),
+        review["rating"],
+        review.get("review"),
+        review.get("language"),
+        review.get("image_url_fullxfull"),
+        review.get("create_timestamp", now),
+        review.get("update_timestamp"),
+        now,
+        notified_at,
+    )
+
+
+async def upsert_reviews(
+    db: aiosqlite.Connection, reviews: list, already_seen: bool = False
+) -> dict[int, sqlite3.Row]:
+    """Insert a page of reviews, ignoring ones already stored (preserves notified_at).
+
+    Returns {transaction_id: row} for newly inserted reviews.
+    """
+    return await run(db, _upsert_reviews, reviews, already_seen)
+
+
+def _upsert_reviews(
+    conn: sqlite3.Connection, reviews: list, already_seen: bool = False
+) -> dict[int, sqlite3.Row]:
+    now = int(time.time())
+    notified_at = now if already_seen else None
+    rows = [_review_row(review, notified_at, now) for review in reviews]
+    return _upsert_rows(conn, "reviews", _REVIEW_COLUMNS, rows, update=())
+
+
 async def upsert_review(
     db: aiosqlite.Connection, review: dict, already_seen: bool = False
 ) -> bool:
@@ -1000,31 +1875,7 @@ async def upsert_review(
     Insert a new review row, ignoring conflicts to preserve notified_at.
     Returns True if a new row was inserted.
     """
-    notified_at = int(time.time()) if already_seen else None
-    cursor = await db.execute(
-        """
-        INSERT OR IGNORE INTO reviews (
-            transaction_id, shop_id, listing_id, buyer_user_id,
-            rating, review, language, image_url,
-            create_timestamp, update_timestamp, fetched_at, notified_at
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """,
-        (
-            review["transaction_id"],
-            review["shop_id"],
-            review.get("listing_id"),
-            review.get("buyer_user_id"),
-            review["rating"],
-            review.get("review"),
-            review.get("language"),
-            review.get("image_url_fullxfull"),
-            review.get("create_timestamp", int(time.time())),
-            review.get("update_timestamp"),
-            int(time.time()),
-            notified_at,
-        ),
-    )
-    return cursor.rowcount == 1
+    return bool(await upsert_reviews(db, [review], already_seen=already_seen))
 
 
 async def get_unnotified_reviews(db: aiosqlite.Connection, shop_id: int) -> list:
@@ -1055,11 +1906,15 @@ async def get_goal_config(
 
     Returns a dict with keys: amount_cents (int), milestones_sent (list[int]), month (str).
     """
-    cursor = await db.execute(
+    return await run(db, _goal_config, guild_id)
+
+
+def _goal_config(conn: sqlite3.Connection, guild_id: int) -> dict | None:
+    cursor = conn.execute(
         "SELECT goal_amount, goal_milestones_sent, goal_month FROM guilds WHERE guild_id = ?",
         (guild_id,),
     )
-    row = await cursor.fetchone()
+    row = cursor.fetchone()
     if row is None or row[0] is None:
         return None
     return {
@@ -1108,16 +1963,53 @@ async def get_digest_config(
 
     Returns a dict with keys: time (str), tz (str), last_sent (int | None).
     """
-    cursor = await db.execute(
+    return await run(db, _digest_config, guild_id)
+
+
+def _digest_config(conn: sqlite3.Connection, guild_id: int) -> dict | None:
+    cursor = conn.execute(
         "SELECT digest_time, digest_tz, digest_last_sent FROM guilds WHERE guild_id = ?",
         (guild_id,),
     )
-    row = await cursor.fetchone()
+    row = cursor.fetchone()
     if row is None or row[0] is None:
         return None
     return {"time": row[0], "tz": row[1], "last_sent": row[2]}
 
 
+
+async def get_digest_data(
+    db: aiosqlite.Connection, shop_id: int, now: int, goal: dict | None = None
+) -> dict:
+    """Collect everything the daily digest shows in a single thread hop.
+
+    goal is the guild's get_goal_config(), read by the caller since guild settings
+    and shop data may live in different databases (see get_shop_db()).
+
+    Returns a dict with keys: sales_24h (get_receipt_totals_since over the last day),
+    currency (str), open_count (int), due_soon (rows due within two days), goal (as
+    passed) and month_sales (get_sales_since for this month, when a goal is set).
+    """
+    return await run(db, _digest_data, shop_id, now, goal)
+
+
+def _digest_data(conn: sqlite3.Connection, shop_id: int, now: int, goal: dict | None) -> dict:
+    sales_24h = _receipt_totals_since(conn, shop_id, now - 86400)
+    month_sales = None
+    if goal:
+        now_dt = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+        month_start = datetime.datetime(now_dt.year, now_dt.month, 1, tzinfo=datetime.timezone.utc)
+        month_sales = _sales_since(conn, shop_id, int(month_start.timestamp()))
+    return {
+        "sales_24h": sales_24h,
+        "currency": sales_24h["currency"] or _shop_currency(conn, shop_id),
+        "open_count": _open_order_count(conn, shop_id),
+        "due_soon": _receipts_due_within(conn, shop_id, 2 * 86400, now),
+        "goal": goal,
+        "month_sales": month_sales,
+    }
+
+
 async def set_digest_config(
     db: aiosqlite.Connection, guild_id: int, time_str: str, tz: str
 ) -> None:
@@ -1145,43 +2037,54 @@ async def get_receipts_due_within(
     db: aiosqlite.Connection, shop_id: int, within_seconds: int, now: int
 ) -> list:
     """Return unshipped, non-canceled receipts with a ship deadline in the next within_seconds."""
+    return await run(db, _receipts_due_within, shop_id, within_seconds, now)
+
+
+def _receipts_due_within(conn: sqlite3.Connection, shop_id: int, within_seconds: int, now: int) -> list:
     deadline = now + within_seconds
-    cursor = await db.execute(
+    cursor = conn.execute(
         """
         SELECT receipt_id, name, grandtotal_amount, grandtotal_divisor,
                grandtotal_currency, expected_ship_date
         FROM receipts
         WHERE shop_id = ?
-          AND is_shipped = 0
-          AND LOWER(status) != 'canceled'
+          AND is_open = 1
           AND expected_ship_date IS NOT NULL
           AND expected_ship_date <= ?
         ORDER BY expected_ship_date ASC
         """,
         (shop_id, deadline),
     )
-    return await cursor.fetchall()
+    return cursor.fetchall()
 
 
 async def get_shop_currency(db: aiosqlite.Connection, shop_id: int) -> str:
     """Return the currency_code for a shop, defaulting to USD."""
-    cursor = await db.execute(
+    return await run(db, _shop_currency, shop_id)
+
+
+def _shop_currency(conn: sqlite3.Connection, shop_id: int) -> str:
+    cursor = conn.execute(
         "SELECT currency_code FROM shops WHERE shop_id = ?", (shop_id,)
     )
-    row = await cursor.fetchone()
+    row = cursor.fetchone()
     return row["currency_code"] if row else "USD"
 
 
 async def get_open_order_count(db: aiosqlite.Connection, shop_id: int) -> int:
     """Return the number of open, unshipped, non-canceled receipts for a shop."""
-    cursor = await db.execute(
+    return await run(db, _open_order_count, shop_id)
+
+
+def _open_order_count(conn: sqlite3.Connection, shop_id: int) -> int:
+    cursor = conn.execute(
         """
         SELECT COUNT(*) FROM receipts
-        WHERE shop_id = ? AND is_shipped = 0 AND LOWER(status) != 'canceled'
+        WHERE shop_id = ? AND is_open = 1
         """,
         (shop_id,),
     )
-    row = await cursor.fetchone()
+    row = cursor.fetchone()
     return row[0] if row else 0
 
 
@@ -1192,11 +2095,15 @@ async def get_backlog_config(
 
     Returns a dict with keys: threshold (int), warned (bool).
     """
-    cursor = await db.execute(
+    return await run(db, _backlog_config, guild_id)
+
+
+def _backlog_config(conn: sqlite3.Connection, guild_id: int) -> dict | None:
+    cursor = conn.execute(
         "SELECT backlog_threshold, backlog_warned FROM guilds WHERE guild_id = ?",
         (guild_id,),
     )
-    row = await cursor.fetchone()
+    row = cursor.fetchone()
     if row is None or row[0] is None:
         return None
     return {"threshold": row[0], "warned": bool(row[1])}
@@ -1227,18 +2134,15 @@ async def is_returning_buyer(
     buyer_user_id: int | None,
     current_receipt_id: int,
 ) -> bool:
-    """Return True if this buyer has any prior notified receipts for the shop."""
+    """Return True if this buyer's first order with the shop was a different receipt."""
     if not buyer_user_id:
         return False
     cursor = await db.execute(
-        """
-        SELECT 1 FROM receipts
-        WHERE shop_id = ? AND buyer_user_id = ? AND receipt_id != ? AND notified_at IS NOT NULL
-        LIMIT 1
-        """,
-        (shop_id, buyer_user_id, current_receipt_id),
+        "SELECT first_receipt_id FROM buyers WHERE shop_id = ? AND buyer_user_id = ?",
+        (shop_id, buyer_user_id),
     )
-    return await cursor.fetchone() is not None
+    row = await cursor.fetchone()
+    return row is not None and row["first_receipt_id"] != current_receipt_id
 
 
 async def disconnect_guild(
@@ -1343,20 +2247,262 @@ async def mark_receipts_shipped_bulk(db: aiosqlite.Connection, receipt_ids: list
 
 
 async def get_buyer_orders(
-    db: aiosqlite.Connection, shop_id: int, buyer_name: str, limit: int = 5
+    db: aiosqlite.Connection,
+    shop_id: int,
+    buyer_name: str,
+    limit: int = 5,
+    include_archive: bool = False,
+) -> list:
+    """Return recent paid receipts for the buyer(s) with this name (case-insensitive).
+
+    That is every receipt of a buyer whose latest name it is, plus receipts placed
+    under the name itself: older names of a buyer who has since changed it, and
+    guest checkouts, which have no buyer_user_id. With include_archive, receipts
+    moved to the archive database are searched too.
+    """
+    return await run(db, _buyer_orders, shop_id, buyer_name, limit, include_archive)
+
+
+def _buyer_orders(
+    conn: sqlite3.Connection, shop_id: int, buyer_name: str, limit: int, include_archive: bool
+) -> list:
+    sources = ["main"]
+    if include_archive and _has_archive(conn):
+        sources.append("archive")
+    match = _fts_match(shop_id, buyer_name, column="name")
+    rows = []
+    for source in sources:
+        # Receipts under the name itself are found through the full-text index in
+        # main; the archive has none, so there the shop's receipts are scanned.
+        # CROSS JOINs pin the join order, so the plan doesn't depend on ANALYZE.
+        by_name = "r.shop_id = ?"
+        by_name_param: int | str = shop_id
+        if source == "main" and match is not None:
+            by_name = "r.receipt_id IN (SELECT rowid FROM orders_fts WHERE orders_fts MATCH ?)"
+            by_name_param = match
+        rows += conn.execute(
+            f"""
+            SELECT r.receipt_id, r.name, r.create_timestamp,
+                   GROUP_CONCAT(t.title, ', ') AS items
+            FROM {source}.receipts r
+            LEFT JOIN {source}.transactions t
+              ON t.receipt_id = r.receipt_id AND +t.shop_id = r.shop_id
+            WHERE r.receipt_id IN (
+                SELECT r.receipt_id
+                FROM buyers b
+                CROSS JOIN {source}.receipts r
+                  ON r.shop_id = b.shop_id AND r.buyer_user_id = b.buyer_user_id
+                WHERE b.shop_id = ? AND b.name_norm = LOWER(TRIM(?))
+                UNION
+                SELECT r.receipt_id
+                FROM {source}.receipts r
+                WHERE {by_name} AND LOWER(TRIM(r.name)) = LOWER(TRIM(?))
+            ) AND r.is_paid = 1
+            GROUP BY r.receipt_id
+            ORDER BY r.create_timestamp DESC
+            LIMIT ?
+            """,
+            (shop_id, buyer_name, by_name_param, buyer_name, limit),
+        ).fetchall()
+    rows.sort(key=lambda r: r["create_timestamp"], reverse=True)
+    return rows[:limit]
+
+
+async def search_buyers(
+    db: aiosqlite.Connection, shop_id: int, current: str, limit: int = 25
+) -> list[str]:
+    """Return up to `limit` distinct buyer names, most recent first.
+
+    With `current`, only buyers whose name has words starting with each of its words.
+    """
+    match = _fts_match(shop_id, current, column="name")
+    if match is None:
+        cursor = await db.execute(
+            """
+            SELECT name FROM buyers
+            WHERE shop_id = ? AND name IS NOT NULL
+            ORDER BY last_order_at DESC
+            LIMIT ?
+            """,
+            (shop_id, limit * 2),
+        )
+    else:
+        cursor = await db.execute(
+            """
+            SELECT b.name FROM buyers b
+            WHERE b.shop_id = ? AND b.name IS NOT NULL AND b.buyer_user_id IN (
+                SELECT r.buyer_user_id FROM orders_fts f
+                JOIN receipts r ON r.receipt_id = f.rowid
+                WHERE orders_fts MATCH ?
+            )
+            ORDER BY b.last_order_at DESC
+            LIMIT ?
+            """,
+            (shop_id, match, limit * 2),
+        )
+    names = list(dict.fromkeys(row["name"] for row in await cursor.fetchall()))
+    return names[:limit]
+
+
+# ── Retention ─────────────────────────────────────────────────────────────────
+
+# Orders in these statuses are finished with; Etsy no longer changes them.
+_ARCHIVABLE_STATUS_CODES = tuple(
+    schema.RECEIPT_STATUS_CODES[s] for s in ("completed", "canceled", "fully refunded")
+)
+
+
+def _has_archive(conn: sqlite3.Connection) -> bool:
+    return any(row[1] == "archive" for row in conn.execute("PRAGMA database_list"))
+
+
+async def copy_orders_to_archive(
+    db: aiosqlite.Connection, older_than: int, batch_size: int = 500
+) -> list[int]:
+    """Copy up to batch_size finished orders created before older_than into the archive.
+
+    The first half of archiving: copies each receipt with its line items, notified
+    reviews and shipping reminders, and returns the receipt IDs copied. Only
+    receipts that are closed, notified and in a final status qualify. Writes only
+    to the archive, so run it as its own write job and pass the IDs to
+    delete_archived_orders() once it has committed: in WAL mode a transaction
+    spanning both files isn't atomic, and a crash between their commits must not
+    lose rows. Rows are written with INSERT OR IGNORE, so orders copied but never
+    deleted are simply picked up again next time. Returns [] when ARCHIVE_DB_PATH
+    isn't attached.
+    """
+    return await run(db, _copy_orders_to_archive, older_than, batch_size)
+
+
+def _copy_orders_to_archive(conn: sqlite3.Connection, older_than: int, batch_size: int) -> list[int]:
+    if not _has_archive(conn):
+        return []
+    codes = ",".join("?" * len(_ARCHIVABLE_STATUS_CODES))
+    receipt_ids = [
+        row[0]
+        for row in conn.execute(
+            f"""
+            SELECT receipt_id FROM receipts
+            WHERE create_timestamp < ? AND is_open = 0 AND notified_at IS NOT NULL
+              AND status_code IN ({codes})
+            LIMIT ?
+            """,
+            (older_than, *_ARCHIVABLE_STATUS_CODES, batch_size),
+        )
+    ]
+    if not receipt_ids:
+        return []
+    ids = ",".join("?" * len(receipt_ids))
+
+    def copy(table: str, where: str) -> None:
+        columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA main.table_info({table})"))
+        conn.execute(
+            f"INSERT OR IGNORE INTO archive.{table} ({columns}) "
+            f"SELECT {columns} FROM main.{table} WHERE {where}",
+            receipt_ids,
+        )
+
+    copy("receipts", f"receipt_id IN ({ids})")
+    copy("transactions", f"receipt_id IN ({ids})")
+    copy("shipping_reminders", f"receipt_id IN ({ids})")
+    copy(
+        "reviews",
+        f"notified_at IS NOT NULL AND transaction_id IN "
+        f"(SELECT transaction_id FROM main.transactions WHERE receipt_id IN ({ids}))",
+    )
+    return receipt_ids
+
+
+async def delete_archived_orders(db: aiosqlite.Connection, receipt_ids: list[int]) -> int:
+    """Remove orders copied by copy_orders_to_archive() from the main database.
+
+    The second half of archiving. Only receipts and reviews already in the archive
+    are deleted, and their IDs go into archived_ids so the rollups (daily_sales,
+    listing_sales, buyers) keep counting them and a re-fetch from Etsy doesn't
+    bring them back. Writes only to the main database. Returns how many receipts
+    were removed; 0 when ARCHIVE_DB_PATH isn't attached.
+    """
+    return await run(db, _delete_archived_orders, receipt_ids)
+
+
+def _delete_archived_orders(conn: sqlite3.Connection, receipt_ids: list[int]) -> int:
+    if not receipt_ids or not _has_archive(conn):
+        return 0
+    ids = ",".join("?" * len(receipt_ids))
+    receipt_ids = [
+        row[0]
+        for row in conn.execute(
+            f"SELECT receipt_id FROM archive.receipts WHERE receipt_id IN ({ids})", receipt_ids
+        )
+    ]
+    if not receipt_ids:
+        return 0
+    ids = ",".join("?" * len(receipt_ids))
+    review_ids = [
+        row[0]
+        for row in conn.execute(
+            f"""
+            SELECT transaction_id FROM archive.reviews WHERE transaction_id IN (
+                SELECT transaction_id FROM main.transactions WHERE receipt_id IN ({ids})
+            )
+            """,
+            receipt_ids,
+        )
+    ]
+    review_marks = ",".join("?" * len(review_ids))
+
+    conn.executemany(
+        "INSERT OR IGNORE INTO archived_ids (tbl, id) VALUES (?, ?)",
+        [("receipts", rid) for rid in receipt_ids] + [("reviews", tid) for tid in review_ids],
+    )
+    # Children first: they reference the receipts
+    if review_ids:
+        conn.execute(f"DELETE FROM main.reviews WHERE transaction_id IN ({review_marks})", review_ids)
+    conn.execute(f"DELETE FROM main.shipping_reminders WHERE receipt_id IN ({ids})", receipt_ids)
+    conn.execute(f"DELETE FROM main.transactions WHERE receipt_id IN ({ids})", receipt_ids)
+    conn.execute(f"DELETE FROM main.receipts WHERE receipt_id IN ({ids})", receipt_ids)
+    return len(receipt_ids)
+
+
+# ── Order search ──────────────────────────────────────────────────────────────
+
+def _fts_match(shop_id: int, text: str, column: str | None = None) -> str | None:
+    """Build an orders_fts MATCH expression: every word of `text` as a prefix, within one shop.
+
+    Only word characters are kept, so user input can never inject FTS5 syntax.
+    Returns None when `text` has no words.
+    """
+    words = re.findall(r"\w+", text)
+    if not words:
+        return None
+    terms = " ".join(f'"{word}"*' for word in words)
+    if column:
+        terms = f"{column} : ({terms})"
+    return f'shop : "s{shop_id}" AND ({terms})'
+
+
+async def search_orders(
+    db: aiosqlite.Connection, shop_id: int, query: str, limit: int = 10
 ) -> list:
-    """Return recent paid receipts for a buyer matched by name (case-insensitive)."""
+    """Full-text search a shop's orders, best match first.
+
+    Matches receipt ID, buyer name, city, gift message, item titles, variations and
+    personalization, each word of `query` as a prefix. Archived orders aren't searched.
+    """
+    match = _fts_match(shop_id, query)
+    if match is None:
+        return []
     cursor = await db.execute(
         """
-        SELECT r.receipt_id, r.name, r.create_timestamp,
-               GROUP_CONCAT(t.title, ', ') AS items
-        FROM receipts r
-        LEFT JOIN transactions t ON t.receipt_id = r.receipt_id AND t.shop_id = r.shop_id
-        WHERE r.shop_id = ? AND LOWER(r.name) = LOWER(?) AND r.is_paid = 1
-        GROUP BY r.receipt_id
-        ORDER BY r.create_timestamp DESC
+        SELECT r.receipt_id, r.name, r.city, r.status, r.is_shipped, r.create_timestamp,
+               r.grandtotal_amount, r.grandtotal_divisor, r.grandtotal_currency,
+               f.items, f.personalization
+        FROM orders_fts f
+        JOIN receipts r ON r.receipt_id = f.rowid
+        WHERE orders_fts MATCH ?
+        ORDER BY f.rank
         LIMIT ?
         """,
-        (shop_id, buyer_name, limit),
+        (match, limit),
     )
     return await cursor.fetchall()
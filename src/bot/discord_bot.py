@@ -1,17 +1,23 @@
 import asyncio
 import datetime
+import functools
+import hashlib
+import importlib
+import json
 import os
 import secrets
 import time
 import zoneinfo
+from typing import TYPE_CHECKING, Any
 
 import anthropic
 import discord
 from discord.ext import tasks
 from dotenv import load_dotenv
 
-from src.bot import db
-from src.bot.notifier import build_backlog_embed, build_bestsellers_embed, build_connected_embed, build_digest_embed, build_disconnect_embed, build_goal_milestone_embed, build_label_dm_embed, build_label_public_embed, build_order_embed, build_out_of_stock_embed, build_review_embed, build_shipping_reminder_embed, build_shop_embed, build_status_change_embed, build_welcome_embed
+from src import schema
+from src.bot.cache import LRUDict
+from src.bot.notifier import build_backlog_embed, build_bestsellers_embed, build_connected_embed, build_digest_embed, build_disconnect_embed, build_goal_milestone_embed, build_label_dm_embed, build_label_public_embed, build_order_embed, build_out_of_stock_embed, build_review_embed, build_search_results_embed, build_shipping_reminder_embed, build_shop_embed, build_status_change_embed, build_welcome_embed
 from src.etsy.client import EtsyClient
 from src.shippo.client import ShippoClient
 from src.usps.client import USPSAddressVerificationError, USPSClient
@@ -26,14 +32,70 @@ _anthropic: anthropic.Anthropic | None = None
 if ANTHROPIC_API_KEY:
     _anthropic = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, timeout=30.0)
 POLL_INTERVAL_SECS = int(os.getenv("POLL_INTERVAL_SECS", "60"))
+# How often the bot checks for shops the web server just connected, and how often it
+# re-reads every connected guild as a safety net
+GUILD_EVENT_POLL_SECS = float(os.getenv("GUILD_EVENT_POLL_SECS", "2"))
+GUILD_RESYNC_SECS = int(os.getenv("GUILD_RESYNC_SECS", "600"))
 DB_PATH_ENV = os.getenv("DB_PATH", "./shopkeep.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+# Read-only connections for slash commands and autocompletes (see db.get_read_db())
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+# DB_LAYOUT=per_shop gives every shop its own SQLite file under SHOP_DB_DIR so shops don't
+# share a write lock. The shops this process polls stay open; at most SHOP_DB_CACHE_SIZE
+# others (e.g. opened by slash commands) are kept open on top of them.
+DB_LAYOUT = os.getenv("DB_LAYOUT", "single")
+SHOP_DB_DIR = os.getenv("SHOP_DB_DIR", os.path.join(os.path.dirname(DB_PATH_ENV) or ".", "shops"))
+SHOP_DB_CACHE_SIZE = int(os.getenv("SHOP_DB_CACHE_SIZE", "64"))
+# Storage: SQLite at DB_PATH by default. Set DATABASE_URL (postgresql://...) to share one
+# PostgreSQL database between shard processes and web replicas instead.
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+if TYPE_CHECKING:
+    # src/bot/pg.py mirrors this module's helpers, so type-check against it either way
+    from src.bot import db
+else:
+    db = importlib.import_module("src.bot.pg" if DATABASE_URL else "src.bot.db")
 WEB_BASE_URL = os.getenv("WEB_BASE_URL", "")
+# Sharding: leave SHARD_COUNT unset to use Discord's recommended count. To split the bot
+# into one process per shard cluster, set SHARD_COUNT on every process and SHARD_IDS
+# (comma-separated) to the shards this process should run.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(s) for s in os.getenv("SHARD_IDS", "").split(",") if s.strip()] or None
+# Lean mode trims discord.py's caches to what the bot actually uses (guild ownership,
+# channel lookups, interactions) and caps our own per-guild maps at LEAN_CACHE_SIZE entries.
+# Entries of the connected guilds this process polls are never evicted, so the cap only
+# bounds the rest (guilds that disconnected or were only looked up by a command).
+LEAN_MODE = os.getenv("LEAN_MODE", "").lower() in ("1", "true", "yes")
+LEAN_CACHE_SIZE = int(os.getenv("LEAN_CACHE_SIZE", "500"))
+# Startup tuning: how many shops are bootstrapped concurrently after a restart, and the
+# minimum gap between welcome DMs so a large backlog doesn't trip Discord's rate limits.
+BOOTSTRAP_CONCURRENCY = int(os.getenv("BOOTSTRAP_CONCURRENCY", "8"))
+WELCOME_DM_INTERVAL_SECS = float(os.getenv("WELCOME_DM_INTERVAL_SECS", "1.0"))
+# Gap between per-guild command syncs when stale guild commands are cleared after a
+# command tree change
+GUILD_SYNC_INTERVAL_SECS = float(os.getenv("GUILD_SYNC_INTERVAL_SECS", "1.0"))
+# Retention: finished orders older than RETENTION_DAYS move to ARCHIVE_DB_PATH, keeping
+# the hot database small. 0 disables archiving; an existing archive is still read.
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "./shopkeep-archive.db")
+# SQLite tuning: SQLITE_PRAGMAS overrides schema.PRAGMA_PROFILE (e.g. "mmap_size=0,cache_size=-4000").
+# WALs are checkpointed every CHECKPOINT_INTERVAL_SECS and truncated past WAL_TRUNCATE_MB.
+SQLITE_PRAGMAS = os.getenv("SQLITE_PRAGMAS", "")
+CHECKPOINT_INTERVAL_SECS = int(os.getenv("CHECKPOINT_INTERVAL_SECS", "300"))
+WAL_TRUNCATE_MB = int(os.getenv("WAL_TRUNCATE_MB", "64"))
+# Daily ANALYZE/optimize and incremental vacuum, at MAINTENANCE_HOUR UTC for at most
+# MAINTENANCE_BUDGET_SECS
+MAINTENANCE_HOUR = int(os.getenv("MAINTENANCE_HOUR", "4"))
+MAINTENANCE_BUDGET_SECS = int(os.getenv("MAINTENANCE_BUDGET_SECS", "60"))
+RETENTION_BATCH_SIZE = 500
 
 _usps_client: USPSClient | None = None
 if os.getenv("USPS_CLIENT_ID") and os.getenv("USPS_CLIENT_SECRET"):
     _usps_client = USPSClient(os.environ["USPS_CLIENT_ID"], os.environ["USPS_CLIENT_SECRET"])
 
 SETUP_TOKEN_TTL = 86400  # 24 hours
+_COMMAND_TREE_HASH_KEY = "command_tree_hash"
+# Per shard cluster: the tree hash that cluster last cleared its guilds' commands for
+_GUILD_COMMANDS_HASH_KEY = "guild_commands_hash"
 
 
 _ORDERS_PAGE_SIZE = 5
@@ -162,10 +224,13 @@ class DraftView(discord.ui.View):
 
 
 class ConfirmDisconnectView(discord.ui.View):
-    def __init__(self, bot: "ShopkeepBot", guild_id: int, shop_name: str, channel_id: int | None):
+    def __init__(
+        self, bot: "ShopkeepBot", guild_id: int, shop_id: int, shop_name: str, channel_id: int | None
+    ):
         super().__init__(timeout=60)
         self.bot = bot
         self.guild_id = guild_id
+        self.shop_id = shop_id
         self.shop_name = shop_name
         self.channel_id = channel_id
 
@@ -173,13 +238,14 @@ class ConfirmDisconnectView(discord.ui.View):
     async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
         setup_token = secrets.token_urlsafe(16)
         setup_token_exp = int(time.time()) + SETUP_TOKEN_TTL
-        async with db.get_db() as conn:
-            await db.disconnect_guild(conn, self.guild_id, setup_token, setup_token_exp)
-            await conn.commit()
+        await db.write(db.disconnect_guild, self.guild_id, setup_token, setup_token_exp)
 
         self.bot.etsy_clients.pop(self.guild_id, None)
+        self.bot._connected_guilds.pop(self.guild_id, None)
         self.bot._bootstrapped_guilds.discard(self.guild_id)
         self.bot._last_polled.pop(self.guild_id, None)
+        if await db.drop_shop_database(self.shop_id):
+            print(f"[disconnect] Deleted data for shop={self.shop_id}")
 
         self.stop()
         await interaction.response.edit_message(
@@ -354,20 +420,18 @@ class ShippoAddressModal(discord.ui.Modal, title="Ship-From Address"):
             return
         state = parts[0].upper()
         zip_code = parts[1]
-        async with db.get_db() as conn:
-            await db.save_shippo_address(
-                conn,
-                interaction.guild_id,
-                name=self.addr_name.value.strip(),
-                street1=self.street1.value.strip(),
-                street2="",
-                city=self.city.value.strip(),
-                state=state,
-                zip_code=zip_code,
-                country="US",
-                phone=self.phone.value.strip(),
-            )
-            await conn.commit()
+        await db.write(
+            db.save_shippo_address,
+            interaction.guild_id,
+            name=self.addr_name.value.strip(),
+            street1=self.street1.value.strip(),
+            street2="",
+            city=self.city.value.strip(),
+            state=state,
+            zip_code=zip_code,
+            country="US",
+            phone=self.phone.value.strip(),
+        )
         await interaction.response.send_message("Return address saved.", ephemeral=True)
 
 
@@ -685,39 +749,129 @@ def _check_guild_perm(interaction: discord.Interaction, perm: str) -> str | None
     return None
 
 
-class ShopkeepBot(discord.Client):
+class ShopkeepBot(discord.AutoShardedClient):
     def __init__(self):
         intents = discord.Intents.default()
         intents.guilds = True
-        super().__init__(intents=intents)
+        cache_options = {}
+        if LEAN_MODE:
+            # No message cache, no member cache (owners are fetched on demand when we DM
+            # them) and no member chunking when guilds become available.
+            cache_options = {
+                "max_messages": None,
+                "member_cache_flags": discord.MemberCacheFlags.none(),
+                "chunk_guilds_at_startup": False,
+            }
+        super().__init__(
+            intents=intents, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS, **cache_options
+        )
         self.tree = discord.app_commands.CommandTree(self)
-        # guild_id -> EtsyClient, populated on startup and when new guilds connect
-        self.etsy_clients: dict[int, EtsyClient] = {}
+        budget = LEAN_CACHE_SIZE if LEAN_MODE else None
+        # Polled guilds stay cached however small the budget: evicting one would rebuild
+        # its client every cycle, possibly while the old one is refreshing tokens
+        polled = self._is_polled
+        # guild_id -> EtsyClient, populated on startup and when new guilds connect.
+        # Evicted clients are rebuilt from stored tokens the next time they're needed.
+        # They aren't closed on eviction: a poll may still be using one in an executor
+        # thread, and its session is released once the last reference goes.
+        self.etsy_clients: LRUDict[int, EtsyClient] = LRUDict(budget, pinned=polled)
         self._bootstrapped_guilds: set[int] = set()
+        self._bootstrapping: set[int] = set()
         self._bootstrapped = False
-        self._last_polled: dict[int, int] = {}
+        # guild_id -> guilds row for every connected guild this process polls. Kept up
+        # to date by guild events, /setchannel and /disconnect, and re-read every
+        # GUILD_RESYNC_SECS.
+        self._connected_guilds: dict[int, Any] = {}
+        self._guild_resync_at = 0.0
+        self._guild_event_id = 0
+        self._last_polled: LRUDict[int, int] = LRUDict(budget, pinned=polled)
         self._poll_tick: int = 0
+        self._tree_changed = False
+        # (guild, setup_token) pairs waiting for a welcome DM to the owner
+        self._welcome_queue: asyncio.Queue[tuple[discord.Guild, str]] = asyncio.Queue()
+        # Background tasks started by the bot itself; close() cancels whatever is left
+        self._tasks: set[asyncio.Task] = set()
+
+    def _is_polled(self, guild_id: int) -> bool:
+        return guild_id in self._connected_guilds
 
     async def setup_hook(self):
-        db.DB_PATH = DB_PATH_ENV
+        if DATABASE_URL:
+            db.DATABASE_URL = DATABASE_URL
+        else:
+            schema.configure_pragmas(SQLITE_PRAGMAS)
+            db.DB_PATH = DB_PATH_ENV
+            db.DB_LAYOUT = DB_LAYOUT
+            db.SHOP_DB_DIR = SHOP_DB_DIR
+            db.SHOP_DB_CACHE_SIZE = SHOP_DB_CACHE_SIZE
+            if RETENTION_DAYS > 0 or os.path.exists(ARCHIVE_DB_PATH):
+                db.ARCHIVE_DB_PATH = ARCHIVE_DB_PATH
         await db.init_db()
+        await db.open_pool(DB_POOL_SIZE, DB_READ_POOL_SIZE)
 
-        loop = asyncio.get_running_loop()
         async with db.get_db() as conn:
-            guilds = await db.get_connected_guilds(conn)
-            for guild_row in guilds:
-                tokens = await db.get_guild_tokens(conn, guild_row["guild_id"])
-                if tokens:
-                    self._register_client(
-                        loop,
-                        guild_row["guild_id"],
-                        tokens["access_token"],
-                        tokens["refresh_token"],
-                        tokens["expires_at"],
-                    )
+            self._guild_event_id = await db.get_last_guild_event_id(conn)
+        await self._load_connected_guilds()
 
         self._setup_slash_commands()
-        await self.tree.sync()
+        await self._sync_commands_if_changed()
+        self._spawn(self._welcome_dm_worker())
+        self.retention.start()
+        self.checkpoints.start()
+        self.maintenance.start()
+
+    async def close(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await super().close()
+        await db.close_pool()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        """Run coro in the background, holding a reference to it until it finishes."""
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _command_tree_hash(self) -> str:
+        payload = [cmd.to_dict(self.tree) for cmd in self.tree.get_commands()]
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    def _guild_commands_hash_key(self) -> str:
+        shards = "all" if self.shard_ids is None else ",".join(map(str, sorted(self.shard_ids)))
+        return f"{_GUILD_COMMANDS_HASH_KEY}:{shards}"
+
+    async def _sync_commands_if_changed(self) -> None:
+        """Upload the global command tree only when it differs from the last synced one.
+
+        Each shard cluster also tracks the tree it last cleared its own guilds' commands
+        for, and clears them again (see _clear_guild_commands()) when that differs.
+        """
+        tree_hash = self._command_tree_hash()
+        async with db.get_db() as conn:
+            synced_hash = await db.get_bot_state(conn, _COMMAND_TREE_HASH_KEY)
+            cleared_hash = await db.get_bot_state(conn, self._guild_commands_hash_key())
+        self._tree_changed = tree_hash != cleared_hash
+        if tree_hash == synced_hash:
+            print("[commands] Command tree unchanged — skipping sync")
+            return
+        # Global commands only need uploading once, so in a multi-process cluster only the
+        # process running shard 0 syncs them.
+        if self.shard_ids is None or 0 in self.shard_ids:
+            await self.tree.sync()
+            await db.write(db.set_bot_state, _COMMAND_TREE_HASH_KEY, tree_hash)
+            print(f"[commands] Synced command tree {tree_hash[:12]}")
+
+    def _shard_filter(self) -> tuple[int | None, list[int] | None]:
+        """Return (shard_count, shard_ids) limiting work to the guilds this process owns.
+
+        (None, None) means this process runs every shard, so no filtering is needed.
+        Interactions and gateway events are already routed to the owning shard by Discord.
+        """
+        if self.shard_ids is None:
+            return None, None
+        return self.shard_count, list(self.shard_ids)
 
     def _register_client(
         self,
@@ -749,70 +903,134 @@ class ShopkeepBot(discord.Client):
     async def _save_guild_tokens(
         self, guild_id: int, access_token: str, refresh_token: str, expires_at: int
     ) -> None:
+        await db.write(db.save_guild_tokens, guild_id, access_token, refresh_token, expires_at)
+
+    async def _ensure_client(self, guild_id: int) -> EtsyClient | None:
+        """Return the guild's EtsyClient, rebuilding it from stored tokens if it was evicted."""
+        etsy = self.etsy_clients.get(guild_id)
+        if etsy:
+            return etsy
         async with db.get_db() as conn:
-            await db.save_guild_tokens(conn, guild_id, access_token, refresh_token, expires_at)
+            tokens = await db.get_guild_tokens(conn, guild_id)
+        if not tokens:
+            return None
+        return self._register_client(
+            asyncio.get_running_loop(),
+            guild_id,
+            tokens["access_token"],
+            tokens["refresh_token"],
+            tokens["expires_at"],
+        )
+
+    async def _get_owner(self, guild: discord.Guild) -> discord.abc.User | None:
+        """Return the guild owner, fetching them from the API when the member cache is off."""
+        if guild.owner:
+            return guild.owner
+        if guild.owner_id is None:
+            return None
+        try:
+            return await self.fetch_user(guild.owner_id)
+        except discord.HTTPException:
+            return None
 
     # ── Lifecycle ─────────────────────────────────────────────────────────────
 
     async def on_ready(self):
-        print(f"Logged in as {self.user} | {len(self.etsy_clients)} shop(s) connected")
-        # Sync commands to each guild immediately (guild sync is instant vs. up to 1h for global)
-        for guild in self.guilds:
-            await self.tree.sync(guild=guild)
+        shards = self.shard_ids if self.shard_ids is not None else list(range(self.shard_count or 1))
+        print(
+            f"Logged in as {self.user} | shards {shards} of {self.shard_count} | "
+            f"{len(self.etsy_clients)} shop(s) connected"
+        )
         if not self._bootstrapped:
             self._bootstrapped = True
             await self._register_existing_guilds()
-            async with db.get_db() as conn:
-                guild_rows = await db.get_connected_guilds(conn)
-            for row in guild_rows:
+            self._spawn(self._startup_bootstrap())
+
+    async def _startup_bootstrap(self) -> None:
+        """Bootstrap connected shops concurrently, then start polling.
+
+        Runs in the background so on_ready returns immediately; the poll loop starts once
+        every shop has been marked seen, so a restart never re-announces old orders.
+        """
+        if self._tree_changed:
+            self._spawn(self._clear_guild_commands())
+        guild_rows = list(self._connected_guilds.values())
+
+        started = time.monotonic()
+        semaphore = asyncio.Semaphore(BOOTSTRAP_CONCURRENCY)
+
+        async def bootstrap(row) -> None:
+            async with semaphore:
                 try:
                     await self._bootstrap_guild(row["guild_id"], row["etsy_shop_id"])
                 except Exception as exc:
                     print(f"[bootstrap] guild={row['guild_id']} {exc}")
                 finally:
                     self._bootstrapped_guilds.add(row["guild_id"])
-            self.poll_orders.start()
+
+        await asyncio.gather(*(bootstrap(row) for row in guild_rows))
+        print(f"[bootstrap] {len(guild_rows)} shop(s) ready in {time.monotonic() - started:.1f}s")
+        self.poll_orders.start()
+        self.guild_events.start()
+
+    async def _clear_guild_commands(self) -> None:
+        """Remove stale guild-scoped commands after the tree changes, one guild at a time.
+
+        All commands are global; this only cleans up guild copies left by older releases.
+        Every process clears the guilds on its own shards and then records the tree hash
+        under its cluster's key, so an interrupted run starts over on the next restart.
+        """
+        for guild in list(self.guilds):
+            try:
+                await self.tree.sync(guild=guild)
+            except discord.HTTPException as exc:
+                print(f"[commands] guild sync failed guild={guild.id} {exc}")
+            await asyncio.sleep(GUILD_SYNC_INTERVAL_SECS)
+        await db.write(db.set_bot_state, self._guild_commands_hash_key(), self._command_tree_hash())
 
     async def _register_existing_guilds(self) -> None:
         """Create guild rows for any Discord servers the bot is already in but hasn't seen before.
         This handles guilds that were joined before multi-tenant support, or while the bot was offline.
+        All new rows are written in one transaction; welcome DMs are queued.
         """
-        for guild in self.guilds:
-            async with db.get_db() as conn:
-                existing = await db.get_guild(conn, guild.id)
-                if existing:
-                    continue
-                setup_token = secrets.token_urlsafe(16)
-                setup_token_exp = int(time.time()) + SETUP_TOKEN_TTL
-                await db.create_guild(conn, guild.id, guild.name, setup_token, setup_token_exp)
-                await conn.commit()
+        async with db.get_db() as conn:
+            known = await db.get_guild_ids(conn)
+        new_guilds = [g for g in self.guilds if g.id not in known]
+        if not new_guilds:
+            return
+        setup_token_exp = int(time.time()) + SETUP_TOKEN_TTL
+        rows = [(g.id, g.name, secrets.token_urlsafe(16), setup_token_exp) for g in new_guilds]
+        await db.write(db.create_guilds, rows)  # INSERT OR IGNORE, so a racing join is harmless
 
+        for guild, (_, _, setup_token, _) in zip(new_guilds, rows, strict=True):
             print(f"[register] New guild found: '{guild.name}' ({guild.id})")
-            if WEB_BASE_URL and guild.owner:
-                try:
+            self._welcome_queue.put_nowait((guild, setup_token))
+
+    async def _welcome_dm_worker(self) -> None:
+        """Send queued welcome DMs to guild owners, spaced WELCOME_DM_INTERVAL_SECS apart."""
+        while True:
+            guild, setup_token = await self._welcome_queue.get()
+            try:
+                owner = await self._get_owner(guild) if WEB_BASE_URL else None
+                if owner:
                     setup_url = f"{WEB_BASE_URL}/connect/{setup_token}"
-                    embed = build_welcome_embed(guild.name, setup_url)
-                    await guild.owner.send(embed=embed)
-                except discord.Forbidden:
-                    pass
+                    await owner.send(embed=build_welcome_embed(guild.name, setup_url))
+            except discord.Forbidden:
+                pass  # Owner has DMs disabled
+            except Exception as exc:
+                print(f"[welcome] guild={guild.id} {exc}")
+            finally:
+                self._welcome_queue.task_done()
+            await asyncio.sleep(WELCOME_DM_INTERVAL_SECS)
 
     async def on_guild_join(self, guild: discord.Guild):
         setup_token = secrets.token_urlsafe(16)
         setup_token_exp = int(time.time()) + SETUP_TOKEN_TTL
 
-        async with db.get_db() as conn:
-            await db.create_guild(conn, guild.id, guild.name, setup_token, setup_token_exp)
-            await conn.commit()
+        await db.write(db.create_guild, guild.id, guild.name, setup_token, setup_token_exp)
 
         print(f"[guild_join] Joined '{guild.name}' ({guild.id})")
-
-        if WEB_BASE_URL and guild.owner:
-            try:
-                setup_url = f"{WEB_BASE_URL}/connect/{setup_token}"
-                embed = build_welcome_embed(guild.name, setup_url)
-                await guild.owner.send(embed=embed)
-            except discord.Forbidden:
-                pass  # Owner has DMs disabled
+        self._welcome_queue.put_nowait((guild, setup_token))
 
     # ── Bootstrap ─────────────────────────────────────────────────────────────
 
@@ -839,19 +1057,15 @@ class ShopkeepBot(discord.Client):
         receipts = receipts_resp.get("results", [])
         reviews = reviews_resp.get("results", [])
 
-        async with db.get_db() as conn:
-            await db.upsert_shop(conn, shop_data)
-            await db.upsert_listings(conn, listings)
-            for receipt in receipts:
-                receipt.setdefault("shop_id", shop_id)
-                await db.upsert_receipt(conn, receipt, already_seen=True)
-                await db.upsert_transactions(
-                    conn, receipt["receipt_id"], shop_id, receipt.get("transactions", [])
-                )
-            for review in reviews:
-                review["shop_id"] = shop_id
-                await db.upsert_review(conn, review, already_seen=True)
-            await conn.commit()
+        for receipt in receipts:
+            receipt.setdefault("shop_id", shop_id)
+        for review in reviews:
+            review["shop_id"] = shop_id
+
+        await db.write_shop(
+            shop_id, db.ingest_shop_page, shop_id, shop_data, listings, receipts, reviews,
+            already_seen=True,
+        )
 
         shop_name = shop_data.get("shop_name", "")
         print(
@@ -861,52 +1075,99 @@ class ShopkeepBot(discord.Client):
         )
         return shop_name
 
+    # ── Retention ─────────────────────────────────────────────────────────────
+
+    @tasks.loop(hours=6)
+    async def retention(self):
+        """Expire stale OAuth states and move old finished orders to the archive."""
+        now = int(time.time())
+        await db.write(db.delete_expired_pkce_states, now)
+        await db.write(db.delete_guild_events, now - 86400)
+        if RETENTION_DAYS <= 0:
+            return
+        cutoff = now - RETENTION_DAYS * 86400
+        writers = [db.write]
+        if db.DB_LAYOUT == "per_shop":
+            shop_ids = sorted({row["etsy_shop_id"] for row in self._connected_guilds.values()})
+            writers = [functools.partial(db.write_shop, shop_id) for shop_id in shop_ids]
+        total = 0
+        for write in writers:
+            while True:
+                # One batch per write job keeps each transaction (and lock hold) short.
+                # The copy commits before the delete starts, so a crash in between
+                # leaves the orders in both databases rather than in neither.
+                receipt_ids = await write(db.copy_orders_to_archive, cutoff, RETENTION_BATCH_SIZE)
+                if receipt_ids:
+                    total += await write(db.delete_archived_orders, receipt_ids)
+                if len(receipt_ids) < RETENTION_BATCH_SIZE:
+                    break
+        if total:
+            print(f"[retention] Archived {total} order(s) older than {RETENTION_DAYS} day(s)")
+
+    @retention.before_loop
+    async def before_retention(self):
+        await self.wait_until_ready()
+
+    @tasks.loop(seconds=CHECKPOINT_INTERVAL_SECS)
+    async def checkpoints(self):
+        """Checkpoint the SQLite WALs, which constant poll writes and open readers grow."""
+        results = await db.checkpoint_databases(WAL_TRUNCATE_MB * 1024 * 1024)
+        wal_bytes = sum(r["wal_bytes"] for r in results)
+        if not wal_bytes:
+            return
+        truncated = sum(r["mode"] == "TRUNCATE" for r in results)
+        busy = sum(r["busy"] for r in results)
+        print(
+            f"[checkpoint] {len(results)} database(s), WAL {wal_bytes / 1024 / 1024:.1f} MB, "
+            f"{truncated} truncated, {busy} busy"
+        )
+
+    @tasks.loop(time=datetime.time(hour=MAINTENANCE_HOUR, tzinfo=datetime.timezone.utc))
+    async def maintenance(self):
+        """Refresh query planner statistics and reclaim free pages in a quiet hour."""
+        shop_ids = []
+        if db.DB_LAYOUT == "per_shop":
+            shop_ids = sorted({row["etsy_shop_id"] for row in self._connected_guilds.values()})
+        start = time.monotonic()
+        results = await db.maintain_databases(shop_ids, MAINTENANCE_BUDGET_SECS)
+        for r in results:
+            if r["bytes_after"] != r["bytes_before"]:
+                print(
+                    f"[maintenance] {os.path.basename(r['path'])}: "
+                    f"{r['bytes_before'] / 1024 / 1024:.1f} MB -> {r['bytes_after'] / 1024 / 1024:.1f} MB "
+                    f"in {r['seconds']:.1f}s"
+                )
+        if results:
+            free = sum(r["free_bytes_after"] for r in results)
+            print(
+                f"[maintenance] {len(results)}/{len(shop_ids) + 1} database(s) in "
+                f"{time.monotonic() - start:.1f}s, {free / 1024 / 1024:.1f} MB still free"
+            )
+
+    @maintenance.before_loop
+    async def before_maintenance(self):
+        await self.wait_until_ready()
+
     # ── Poll loop ─────────────────────────────────────────────────────────────
 
     @tasks.loop(seconds=POLL_INTERVAL_SECS)
     async def poll_orders(self):
-        loop = asyncio.get_running_loop()
-        async with db.get_db() as conn:
-            guild_rows = await db.get_connected_guilds(conn)
-            for row in guild_rows:
-                guild_id = row["guild_id"]
-                tokens = await db.get_guild_tokens(conn, guild_id)
-                if not tokens:
-                    continue
-                existing = self.etsy_clients.get(guild_id)
-                if existing is None or existing.access_token != tokens["access_token"]:
-                    self._register_client(
-                        loop, guild_id,
-                        tokens["access_token"], tokens["refresh_token"], tokens["expires_at"],
-                    )
+        if time.monotonic() - self._guild_resync_at >= GUILD_RESYNC_SECS:
+            await self._load_connected_guilds()
+        guild_rows = list(self._connected_guilds.values())
+        if db.DB_LAYOUT == "per_shop":
+            db.pin_shops(row["etsy_shop_id"] for row in guild_rows)
 
         for row in guild_rows:
-            guild_id = row["guild_id"]
-            if guild_id in self.etsy_clients and guild_id not in self._bootstrapped_guilds:
-                try:
-                    shop_name = await self._bootstrap_guild(guild_id, row["etsy_shop_id"])
-                    if shop_name:
-                        if row["order_channel_id"]:
-                            channel = self.get_channel(row["order_channel_id"])
-                            if channel:
-                                await channel.send(embed=build_connected_embed(shop_name))
-                        else:
-                            guild = self.get_guild(guild_id)
-                            if guild and guild.owner:
-                                try:
-                                    await guild.owner.send(embed=build_connected_embed(shop_name, no_channel=True))
-                                except discord.Forbidden:
-                                    pass
-                except Exception as exc:
-                    print(f"[poller] bootstrap guild={guild_id} {exc}")
-                finally:
-                    self._bootstrapped_guilds.add(guild_id)
+            if row["guild_id"] not in self._bootstrapped_guilds:
+                await self._bootstrap_new_guild(row)
 
         self._poll_tick += 1
 
         await asyncio.gather(*(
             self._safe_poll_guild(row["guild_id"], row["etsy_shop_id"], row["order_channel_id"])
             for row in guild_rows
+            if row["guild_id"] in self._bootstrapped_guilds
         ))
 
     async def _safe_poll_guild(self, guild_id: int, shop_id: int, channel_id: int) -> None:
@@ -919,8 +1180,124 @@ class ShopkeepBot(discord.Client):
     async def before_poll(self):
         await self.wait_until_ready()
 
+    async def _bootstrap_new_guild(self, row) -> None:
+        """Bootstrap a newly connected guild and announce it in its order channel.
+
+        Both the poll loop and guild events call this; a guild is only polled once
+        its bootstrap has marked the existing orders seen. If the bootstrap fails the
+        guild stays unpolled and the next poll cycle tries again.
+        """
+        guild_id = row["guild_id"]
+        if guild_id in self._bootstrapping or await self._ensure_client(guild_id) is None:
+            return
+        self._bootstrapping.add(guild_id)
+        try:
+            shop_name = await self._bootstrap_guild(guild_id, row["etsy_shop_id"])
+        except Exception as exc:
+            print(f"[poller] bootstrap guild={guild_id} {exc}")
+            return
+        finally:
+            self._bootstrapping.discard(guild_id)
+        self._bootstrapped_guilds.add(guild_id)
+        if not shop_name:
+            return
+
+        try:
+            if row["order_channel_id"]:
+                channel = self.get_channel(row["order_channel_id"])
+                if channel:
+                    await channel.send(embed=build_connected_embed(shop_name))
+            else:
+                guild = self.get_guild(guild_id)
+                owner = await self._get_owner(guild) if guild else None
+                if owner:
+                    await owner.send(embed=build_connected_embed(shop_name, no_channel=True))
+        except discord.Forbidden:
+            pass
+        except Exception as exc:
+            print(f"[poller] connected notice guild={guild_id} {exc}")
+
+    # ── Connected guilds ──────────────────────────────────────────────────────
+
+    def _owns_guild(self, guild_id: int) -> bool:
+        shard_count, shard_ids = self._shard_filter()
+        if shard_ids is None or shard_count is None:
+            return True
+        return (guild_id >> 22) % shard_count in shard_ids
+
+    async def _load_connected_guilds(self) -> None:
+        """Re-read every connected guild this process owns, and their tokens.
+
+        Guild events, /setchannel and /disconnect keep the registry current between
+        runs; this catches anything they missed, e.g. edits made by hand.
+        """
+        loop = asyncio.get_running_loop()
+        async with db.get_db() as conn:
+            guild_rows = await db.get_connected_guilds(conn, *self._shard_filter())
+            # Before registering clients, so the LRU budget doesn't evict the new ones
+            self._connected_guilds = {row["guild_id"]: row for row in guild_rows}
+            for row in guild_rows:
+                guild_id = row["guild_id"]
+                tokens = await db.get_guild_tokens(conn, guild_id)
+                if not tokens:
+                    continue
+                existing = self.etsy_clients.get(guild_id)
+                if existing is None or existing.access_token != tokens["access_token"]:
+                    self._register_client(
+                        loop, guild_id,
+                        tokens["access_token"], tokens["refresh_token"], tokens["expires_at"],
+                    )
+        self._guild_resync_at = time.monotonic()
+
+    async def _refresh_guild(self, guild_id: int) -> None:
+        """Re-read one guild after it changed, adding it to or dropping it from the registry."""
+        async with db.get_db() as conn:
+            row = await db.get_guild(conn, guild_id)
+            tokens = await db.get_guild_tokens(conn, guild_id)
+        if not row or not row["etsy_shop_id"] or not row["order_channel_id"]:
+            self._connected_guilds.pop(guild_id, None)
+            return
+        previous = self._connected_guilds.get(guild_id)
+        if previous is not None and previous["etsy_shop_id"] != row["etsy_shop_id"]:
+            self._bootstrapped_guilds.discard(guild_id)  # reconnected to another shop
+        self._connected_guilds[guild_id] = row
+        existing = self.etsy_clients.get(guild_id)
+        if tokens and (existing is None or existing.access_token != tokens["access_token"]):
+            self._register_client(
+                asyncio.get_running_loop(), guild_id,
+                tokens["access_token"], tokens["refresh_token"], tokens["expires_at"],
+            )
+
+    @tasks.loop(seconds=GUILD_EVENT_POLL_SECS)
+    async def guild_events(self):
+        """Pick up shops the web server connected and bootstrap them straight away.
+
+        The cursor only moves past an event once it has been applied; an event that
+        fails is retried, in order, on the next run.
+        """
+        try:
+            async with db.get_db() as conn:
+                events = await db.get_guild_events(conn, self._guild_event_id)
+        except Exception as exc:
+            print(f"[events] {exc}")
+            return
+        for event in events:
+            guild_id = event["guild_id"]
+            if not self._owns_guild(guild_id):
+                self._guild_event_id = event["event_id"]
+                continue
+            try:
+                await self._refresh_guild(guild_id)
+            except Exception as exc:
+                print(f"[events] guild={guild_id} {exc}")
+                return
+            self._guild_event_id = event["event_id"]
+            row = self._connected_guilds.get(guild_id)
+            if row is not None and guild_id not in self._bootstrapped_guilds:
+                await self._bootstrap_new_guild(row)
+
     async def _poll_guild(self, guild_id: int, shop_id: int, channel_id: int) -> None:
-        etsy = self.etsy_clients.get(guild_id)
+        etsy = await self._ensure_client(guild_id)
         if not etsy:
             return
 
@@ -938,94 +1315,85 @@ class ShopkeepBot(discord.Client):
         channel = self.get_channel(channel_id)
         shop_name = shop_data.get("shop_name", "My Shop")
 
-        async with db.get_db() as conn:
-            await db.upsert_shop(conn, shop_data)
+        # The upserts report old and new quantity/status for every row they changed,
+        # so zero-crossings and status changes fall out of the write itself.
+        for receipt in receipts:
+            receipt.setdefault("shop_id", shop_id)
 
-            # Snapshot listing quantities before upsert to detect zero-crossings
-            listing_ids = [l["listing_id"] for l in listings]
-            qty_snapshot = await db.get_listing_quantity_snapshot(conn, listing_ids)
-            await db.upsert_listings(conn, listings)
-            await conn.commit()
+        listing_changes, receipt_changes = await db.write_shop(
+            shop_id, db.ingest_shop_page, shop_id, shop_data, listings, receipts
+        )
 
-            if channel:
-                for listing in listings:
-                    lid = listing["listing_id"]
-                    old_qty = qty_snapshot.get(lid)
-                    new_qty = listing.get("quantity", 0)
-                    # Only fire if listing was previously known (old_qty is not None),
-                    # had stock, and now has none
-                    if old_qty is not None and old_qty > 0 and new_qty == 0:
-                        first_image = (listing.get("images") or [{}])[0]
-                        listing_row = {
-                            "listing_id": lid,
-                            "title": listing.get("title", ""),
-                            "url": listing.get("url"),
-                            "image_url": first_image.get("url_75x75") or first_image.get("url_170x135"),
-                        }
-                        await channel.send(embed=build_out_of_stock_embed(listing_row, shop_name))
-
-            # Snapshot status before upserting so we can detect changes
-            receipt_ids = [r["receipt_id"] for r in receipts]
-            old_snapshot = await db.get_receipts_status_snapshot(conn, receipt_ids)
-
-            for receipt in receipts:
-                receipt.setdefault("shop_id", shop_id)
-                await db.upsert_receipt(conn, receipt)
-                await db.upsert_transactions(
-                    conn, receipt["receipt_id"], shop_id, receipt.get("transactions", [])
-                )
-            await conn.commit()
+        if channel:
+            listings_by_id = {l["listing_id"]: l for l in listings}
+            for lid, change in listing_changes.items():
+                old_qty = change["prev_quantity"]
+                # Only fire if listing was previously known (old_qty is not None),
+                # had stock, and now has none
+                if old_qty is not None and old_qty > 0 and change["quantity"] == 0:
+                    listing = listings_by_id[lid]
+                    first_image = (listing.get("images") or [{}])[0]
+                    listing_row = {
+                        "listing_id": lid,
+                        "title": listing.get("title", ""),
+                        "url": listing.get("url"),
+                        "image_url": first_image.get("url_75x75") or first_image.get("url_170x135"),
+                    }
+                    await channel.send(embed=build_out_of_stock_embed(listing_row, shop_name))
 
             # Post status change notifications for already-seen receipts
+            for rid, change in receipt_changes.items():
+                if change["prev_status"] is None:
+                    continue  # New receipt — handled by unnotified flow below
+                receipt = raw_by_id[rid]
+                if not change["prev_is_shipped"] and change["is_shipped"]:
+                    await channel.send(embed=build_status_change_embed(receipt, shop_name, "shipped"))
+                elif change["prev_status"] != "canceled" and change["status"] == "canceled":
+                    await channel.send(embed=build_status_change_embed(receipt, shop_name, "canceled"))
+
+        # Reads below are fetched up front and the connection released before any
+        # Discord send, so a slow channel never holds a pooled connection.
+        async with db.get_shop_db(shop_id) as shop_conn:
+            # Trigger-maintained counts: idle shops skip the stages with nothing to do
+            counters = await db.get_shop_counters(shop_conn, shop_id)
+            unnotified = (
+                await db.get_unnotified_receipts(shop_conn, shop_id)
+                if counters["unnotified_receipts"]
+                else []
+            )
+        for row in unnotified:
             if channel:
-                for receipt in receipts:
-                    rid = receipt["receipt_id"]
-                    old = old_snapshot.get(rid)
-                    if old is None:
-                        continue  # New receipt — handled by unnotified flow below
-                    new_shipped = 1 if receipt.get("is_shipped") else 0
-                    new_status = receipt.get("status", "")
-                    if not old["is_shipped"] and new_shipped:
-                        await channel.send(embed=build_status_change_embed(receipt, shop_name, "shipped"))
-                    elif old["status"] != "canceled" and new_status == "canceled":
-                        await channel.send(embed=build_status_change_embed(receipt, shop_name, "canceled"))
-
-            unnotified = await db.get_unnotified_receipts(conn, shop_id)
-            for row in unnotified:
-                if channel:
-                    raw = raw_by_id.get(row["receipt_id"], {})
-                    returning = await db.is_returning_buyer(
-                        conn, shop_id, row["buyer_user_id"], row["receipt_id"]
-                    )
-                    embed = build_order_embed(
-                        dict(row),
-                        shop_name=shop_name,
-                        new=True,
-                        transactions=raw.get("transactions", []),
-                        returning=returning,
-                    )
-                    await channel.send(embed=embed)
-                    await db.mark_receipt_notified(conn, row["receipt_id"])
-                    await conn.commit()
-
-            await self._check_backlog(conn, guild_id, shop_id, channel, shop_name)
-            await self._check_goal_milestones(conn, guild_id, shop_id, channel, shop_name)
-            await self._check_digest(conn, guild_id, shop_id, channel, shop_name)
-            await self._check_shipping_reminders(conn, guild_id, shop_id, channel, shop_name)
-            await self._check_new_reviews(conn, guild_id, shop_id, channel, shop_name)
+                raw = raw_by_id.get(row["receipt_id"], {})
+                embed = build_order_embed(
+                    dict(row),
+                    shop_name=shop_name,
+                    new=True,
+                    transactions=raw.get("transactions", []),
+                    returning=bool(row["is_returning"]),
+                )
+                await channel.send(embed=embed)
+                await db.write_shop(shop_id, db.mark_receipt_notified, row["receipt_id"])
+
+        await self._check_backlog(guild_id, channel, shop_name, counters["open_orders"])
+        await self._check_goal_milestones(guild_id, shop_id, channel, shop_name)
+        await self._check_digest(guild_id, shop_id, channel, shop_name)
+        await self._check_shipping_reminders(guild_id, shop_id, channel, shop_name)
+        await self._check_new_reviews(
+            guild_id, shop_id, channel, shop_name, counters["unnotified_reviews"]
+        )
 
         self._last_polled[guild_id] = int(time.time())
 
     async def _check_digest(
         self,
-        conn,
         guild_id: int,
         shop_id: int,
         channel,
         shop_name: str,
     ) -> None:
         """Post the daily digest at the configured time, at most once per day."""
-        config = await db.get_digest_config(conn, guild_id)
+        async with db.get_db() as conn:
+            config = await db.get_digest_config(conn, guild_id)
         if not config or channel is None:
             return
 
@@ -1048,29 +1416,21 @@ class ShopkeepBot(discord.Client):
             return
 
         # Gather digest data
-        since_24h = now_ts - 86400
-        receipts_24h = await db.get_receipts_since(conn, shop_id, since_24h)
-        order_count = len(receipts_24h)
-        revenue = sum(
-            r["grandtotal_amount"] / (r["grandtotal_divisor"] or 100)
-            for r in receipts_24h
-        )
-        currency = (
-            receipts_24h[0]["grandtotal_currency"]
-            if receipts_24h
-            else await db.get_shop_currency(conn, shop_id)
-        )
-        open_count = await db.get_open_order_count(conn, shop_id)
-        due_soon = await db.get_receipts_due_within(conn, shop_id, within_seconds=2 * 86400, now=now_ts)
+        async with db.get_db() as conn:
+            goal = await db.get_goal_config(conn, guild_id)
+        async with db.get_shop_db(shop_id) as shop_conn:
+            data = await db.get_digest_data(shop_conn, shop_id, now_ts, goal)
+        order_count = data["sales_24h"]["orders"]
+        revenue = data["sales_24h"]["revenue"]
+        currency = data["currency"]
+        open_count = data["open_count"]
+        due_soon = data["due_soon"]
 
         # Include goal progress if configured
         goal_amount = goal_current = goal_pct = None
-        goal_config = await db.get_goal_config(conn, guild_id)
+        goal_config = data["goal"]
         if goal_config:
-            now_dt = datetime.datetime.now(datetime.timezone.utc)
-            month_start = datetime.datetime(now_dt.year, now_dt.month, 1, tzinfo=datetime.timezone.utc)
-            month_receipts = await db.get_receipts_since(conn, shop_id, int(month_start.timestamp()))
-            goal_current = sum(r["grandtotal_amount"] / (r["grandtotal_divisor"] or 100) for r in month_receipts)
+            goal_current = data["month_sales"]["revenue"]
             goal_amount = goal_config["amount_cents"] / 100
             goal_pct = int(goal_current / goal_amount * 100) if goal_amount > 0 else 0
 
@@ -1087,19 +1447,18 @@ class ShopkeepBot(discord.Client):
                 goal_pct=goal_pct,
             )
         )
-        await db.mark_digest_sent(conn, guild_id, now_ts)
-        await conn.commit()
+        await db.write(db.mark_digest_sent, guild_id, now_ts)
 
     async def _check_goal_milestones(
         self,
-        conn,
         guild_id: int,
         shop_id: int,
         channel,
         shop_name: str,
     ) -> None:
         """Fire milestone notifications when monthly revenue crosses 25/50/75/100% of the goal."""
-        config = await db.get_goal_config(conn, guild_id)
+        async with db.get_db() as conn:
+            config = await db.get_goal_config(conn, guild_id)
         if not config or channel is None:
             return
 
@@ -1111,17 +1470,17 @@ class ShopkeepBot(discord.Client):
         if config["month"] != current_month:
             milestones_sent = []
 
-        # Monthly revenue: sum receipts from the first of this month
+        # Monthly revenue from the daily rollup
         month_start = datetime.datetime(now.year, now.month, 1, tzinfo=datetime.timezone.utc)
-        receipts = await db.get_receipts_since(conn, shop_id, int(month_start.timestamp()))
-        if not receipts:
+        async with db.get_shop_db(shop_id) as shop_conn:
+            sales = await db.get_sales_since(shop_conn, shop_id, int(month_start.timestamp()))
+        if not sales["orders"]:
             if config["month"] != current_month:
-                await db.update_goal_milestones(conn, guild_id, [], current_month)
-                await conn.commit()
+                await db.write(db.update_goal_milestones, guild_id, [], current_month)
             return
 
-        revenue = sum(r["grandtotal_amount"] / (r["grandtotal_divisor"] or 100) for r in receipts)
-        currency = receipts[0]["grandtotal_currency"]
+        revenue = sales["revenue"]
+        currency = sales["currency"]
         goal_dollars = config["amount_cents"] / 100
         pct = int(revenue / goal_dollars * 100) if goal_dollars > 0 else 0
 
@@ -1149,45 +1508,41 @@ class ShopkeepBot(discord.Client):
                 newly_sent.append(milestone)
 
         if newly_sent != milestones_sent or config["month"] != current_month:
-            await db.update_goal_milestones(conn, guild_id, newly_sent, current_month)
-            await conn.commit()
+            await db.write(db.update_goal_milestones, guild_id, newly_sent, current_month)
 
     async def _check_backlog(
         self,
-        conn,
         guild_id: int,
-        shop_id: int,
         channel,
         shop_name: str,
+        count: int,
     ) -> None:
-        """Post a one-time warning when open unshipped orders exceed the configured threshold."""
-        config = await db.get_backlog_config(conn, guild_id)
+        """Post a one-time warning when open unshipped orders (count) exceed the configured threshold."""
+        async with db.get_db() as conn:
+            config = await db.get_backlog_config(conn, guild_id)
         if not config or channel is None:
             return
 
         threshold = config["threshold"]
         warned = config["warned"]
-        count = await db.get_open_order_count(conn, shop_id)
 
         if count >= threshold and not warned:
             await channel.send(embed=build_backlog_embed(count, threshold, shop_name))
-            await db.set_backlog_warned(conn, guild_id, True)
-            await conn.commit()
+            await db.write(db.set_backlog_warned, guild_id, True)
         elif count < threshold and warned:
             # Backlog cleared — reset so warning can fire again next time
-            await db.set_backlog_warned(conn, guild_id, False)
-            await conn.commit()
+            await db.write(db.set_backlog_warned, guild_id, False)
 
     async def _check_shipping_reminders(
         self,
-        conn,
         guild_id: int,
         shop_id: int,
         channel,
         shop_name: str,
     ) -> None:
         """Post shipping deadline reminders for open orders approaching their ship date."""
-        config = await db.get_guild_reminder_config(conn, guild_id)
+        async with db.get_db() as conn:
+            config = await db.get_guild_reminder_config(conn, guild_id)
         if not config or channel is None:
             return
 
@@ -1210,33 +1565,37 @@ class ShopkeepBot(discord.Client):
         except zoneinfo.ZoneInfoNotFoundError:
             reminder_tz = datetime.timezone.utc
         today_local = datetime.datetime.now(reminder_tz).date()
-        for days_before in reminder_days:
-            target_date = today_local + datetime.timedelta(days=days_before)
-            day_start = datetime.datetime(target_date.year, target_date.month, target_date.day, tzinfo=reminder_tz)
-            day_end = day_start + datetime.timedelta(days=1)
-            lower = int(day_start.timestamp())
-            upper = int(day_end.timestamp())
-            pending = await db.get_pending_reminders(conn, shop_id, days_before, lower, upper)
-            for row in pending:
-                txns = await db.get_receipt_transactions(conn, row["receipt_id"])
-                embed = build_shipping_reminder_embed(dict(row), shop_name, days_before, transactions=txns)
-                await channel.send(embed=embed)
-                await db.mark_reminder_sent(conn, row["receipt_id"], days_before)
-                await conn.commit()
+        due = []
+        async with db.get_shop_db(shop_id) as shop_conn:
+            for days_before in reminder_days:
+                target_date = today_local + datetime.timedelta(days=days_before)
+                day_start = datetime.datetime(target_date.year, target_date.month, target_date.day, tzinfo=reminder_tz)
+                day_end = day_start + datetime.timedelta(days=1)
+                lower = int(day_start.timestamp())
+                upper = int(day_end.timestamp())
+                pending = await db.get_pending_reminders(shop_conn, shop_id, days_before, lower, upper)
+                for row in pending:
+                    txns = await db.get_receipt_transactions(shop_conn, row["receipt_id"])
+                    due.append((days_before, row, txns))
+        for days_before, row, txns in due:
+            embed = build_shipping_reminder_embed(dict(row), shop_name, days_before, transactions=txns)
+            await channel.send(embed=embed)
+            await db.write_shop(shop_id, db.mark_reminder_sent, row["receipt_id"], days_before)
 
     async def _check_new_reviews(
         self,
-        conn,
         guild_id: int,
         shop_id: int,
         channel,
         shop_name: str,
+        pending: int,
     ) -> None:
         """Fetch recent reviews, store any new ones, and post notifications.
 
         The API call is only made every 5th poll cycle (~5 minutes) to conserve
         API budget. Unnotified rows accumulated in the interim are still flushed
-        every cycle.
+        every cycle; `pending` is the shop's unnotified-review counter, and the
+        lookup is skipped when it and the fetch turned up nothing.
         """
         etsy = self.etsy_clients.get(guild_id)
         if not etsy or channel is None:
@@ -1254,17 +1613,24 @@ class ShopkeepBot(discord.Client):
             reviews = response.get("results", [])
             for review in reviews:
                 review["shop_id"] = shop_id
-                await db.upsert_review(conn, review)
-            await conn.commit()
 
-        unnotified = await db.get_unnotified_reviews(conn, shop_id)
+            async def ingest(conn) -> dict:
+                new_reviews = await db.upsert_reviews(conn, reviews)
+                await db.mark_shop_synced(conn, shop_id, "reviews")
+                return new_reviews
+
+            pending += len(await db.write_shop(shop_id, ingest))
+
+        if not pending:
+            return
+        async with db.get_shop_db(shop_id) as shop_conn:
+            unnotified = await db.get_unnotified_reviews(shop_conn, shop_id)
         for row in unnotified:
             embed = build_review_embed(
                 dict(row), shop_name=shop_name, listing_title=row["listing_title"]
             )
             await channel.send(embed=embed)
-            await db.mark_review_notified(conn, row["transaction_id"])
-            await conn.commit()
+            await db.write_shop(shop_id, db.mark_review_notified, row["transaction_id"])
 
     # ── Commands ──────────────────────────────────────────────────────────────
 
@@ -1541,6 +1907,11 @@ class ShopkeepBot(discord.Client):
         ):
             await self._cmd_bestsellers(interaction, period=period, ranked_by=ranked_by)
 
+        @tree.command(name="search", description="Search orders by buyer, item, city, receipt ID or personalization")
+        @discord.app_commands.describe(query="Words to look for — each word matches as a prefix")
+        async def search(interaction: discord.Interaction, query: str):
+            await self._cmd_search(interaction, query=query)
+
         @tree.command(name="label", description="Buy a shipping label for one or more orders")
         @discord.app_commands.describe(
             receipt_ids="Order receipt ID(s) — omit to pick from a list, or comma-separate for batch",
@@ -1560,24 +1931,22 @@ class ShopkeepBot(discord.Client):
     async def _autocomplete_labelable_receipt(
         self, interaction: discord.Interaction, current: str
     ) -> list[discord.app_commands.Choice[str]]:
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             guild_row = await db.get_guild(conn, interaction.guild_id)
-            if not guild_row or not guild_row["etsy_shop_id"]:
-                return []
-            rows = await db.get_labelable_receipts(conn, guild_row["etsy_shop_id"])
-
+        if not guild_row or not guild_row["etsy_shop_id"]:
+            return []
+        shop_id = guild_row["etsy_shop_id"]
         current = current.strip()
         # Support comma-separated input: autocomplete only the last segment
         prefix, _, stem = current.rpartition(",")
-        stem = stem.strip()
+        async with db.get_read_db(shop_id) as conn:
+            rows = await db.get_labelable_receipts(conn, shop_id, search=stem.strip())
 
         choices = []
         for row in rows:
             rid = str(row["receipt_id"])
             buyer = row["name"] or "Unknown buyer"
             display = f"#{rid} — {buyer}"
-            if stem and stem not in rid and stem.lower() not in buyer.lower():
-                continue
             value = f"{prefix},{rid}".lstrip(",") if prefix else rid
             choices.append(discord.app_commands.Choice(name=display[:100], value=value))
         return choices[:25]
@@ -1585,7 +1954,7 @@ class ShopkeepBot(discord.Client):
     async def _autocomplete_preset(
         self, interaction: discord.Interaction, current: str
     ) -> list[discord.app_commands.Choice[str]]:
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             presets = await db.list_presets(conn, interaction.guild_id)
         current_lower = current.lower()
         return [
@@ -1597,32 +1966,13 @@ class ShopkeepBot(discord.Client):
     async def _autocomplete_buyer(
         self, interaction: discord.Interaction, current: str
     ) -> list[discord.app_commands.Choice[str]]:
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             guild_row = await db.get_guild(conn, interaction.guild_id)
-            if not guild_row or not guild_row["etsy_shop_id"]:
-                return []
-            rows = await conn.execute_fetchall(
-                """
-                SELECT DISTINCT name FROM receipts
-                WHERE shop_id = ? AND name IS NOT NULL
-                ORDER BY receipt_id DESC
-                LIMIT 100
-                """,
-                (guild_row["etsy_shop_id"],),
-            )
-        current_lower = current.lower()
-        seen: set[str] = set()
-        choices = []
-        for row in rows:
-            name = row["name"]
-            if name in seen:
-                continue
-            seen.add(name)
-            if current_lower in name.lower():
-                choices.append(discord.app_commands.Choice(name=name, value=name))
-            if len(choices) == 25:
-                break
-        return choices
+        if not guild_row or not guild_row["etsy_shop_id"]:
+            return []
+        async with db.get_read_db(guild_row["etsy_shop_id"]) as conn:
+            names = await db.search_buyers(conn, guild_row["etsy_shop_id"], current)
+        return [discord.app_commands.Choice(name=name, value=name) for name in names]
 
     async def _cmd_help(self, interaction: discord.Interaction) -> None:
         embed = discord.Embed(title="Shopkeep Commands", color=discord.Color.blurple())
@@ -1636,6 +1986,7 @@ class ShopkeepBot(discord.Client):
             ("/revenue [period]", "Show revenue summary (default: this month)"),
             ("/listings", "Browse your active Etsy listings"),
             ("/bestsellers [period] [ranked_by]", "Top listings by units or revenue (this month / year / all-time)"),
+            ("/search <query>", "Search orders by buyer, item, city, receipt ID or personalization"),
             ("/shippo connect/address/status/disconnect", "Connect Shippo for label purchasing — set your API key and ship-from address"),
             ("/label [receipt_ids] [preset]", "Buy shipping labels via Shippo — omit receipt IDs to pick from a list"),
             ("/preset add/list/remove", "Manage shipping presets — save carrier, mail class, weight, and dimensions for reuse with `/label`"),
@@ -1654,9 +2005,8 @@ class ShopkeepBot(discord.Client):
             await interaction.response.send_message(err, ephemeral=True)
             return
 
-        async with db.get_db() as conn:
-            await db.update_guild_channel(conn, interaction.guild_id, interaction.channel_id)
-            await conn.commit()
+        await db.write(db.update_guild_channel, interaction.guild_id, interaction.channel_id)
+        await self._refresh_guild(interaction.guild_id)
 
         await interaction.response.send_message(
             f"Order notifications will be posted in <#{interaction.channel_id}>.",
@@ -1664,27 +2014,25 @@ class ShopkeepBot(discord.Client):
         )
 
     async def _cmd_status(self, interaction: discord.Interaction) -> None:
-        async with db.get_db() as conn:
-            guild_row = await db.get_guild(conn, interaction.guild_id)
-            shop_row = None
-            if guild_row and guild_row["etsy_shop_id"]:
-                cursor = await conn.execute(
-                    "SELECT shop_name, url FROM shops WHERE shop_id = ?",
-                    (guild_row["etsy_shop_id"],),
-                )
-                shop_row = await cursor.fetchone()
-            reminder_config = await db.get_guild_reminder_config(conn, interaction.guild_id)
-            backlog_config = await db.get_backlog_config(conn, interaction.guild_id)
-            digest_config = await db.get_digest_config(conn, interaction.guild_id)
-            goal_config = await db.get_goal_config(conn, interaction.guild_id)
+        async with db.get_read_db() as conn:
+            overview = await db.get_guild_overview(conn, interaction.guild_id)
 
-        if not guild_row:
+        if not overview:
             await interaction.response.send_message(
                 "This server hasn't been set up yet. Add Shopkeep via the website.",
                 ephemeral=True,
             )
             return
 
+        guild_row = overview["guild"]
+        shop_row = None
+        if guild_row["etsy_shop_id"]:
+            async with db.get_read_db(guild_row["etsy_shop_id"]) as conn:
+                shop_row = await db.get_shop(conn, guild_row["etsy_shop_id"])
+        reminder_config = overview["reminders"]
+        backlog_config = overview["backlog"]
+        digest_config = overview["digest"]
+        goal_config = overview["goal"]
         shop_id = guild_row["etsy_shop_id"]
         channel_id = guild_row["order_channel_id"]
 
@@ -1716,9 +2064,7 @@ class ShopkeepBot(discord.Client):
             if not token or exp < int(time.time()):
                 token = secrets.token_urlsafe(16)
                 exp = int(time.time()) + SETUP_TOKEN_TTL
-                async with db.get_db() as conn:
-                    await db.refresh_setup_token(conn, guild_row["guild_id"], token, exp)
-                    await conn.commit()
+                await db.write(db.refresh_setup_token, guild_row["guild_id"], token, exp)
             embed.add_field(
                 name="Setup",
                 value=f"[Connect your Etsy shop]({WEB_BASE_URL}/connect/{token})",
@@ -1831,12 +2177,9 @@ class ShopkeepBot(discord.Client):
             )
             return
 
-        async with db.get_db() as conn:
-            cursor = await conn.execute(
-                "SELECT shop_name FROM shops WHERE shop_id = ?", (guild_row["etsy_shop_id"],)
-            )
-            shop_row = await cursor.fetchone()
-        shop_name = shop_row["shop_name"] if shop_row else f"shop #{guild_row['etsy_shop_id']}"
+        async with db.get_shop_db(guild_row["etsy_shop_id"]) as conn:
+            shop_name = await db.get_shop_name(conn, guild_row["etsy_shop_id"])
+        shop_name = shop_name or f"shop #{guild_row['etsy_shop_id']}"
 
         embed = discord.Embed(
             title="Disconnect Etsy Shop?",
@@ -1847,27 +2190,24 @@ class ShopkeepBot(discord.Client):
             ),
             color=discord.Color.red(),
         )
-        view = ConfirmDisconnectView(self, interaction.guild_id, shop_name, guild_row["order_channel_id"])
+        view = ConfirmDisconnectView(
+            self, interaction.guild_id, guild_row["etsy_shop_id"], shop_name, guild_row["order_channel_id"]
+        )
         await interaction.response.send_message(embed=embed, view=view, ephemeral=True)
 
     async def _cmd_listings(self, interaction: discord.Interaction) -> None:
         await interaction.response.defer(ephemeral=True)
 
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             guild_row = await db.get_guild(conn, interaction.guild_id)
 
         if not guild_row or not guild_row["etsy_shop_id"]:
             await interaction.followup.send("No Etsy shop connected.")
             return
 
-        async with db.get_db() as conn:
+        async with db.get_read_db(guild_row["etsy_shop_id"]) as conn:
             rows = await db.get_active_listings(conn, guild_row["etsy_shop_id"])
-            cursor = await conn.execute(
-                "SELECT shop_name FROM shops WHERE shop_id = ?", (guild_row["etsy_shop_id"],)
-            )
-            shop_row = await cursor.fetchone()
-
-        shop_name = shop_row["shop_name"] if shop_row else "My Shop"
+            shop_name = await db.get_shop_name(conn, guild_row["etsy_shop_id"]) or "My Shop"
 
         if not rows:
             await interaction.followup.send(
@@ -1884,7 +2224,7 @@ class ShopkeepBot(discord.Client):
     async def _cmd_revenue(self, interaction: discord.Interaction, period: str = "this_month") -> None:
         await interaction.response.defer(ephemeral=True)
 
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             guild_row = await db.get_guild(conn, interaction.guild_id)
 
         if not guild_row or not guild_row["etsy_shop_id"]:
@@ -1906,18 +2246,16 @@ class ShopkeepBot(discord.Client):
             since = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
             label = f"This Month · {now.strftime('%B %Y')}"
 
-        async with db.get_db() as conn:
-            rows = await db.get_receipts_since(conn, shop_id, int(since.timestamp()))
+        async with db.get_read_db(shop_id) as conn:
+            sales = await db.get_sales_since(conn, shop_id, int(since.timestamp()))
 
-        order_count = len(rows)
+        order_count = sales["orders"]
         if order_count == 0:
             await interaction.followup.send(f"No orders found for {label}.")
             return
 
-        total_amount = sum(r["grandtotal_amount"] for r in rows)
-        divisor = rows[0]["grandtotal_divisor"] or 100
-        currency = rows[0]["grandtotal_currency"] or "USD"
-        total = total_amount / divisor
+        currency = sales["currency"] or "USD"
+        total = sales["revenue"]
         avg = total / order_count
 
         embed = discord.Embed(title="Revenue", description=label, color=discord.Color.green())
@@ -1938,16 +2276,14 @@ class ShopkeepBot(discord.Client):
                 f"Could not validate the Shippo API key: {exc}", ephemeral=True
             )
             return
-        async with db.get_db() as conn:
-            await db.save_shippo_key(conn, interaction.guild_id, api_key)
-            await conn.commit()
+        await db.write(db.save_shippo_key, interaction.guild_id, api_key)
         await interaction.followup.send(
             "Shippo connected. Now run `/shippo address` to set your ship-from address.",
             ephemeral=True,
         )
 
     async def _cmd_shippo_status(self, interaction: discord.Interaction) -> None:
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             config = await db.get_shippo_config(conn, interaction.guild_id)
         if not config or not config["api_key"]:
             await interaction.response.send_message(
@@ -1974,8 +2310,7 @@ class ShopkeepBot(discord.Client):
                     "Shippo isn't connected.", ephemeral=True
                 )
                 return
-            await db.delete_shippo_config(conn, interaction.guild_id)
-            await conn.commit()
+            await db.write(db.delete_shippo_config, interaction.guild_id)
         await interaction.response.send_message("Shippo disconnected.", ephemeral=True)
 
     async def _cmd_preset_add(
@@ -2005,13 +2340,11 @@ class ShopkeepBot(discord.Client):
             return
         length_in, width_in, height_in = parsed_dims
 
-        async with db.get_db() as conn:
-            inserted = await db.add_preset(
-                conn, interaction.guild_id, name, carrier, mail_class,
-                weight_oz, length_in, width_in, height_in,
-                package_type=package_type,
-            )
-            await conn.commit()
+        inserted = await db.write(
+            db.add_preset, interaction.guild_id, name, carrier, mail_class,
+            weight_oz, length_in, width_in, height_in,
+            package_type=package_type,
+        )
 
         if not inserted:
             await interaction.followup.send(
@@ -2035,7 +2368,7 @@ class ShopkeepBot(discord.Client):
     async def _cmd_preset_list(self, interaction: discord.Interaction) -> None:
         await interaction.response.defer(ephemeral=True)
 
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             presets = await db.list_presets(conn, interaction.guild_id)
 
         if not presets:
@@ -2066,9 +2399,7 @@ class ShopkeepBot(discord.Client):
     async def _cmd_preset_remove(self, interaction: discord.Interaction, name: str) -> None:
         await interaction.response.defer(ephemeral=True)
 
-        async with db.get_db() as conn:
-            deleted = await db.delete_preset(conn, interaction.guild_id, name)
-            await conn.commit()
+        deleted = await db.write(db.delete_preset, interaction.guild_id, name)
 
         if not deleted:
             await interaction.followup.send(
@@ -2110,8 +2441,7 @@ class ShopkeepBot(discord.Client):
                     "No Etsy shop connected. Connect a shop first.", ephemeral=True
                 )
                 return
-            await db.set_guild_reminder_days(conn, interaction.guild_id, parsed)
-            await conn.commit()
+            await db.write(db.set_guild_reminder_days, interaction.guild_id, parsed)
             reminder_config = await db.get_guild_reminder_config(conn, interaction.guild_id)
 
         threshold_labels = {0: "Today", 1: "Tomorrow"}
@@ -2194,8 +2524,7 @@ class ShopkeepBot(discord.Client):
                     "No Etsy shop connected. Connect a shop first.", ephemeral=True
                 )
                 return
-            await db.set_guild_reminder_time(conn, interaction.guild_id, time_str, timezone)
-            await conn.commit()
+            await db.write(db.set_guild_reminder_time, interaction.guild_id, time_str, timezone)
 
         now_local = datetime.datetime.now(tz).strftime("%Z")
         embed = discord.Embed(
@@ -2210,16 +2539,14 @@ class ShopkeepBot(discord.Client):
             await interaction.response.send_message(err, ephemeral=True)
             return
 
-        async with db.get_db() as conn:
-            await db.disable_guild_reminders(conn, interaction.guild_id)
-            await conn.commit()
+        await db.write(db.disable_guild_reminders, interaction.guild_id)
 
         await interaction.response.send_message(
             "Shipping deadline reminders have been disabled.", ephemeral=True
         )
 
     async def _cmd_reminders_status(self, interaction: discord.Interaction) -> None:
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             config = await db.get_guild_reminder_config(conn, interaction.guild_id)
 
         if not config:
@@ -2261,10 +2588,9 @@ class ShopkeepBot(discord.Client):
             )
             return
 
+        await db.write(db.set_backlog_threshold, interaction.guild_id, threshold)
         async with db.get_db() as conn:
-            await db.set_backlog_threshold(conn, interaction.guild_id, threshold)
             guild_row = await db.get_guild(conn, interaction.guild_id)
-            await conn.commit()
 
         channel_id = guild_row["order_channel_id"] if guild_row else None
         channel_mention = f"<#{channel_id}>" if channel_id else "your notification channel"
@@ -2278,16 +2604,14 @@ class ShopkeepBot(discord.Client):
             await interaction.response.send_message(err, ephemeral=True)
             return
 
-        async with db.get_db() as conn:
-            await db.set_backlog_threshold(conn, interaction.guild_id, None)
-            await conn.commit()
+        await db.write(db.set_backlog_threshold, interaction.guild_id, None)
 
         await interaction.response.send_message(
             "Backlog warning has been disabled.", ephemeral=True
         )
 
     async def _cmd_backlog_status(self, interaction: discord.Interaction) -> None:
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             config = await db.get_backlog_config(conn, interaction.guild_id)
 
         if not config:
@@ -2308,9 +2632,7 @@ class ShopkeepBot(discord.Client):
             await interaction.response.send_message(err, ephemeral=True)
             return
 
-        async with db.get_db() as conn:
-            await db.set_digest_config(conn, interaction.guild_id, "09:00", "UTC")
-            await conn.commit()
+        await db.write(db.set_digest_config, interaction.guild_id, "09:00", "UTC")
 
         await interaction.response.send_message(
             "Daily digest enabled. I'll post a summary every day at **9:00 AM UTC**.\n"
@@ -2346,9 +2668,7 @@ class ShopkeepBot(discord.Client):
             return
 
         time_str = f"{h:02d}:{m:02d}"
-        async with db.get_db() as conn:
-            await db.set_digest_config(conn, interaction.guild_id, time_str, timezone)
-            await conn.commit()
+        await db.write(db.set_digest_config, interaction.guild_id, time_str, timezone)
 
         await interaction.response.send_message(
             f"Daily digest will be posted at **{time_str}** ({timezone}).",
@@ -2360,16 +2680,14 @@ class ShopkeepBot(discord.Client):
             await interaction.response.send_message(err, ephemeral=True)
             return
 
-        async with db.get_db() as conn:
-            await db.disable_digest(conn, interaction.guild_id)
-            await conn.commit()
+        await db.write(db.disable_digest, interaction.guild_id)
 
         await interaction.response.send_message(
             "Daily digest has been disabled.", ephemeral=True
         )
 
     async def _cmd_digest_status(self, interaction: discord.Interaction) -> None:
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             config = await db.get_digest_config(conn, interaction.guild_id)
 
         if not config:
@@ -2401,9 +2719,7 @@ class ShopkeepBot(discord.Client):
             await interaction.response.send_message("Goal must be at least $1.", ephemeral=True)
             return
 
-        async with db.get_db() as conn:
-            await db.set_goal_amount(conn, interaction.guild_id, amount * 100)
-            await conn.commit()
+        await db.write(db.set_goal_amount, interaction.guild_id, amount * 100)
 
         await interaction.response.send_message(
             f"Monthly revenue goal set to **${amount:,}**. "
@@ -2413,7 +2729,7 @@ class ShopkeepBot(discord.Client):
 
     async def _cmd_goal_status(self, interaction: discord.Interaction) -> None:
         await interaction.response.defer(ephemeral=True)
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             guild_row = await db.get_guild(conn, interaction.guild_id)
             if not guild_row or not guild_row["etsy_shop_id"]:
                 await interaction.followup.send("No Etsy shop connected.", ephemeral=True)
@@ -2424,14 +2740,15 @@ class ShopkeepBot(discord.Client):
                     "No goal set. Use `/goal set <amount>` to set one.", ephemeral=True
                 )
                 return
-            now_dt = datetime.datetime.now(datetime.timezone.utc)
-            month_start = datetime.datetime(now_dt.year, now_dt.month, 1, tzinfo=datetime.timezone.utc)
-            month_receipts = await db.get_receipts_since(
+        now_dt = datetime.datetime.now(datetime.timezone.utc)
+        month_start = datetime.datetime(now_dt.year, now_dt.month, 1, tzinfo=datetime.timezone.utc)
+        async with db.get_read_db(guild_row["etsy_shop_id"]) as conn:
+            month_sales = await db.get_sales_since(
                 conn, guild_row["etsy_shop_id"], int(month_start.timestamp())
             )
 
-        revenue = sum(r["grandtotal_amount"] / (r["grandtotal_divisor"] or 100) for r in month_receipts)
-        currency = month_receipts[0]["grandtotal_currency"] if month_receipts else "USD"
+        revenue = month_sales["revenue"]
+        currency = month_sales["currency"] or "USD"
         goal_dollars = goal_config["amount_cents"] / 100
         pct = int(revenue / goal_dollars * 100) if goal_dollars > 0 else 0
 
@@ -2455,9 +2772,7 @@ class ShopkeepBot(discord.Client):
             await interaction.response.send_message(err, ephemeral=True)
             return
 
-        async with db.get_db() as conn:
-            await db.disable_goal(conn, interaction.guild_id)
-            await conn.commit()
+        await db.write(db.disable_goal, interaction.guild_id)
 
         await interaction.response.send_message("Monthly revenue goal removed.", ephemeral=True)
 
@@ -2468,25 +2783,24 @@ class ShopkeepBot(discord.Client):
         now = datetime.datetime.now(datetime.timezone.utc)
 
         if period == "this_month":
-            since = datetime.datetime(now.year, now.month, 1, tzinfo=datetime.timezone.utc)
+            period_key = now.strftime("%Y-%m")
             period_label = now.strftime("%B %Y")
         elif period == "this_year":
-            since = datetime.datetime(now.year, 1, 1, tzinfo=datetime.timezone.utc)
+            period_key = str(now.year)
             period_label = str(now.year)
         else:
-            since = datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc)
+            period_key = "all"
             period_label = "All Time"
 
-        async with db.get_db() as conn:
+        async with db.get_read_db() as conn:
             guild_row = await db.get_guild(conn, interaction.guild_id)
             if not guild_row or not guild_row["etsy_shop_id"]:
                 await interaction.followup.send("No Etsy shop connected. Run `/status` to get started.")
                 return
-            shop_id = guild_row["etsy_shop_id"]
-            shop_row = await conn.execute("SELECT shop_name FROM shops WHERE shop_id = ?", (shop_id,))
-            shop_row = await shop_row.fetchone()
-            shop_name = shop_row["shop_name"] if shop_row else "My Shop"
-            rows = await db.get_bestsellers(conn, shop_id, int(since.timestamp()), ranked_by=ranked_by)
+        shop_id = guild_row["etsy_shop_id"]
+        async with db.get_read_db(shop_id) as conn:
+            shop_name = await db.get_shop_name(conn, shop_id) or "My Shop"
+            rows = await db.get_bestsellers(conn, shop_id, period_key, ranked_by=ranked_by)
 
         embed = build_bestsellers_embed(
             [dict(r) for r in rows],
@@ -2496,6 +2810,21 @@ class ShopkeepBot(discord.Client):
         )
         await interaction.followup.send(embed=embed)
 
+    async def _cmd_search(self, interaction: discord.Interaction, query: str) -> None:
+        await interaction.response.defer(ephemeral=True)
+        async with db.get_read_db() as conn:
+            guild_row = await db.get_guild(conn, interaction.guild_id)
+            if not guild_row or not guild_row["etsy_shop_id"]:
+                await interaction.followup.send("No Etsy shop connected. Run `/status` to get started.", ephemeral=True)
+                return
+        shop_id = guild_row["etsy_shop_id"]
+        async with db.get_read_db(shop_id) as conn:
+            shop_name = await db.get_shop_name(conn, shop_id) or "My Shop"
+            rows = await db.search_orders(conn, shop_id, query)
+
+        embed = build_search_results_embed([dict(r) for r in rows], query=query, shop_name=shop_name)
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
     async def _cmd_label(
         self,
         interaction: discord.Interaction,
@@ -2521,7 +2850,7 @@ class ShopkeepBot(discord.Client):
                     "No Etsy shop connected. Run `/status` to get started.", ephemeral=True
                 )
                 return
-            async with db.get_db() as conn:
+            async with db.get_shop_db(shop_id) as conn:
                 receipts = await db.get_labelable_receipts(conn, shop_id)
             if not receipts:
                 await interaction.response.send_message(
@@ -2569,9 +2898,8 @@ class ShopkeepBot(discord.Client):
         async with db.get_db() as conn:
             guild_row = await db.get_guild(conn, interaction.guild_id)
             shippo_config = await db.get_shippo_config(conn, interaction.guild_id)
-            shop_row = await conn.execute("SELECT shop_name FROM shops WHERE shop_id = ?", (shop_id,))
-            shop_row = await shop_row.fetchone()
-        shop_name = shop_row["shop_name"] if shop_row else "My Shop"
+        async with db.get_shop_db(shop_id) as conn:
+            shop_name = await db.get_shop_name(conn, shop_id) or "My Shop"
 
         if not shippo_config or not shippo_config["api_key"]:
             await interaction.followup.send(
@@ -2600,18 +2928,10 @@ class ShopkeepBot(discord.Client):
 
         # Eligibility check
         receipt_rows: dict[int, any] = {}
-        async with db.get_db() as conn:
+        async with db.get_shop_db(shop_id) as conn:
             ineligible = []
             for rid in receipt_ids:
-                cursor = await conn.execute(
-                    """
-                    SELECT receipt_id, is_paid, is_shipped, name,
-                           first_line, second_line, city, state, zip, country_iso
-                    FROM receipts WHERE receipt_id = ? AND shop_id = ?
-                    """,
-                    (rid, shop_id),
-                )
-                row = await cursor.fetchone()
+                row = await db.get_receipt(conn, shop_id, rid)
                 if not row:
                     ineligible.append(f"#{rid}: not found")
                 elif not row["is_paid"]:
@@ -2767,9 +3087,7 @@ class ShopkeepBot(discord.Client):
                 results.append(result)
 
                 # Mark shipped locally immediately so it leaves the picker
-                async with db.get_db() as conn:
-                    await db.mark_receipt_shipped(conn, receipt_id)
-                    await conn.commit()
+                await db.write_shop(shop_id, db.mark_receipt_shipped, receipt_id)
 
                 # Post tracking to Etsy to mark order shipped
                 tracking_number = txn.get("tracking_number", "")
@@ -2833,31 +3151,27 @@ class ShopkeepBot(discord.Client):
         try:
             async with db.get_db() as conn:
                 guild_row = await db.get_guild(conn, interaction.guild_id)
-                shop_id = guild_row["etsy_shop_id"] if guild_row else None
-                shop_name = "our shop"
-                if shop_id:
-                    shop_row = await conn.execute_fetchall(
-                        "SELECT shop_name FROM shops WHERE shop_id = ?", (shop_id,)
-                    )
-                    if shop_row:
-                        shop_name = shop_row[0]["shop_name"]
+            shop_id = guild_row["etsy_shop_id"] if guild_row else None
+            shop_name = "our shop"
+            listings_summary = "various handmade items"
+            history = "No previous orders found."
+            if shop_id:
+                async with db.get_shop_db(shop_id) as conn:
+                    shop_name = await db.get_shop_name(conn, shop_id) or shop_name
 
-                listings_summary = "various handmade items"
-                if shop_id:
                     listings = await db.get_active_listings(conn, shop_id)
                     if listings:
                         titles = [r["title"] for r in listings[:10] if r["title"]]
                         listings_summary = ", ".join(titles)
 
-                history = "No previous orders found."
-                if shop_id and buyer:
-                    orders = await db.get_buyer_orders(conn, shop_id, buyer)
-                    if orders:
-                        lines = [
-                            f"Order #{r['receipt_id']}: {r['items'] or 'unknown items'}"
-                            for r in orders
-                        ]
-                        history = "\n".join(lines)
+                    if buyer:
+                        orders = await db.get_buyer_orders(conn, shop_id, buyer, include_archive=True)
+                        if orders:
+                            lines = [
+                                f"Order #{r['receipt_id']}: {r['items'] or 'unknown items'}"
+                                for r in orders
+                            ]
+                            history = "\n".join(lines)
 
             loop = asyncio.get_running_loop()
             print(f"[draft] calling Claude - shop={shop_name!r} buyer={buyer!r}")
@@ -2882,7 +3196,7 @@ class ShopkeepBot(discord.Client):
             guild_row = await db.get_guild(conn, interaction.guild_id)
         if not guild_row or not guild_row["etsy_shop_id"]:
             return None, None
-        etsy = self.etsy_clients.get(interaction.guild_id)
+        etsy = await self._ensure_client(interaction.guild_id)
         if not etsy:
             return None, None
         return etsy, guild_row["etsy_shop_id"]
@@ -2901,7 +3215,7 @@ class ShopkeepBot(discord.Client):
             await interaction.followup.send(f"No Etsy shop connected.{link}")
             return None, None
 
-        etsy = self.etsy_clients.get(interaction.guild_id)
+        etsy = await self._ensure_client(interaction.guild_id)
         if not etsy:
             await interaction.followup.send(
                 "Bot connection error — try again in a moment. If this persists, contact an admin.",
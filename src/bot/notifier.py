@@ -347,6 +347,47 @@ def build_bestsellers_embed(
     return embed
 
 
+def build_search_results_embed(rows: list, query: str, shop_name: str) -> discord.Embed:
+    """Build a Discord embed for the /search command.
+
+    Args:
+        rows: DB rows with keys: receipt_id, name, city, status, is_shipped, create_timestamp,
+            grandtotal_amount, grandtotal_divisor, grandtotal_currency, items, personalization.
+        query: The search text as the user typed it.
+        shop_name: Shown in the footer.
+    """
+    embed = discord.Embed(
+        title=f"Search — {query}"[:256],
+        color=discord.Color.blurple(),
+    )
+
+    if not rows:
+        embed.description = "No orders matched."
+        embed.set_footer(text=shop_name)
+        return embed
+
+    for row in rows:
+        buyer = row["name"] or "Unknown buyer"
+        divisor = row["grandtotal_divisor"] or 100
+        total = (row["grandtotal_amount"] or 0) / divisor
+        currency = row["grandtotal_currency"] or "USD"
+        status = "Shipped" if row["is_shipped"] else (row["status"] or "Unknown")
+        lines = [f"${total:.2f} {currency} · {status} · <t:{row['create_timestamp']}:d>"]
+        if row["items"]:
+            lines.append(row["items"][:200])
+        if row["personalization"]:
+            lines.append(f"*{row['personalization'][:200]}*")
+        location = f" ({row['city']})" if row["city"] else ""
+        embed.add_field(
+            name=f"#{row['receipt_id']} — {buyer}{location}"[:256],
+            value="\n".join(lines)[:1024],
+            inline=False,
+        )
+
+    embed.set_footer(text=shop_name)
+    return embed
+
+
 def build_goal_milestone_embed(
     milestone_pct: int,
     current: float,
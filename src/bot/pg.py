@@ -0,0 +1,1554 @@
+"""
+PostgreSQL persistence layer for Shopkeep bot.
+
+The same helper API as src/bot/db.py, on asyncpg, selected when DATABASE_URL is set
+so several bot shards and web replicas can share one database server. Every public
+helper in db.py has a counterpart here with the same signature and result shape:
+helpers take an asyncpg connection, return asyncpg Records (which index by name
+and position like sqlite3.Row) and never commit. Row building from Etsy payloads is
+shared with db.py; the schema lives in src/schema_pg.py.
+"""
+
+import datetime
+import json
+import re
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+
+from src import schema, schema_pg
+from src.bot.db import (
+    _ARCHIVABLE_STATUS_CODES,
+    _LISTING_COLUMNS,
+    _RECEIPT_COLUMNS,
+    _RECEIPT_MUTABLE_COLUMNS,
+    _REVIEW_COLUMNS,
+    _SHOP_COLUMNS,
+    _SYNC_STAGES,
+    _TRANSACTION_COLUMNS,
+    _listing_row,
+    _receipt_row,
+    _review_row,
+    _shop_row,
+    _transaction_row,
+)
+
+# Set by discord_bot.py before init_db() is called, e.g. postgresql://user@host/shopkeep
+DATABASE_URL: str = ""
+# Every shop shares the one database (see get_shop_db())
+DB_LAYOUT = "single"
+
+
+async def init_db() -> None:
+    """Bring the database schema and the archive schema up to date (see src/schema_pg.py)."""
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        await schema_pg.migrate(conn)
+        await schema_pg.ensure_archive(conn)
+    finally:
+        await conn.close()
+
+
+# ── Connection pool ───────────────────────────────────────────────────────────
+
+_pool: asyncpg.Pool | None = None
+
+# How often write() retries a job that lost a deadlock to another process
+WRITE_DEADLOCK_RETRIES = 3
+
+
+async def open_pool(size: int = 4, readers: int = 4) -> None:
+    """Open the shared connection pool. Call once at startup, after init_db().
+
+    Readers share the pool here; get_read_db() only differs in its transaction.
+    """
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            DATABASE_URL, min_size=size, max_size=size + readers
+        )
+
+
+async def close_pool() -> None:
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None:
+        await pool.close()
+
+
+@asynccontextmanager
+async def get_db():
+    """Yield a connection in autocommit mode.
+
+    Uses the shared pool when open_pool() has been called, otherwise opens a
+    one-off connection. As with db.get_db(), a temporary overflow connection is
+    opened instead of waiting when every pooled one is checked out, so nested
+    get_db() calls can't deadlock. Writes belong in write(), not here.
+    """
+    pool = _pool
+    if pool is None or (pool.get_idle_size() == 0 and pool.get_size() >= pool.get_max_size()):
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            yield conn
+        finally:
+            await conn.close()
+        return
+    async with pool.acquire() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def get_read_db(shop_id: int | None = None):
+    """Yield a connection inside a READ ONLY, REPEATABLE READ transaction.
+
+    Like db.get_read_db(): one snapshot for the block and no writes. PostgreSQL
+    readers never wait on writers, so they come from the shared pool.
+    """
+    async with get_db() as conn:
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            yield conn
+
+
+async def write(fn, *args, **kwargs):
+    """Run `await fn(conn, *args, **kwargs)` in a transaction of its own and return its result.
+
+    PostgreSQL arbitrates concurrent writers itself, so there is no writer task or
+    group commit as in db.write(): each job commits on its own and is rolled back if
+    it raises. A job that loses a deadlock is retried. fn must not commit.
+    """
+    async with get_db() as conn:
+        for attempt in range(WRITE_DEADLOCK_RETRIES):
+            try:
+                async with conn.transaction():
+                    return await fn(conn, *args, **kwargs)
+            except asyncpg.DeadlockDetectedError:
+                if attempt == WRITE_DEADLOCK_RETRIES - 1:
+                    raise
+
+
+@asynccontextmanager
+async def get_shop_db(shop_id: int):
+    """Every shop lives in the one database here; the same as get_db()."""
+    async with get_db() as conn:
+        yield conn
+
+
+async def write_shop(shop_id: int, fn, *args, **kwargs):
+    """The same as write(); PostgreSQL already lets shops write concurrently."""
+    return await write(fn, *args, **kwargs)
+
+
+async def drop_shop_database(shop_id: int) -> bool:
+    """Shop data stays in the shared database on disconnect, as in SQLite's single layout."""
+    return False
+
+
+async def checkpoint_databases(truncate_above: int) -> list[dict]:
+    """PostgreSQL checkpoints its own WAL; nothing to do."""
+    return []
+
+
+async def maintain_databases(
+    shop_ids: list[int], budget_secs: float, analysis_limit: int = 1000, vacuum_pages: int = 256
+) -> list[dict]:
+    """PostgreSQL's autovacuum analyzes and vacuums on its own; nothing to do."""
+    return []
+
+
+def _rowcount(status: str) -> int:
+    """Rows affected, from a command status such as "DELETE 3" or "INSERT 0 1"."""
+    return int(status.rsplit(" ", 1)[-1])
+
+
+# ── Guild helpers ─────────────────────────────────────────────────────────────
+
+async def create_guild(
+    db: asyncpg.Connection,
+    guild_id: int,
+    guild_name: str,
+    setup_token: str,
+    setup_token_exp: int,
+) -> None:
+    """Insert a new guild row (ignores if already exists)."""
+    await create_guilds(db, [(guild_id, guild_name, setup_token, setup_token_exp)])
+
+
+async def create_guilds(db: asyncpg.Connection, guilds: list[tuple]) -> None:
+    """Insert many guild rows (ignores existing).
+
+    guilds is a list of (guild_id, guild_name, setup_token, setup_token_exp) tuples.
+    """
+    now = int(time.time())
+    await db.executemany(
+        """
+        INSERT INTO guilds (guild_id, guild_name, setup_token, setup_token_exp, created_at)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT DO NOTHING
+        """,
+        [(*g, now) for g in guilds],
+    )
+
+
+async def get_guild_ids(db: asyncpg.Connection) -> set[int]:
+    """Return the IDs of every guild the bot has a row for."""
+    rows = await db.fetch("SELECT guild_id FROM guilds")
+    return {row[0] for row in rows}
+
+
+async def get_guild(db: asyncpg.Connection, guild_id: int) -> asyncpg.Record | None:
+    return await db.fetchrow("SELECT * FROM guilds WHERE guild_id = $1", guild_id)
+
+
+async def get_guild_overview(db: asyncpg.Connection, guild_id: int) -> dict | None:
+    """Load a guild with its feature configs (for /status).
+
+    Returns None for unknown guilds, otherwise a dict with keys: guild, reminders,
+    backlog, digest, goal. The shop itself is read with get_shop().
+    """
+    guild = await get_guild(db, guild_id)
+    if guild is None:
+        return None
+    return {
+        "guild": guild,
+        "reminders": await get_guild_reminder_config(db, guild_id),
+        "backlog": await get_backlog_config(db, guild_id),
+        "digest": await get_digest_config(db, guild_id),
+        "goal": await get_goal_config(db, guild_id),
+    }
+
+
+async def get_guild_by_setup_token(
+    db: asyncpg.Connection, setup_token: str
+) -> asyncpg.Record | None:
+    return await db.fetchrow("SELECT * FROM guilds WHERE setup_token = $1", setup_token)
+
+
+async def get_connected_guilds(
+    db: asyncpg.Connection,
+    shard_count: int | None = None,
+    shard_ids: list[int] | None = None,
+) -> list:
+    """Return all guilds that have a connected Etsy shop and an order channel set.
+
+    When shard_count and shard_ids are given, only guilds owned by those shards are
+    returned, using Discord's (guild_id >> 22) % shard_count mapping.
+    """
+    sql = """
+        SELECT * FROM guilds
+        WHERE etsy_shop_id IS NOT NULL AND order_channel_id IS NOT NULL
+        """
+    args: list = []
+    if shard_count and shard_ids is not None:
+        sql += " AND ((guild_id >> 22) % $1) = ANY($2::bigint[])"
+        args = [shard_count, shard_ids]
+    rows: list[asyncpg.Record] = await db.fetch(sql, *args)
+    return rows
+
+
+async def refresh_setup_token(
+    db: asyncpg.Connection, guild_id: int, setup_token: str, setup_token_exp: int
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET setup_token = $1, setup_token_exp = $2 WHERE guild_id = $3",
+        setup_token, setup_token_exp, guild_id,
+    )
+
+
+async def update_guild_etsy(
+    db: asyncpg.Connection, guild_id: int, etsy_shop_id: int
+) -> None:
+    """Mark a guild's Etsy shop as connected."""
+    await db.execute(
+        """
+        UPDATE guilds
+        SET etsy_shop_id = $1, connected_at = $2, setup_token = NULL, setup_token_exp = NULL
+        WHERE guild_id = $3
+        """,
+        etsy_shop_id, int(time.time()), guild_id,
+    )
+
+
+async def update_guild_channel(
+    db: asyncpg.Connection, guild_id: int, channel_id: int
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET order_channel_id = $1 WHERE guild_id = $2", channel_id, guild_id
+    )
+
+
+# ── Bot state helpers ─────────────────────────────────────────────────────────
+
+async def get_bot_state(db: asyncpg.Connection, key: str) -> str | None:
+    value: str | None = await db.fetchval("SELECT value FROM bot_state WHERE key = $1", key)
+    return value
+
+
+async def set_bot_state(db: asyncpg.Connection, key: str, value: str) -> None:
+    await db.execute(
+        """
+        INSERT INTO bot_state (key, value, updated_at) VALUES ($1, $2, $3)
+        ON CONFLICT(key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+        """,
+        key, value, int(time.time()),
+    )
+
+
+# ── Etsy token helpers ────────────────────────────────────────────────────────
+
+async def get_guild_tokens(
+    db: asyncpg.Connection, guild_id: int
+) -> asyncpg.Record | None:
+    return await db.fetchrow("SELECT * FROM etsy_tokens WHERE guild_id = $1", guild_id)
+
+
+async def save_guild_tokens(
+    db: asyncpg.Connection,
+    guild_id: int,
+    access_token: str,
+    refresh_token: str,
+    expires_at: int,
+) -> None:
+    await db.execute(
+        """
+        INSERT INTO etsy_tokens (guild_id, access_token, refresh_token, expires_at)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (guild_id) DO UPDATE SET
+            access_token = excluded.access_token,
+            refresh_token = excluded.refresh_token,
+            expires_at = excluded.expires_at
+        """,
+        guild_id, access_token, refresh_token, expires_at,
+    )
+
+
+async def connect_guild(
+    db: asyncpg.Connection,
+    guild_id: int,
+    etsy_shop_id: int,
+    access_token: str,
+    refresh_token: str,
+    expires_at: int,
+) -> None:
+    """Store the tokens and shop from a finished OAuth flow (both or neither, in write()).
+
+    Also records a guild event, so a bot process picks the connection up at once.
+    """
+    await save_guild_tokens(db, guild_id, access_token, refresh_token, expires_at)
+    await update_guild_etsy(db, guild_id, etsy_shop_id)
+    await add_guild_event(db, guild_id)
+
+
+# ── Guild event helpers ───────────────────────────────────────────────────────
+# As in db.py. event_ids are handed out before commit here, so one can become
+# visible after a higher one; the bot's periodic full resync covers that.
+
+async def add_guild_event(db: asyncpg.Connection, guild_id: int) -> None:
+    await db.execute(
+        "INSERT INTO guild_events (guild_id, created_at) VALUES ($1, $2)",
+        guild_id, int(time.time()),
+    )
+
+
+async def get_guild_events(
+    db: asyncpg.Connection, after_event_id: int, limit: int = 100
+) -> list:
+    """Return up to `limit` events newer than after_event_id, oldest first."""
+    rows: list[asyncpg.Record] = await db.fetch(
+        "SELECT * FROM guild_events WHERE event_id > $1 ORDER BY event_id LIMIT $2",
+        after_event_id, limit,
+    )
+    return rows
+
+
+async def get_last_guild_event_id(db: asyncpg.Connection) -> int:
+    value: int = await db.fetchval("SELECT COALESCE(MAX(event_id), 0) FROM guild_events")
+    return value
+
+
+async def delete_guild_events(db: asyncpg.Connection, before: int) -> int:
+    """Drop events created before the `before` timestamp. Returns how many were removed."""
+    return _rowcount(await db.execute("DELETE FROM guild_events WHERE created_at < $1", before))
+
+
+# ── PKCE state helpers ────────────────────────────────────────────────────────
+
+async def save_pkce_state(
+    db: asyncpg.Connection,
+    state: str,
+    code_verifier: str,
+    setup_token: str,
+    guild_id: int,
+    expires_at: int,
+) -> None:
+    await db.execute(
+        """
+        INSERT INTO pkce_state (state, code_verifier, setup_token, guild_id, expires_at)
+        VALUES ($1, $2, $3, $4, $5)
+        ON CONFLICT (state) DO UPDATE SET
+            code_verifier = excluded.code_verifier,
+            setup_token = excluded.setup_token,
+            guild_id = excluded.guild_id,
+            expires_at = excluded.expires_at
+        """,
+        state, code_verifier, setup_token, guild_id, expires_at,
+    )
+    await db.execute("DELETE FROM pkce_state WHERE expires_at <= $1", int(time.time()))
+
+
+async def get_pkce_state(db: asyncpg.Connection, state: str) -> asyncpg.Record | None:
+    return await db.fetchrow(
+        "SELECT * FROM pkce_state WHERE state = $1 AND expires_at > $2", state, int(time.time())
+    )
+
+
+async def delete_pkce_state(db: asyncpg.Connection, state: str) -> None:
+    await db.execute("DELETE FROM pkce_state WHERE state = $1", state)
+
+
+async def consume_pkce_state(db: asyncpg.Connection, state: str) -> asyncpg.Record | None:
+    """Delete an unexpired PKCE state and return it, so it can only be used once."""
+    return await db.fetchrow(
+        "DELETE FROM pkce_state WHERE state = $1 AND expires_at > $2 RETURNING *",
+        state, int(time.time()),
+    )
+
+
+async def delete_expired_pkce_states(db: asyncpg.Connection, now: int) -> int:
+    """Drop OAuth states that expired unused. Returns how many were removed."""
+    return _rowcount(await db.execute("DELETE FROM pkce_state WHERE expires_at <= $1", now))
+
+
+# ── Bulk upsert helpers ───────────────────────────────────────────────────────
+
+# PostgreSQL's cap on bind parameters per statement
+_MAX_VARIABLES = 32767
+
+
+async def _upsert_rows(
+    conn: asyncpg.Connection,
+    table: str,
+    columns: tuple[str, ...],
+    rows: list[tuple],
+    update: tuple[str, ...],
+    keep_existing: bool = False,
+    track: tuple[str, ...] = (),
+) -> dict[int, asyncpg.Record]:
+    """Insert rows with multi-row VALUES statements and return the touched rows.
+
+    Behaves like db._upsert_rows(): the first column is the primary key, conflicts
+    update the `update` columns only when something differs, and each `track`
+    column's prev_<column> receives the old value. A statement may not touch the
+    same row twice here, so rows repeating a key are collapsed to the last one.
+    """
+    if not rows:
+        return {}
+    rows = list({row[0]: row for row in rows}.values())
+    key = columns[0]
+    if not update:
+        conflict = "DO NOTHING"
+    else:
+        if keep_existing:
+            new = [f"COALESCE(excluded.{c}, {table}.{c})" for c in update]
+        else:
+            new = [f"excluded.{c}" for c in update]
+        assignments = [f"prev_{c} = {table}.{c}" for c in track]
+        assignments += [f"{c} = {v}" for c, v in zip(update, new, strict=True)]
+        conflict = (
+            "DO UPDATE SET "
+            + ", ".join(assignments)
+            + f" WHERE ({', '.join(f'{table}.{c}' for c in update)})"
+            + f" IS DISTINCT FROM ({', '.join(new)})"
+        )
+    returning = ", ".join([key, *track, *(f"prev_{c}" for c in track)])
+    per_statement = max(1, _MAX_VARIABLES // len(columns))
+
+    touched: dict[int, asyncpg.Record] = {}
+    for i in range(0, len(rows), per_statement):
+        chunk = rows[i:i + per_statement]
+        values = ", ".join(
+            "(" + ", ".join(f"${n * len(columns) + c + 1}" for c in range(len(columns))) + ")"
+            for n in range(len(chunk))
+        )
+        result = await conn.fetch(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES {values} "
+            f"ON CONFLICT({key}) {conflict} RETURNING {returning}",
+            *[value for row in chunk for value in row],
+        )
+        touched.update((row[0], row) for row in result)
+    return touched
+
+
+# ── Shop / listing / receipt helpers ─────────────────────────────────────────
+
+async def upsert_shop(db: asyncpg.Connection, shop: dict) -> bool:
+    """Insert or refresh a shop row, writing only if its data changed.
+
+    Returns True if anything was written.
+    """
+    row = _shop_row(shop, int(time.time()))
+    return bool(await _upsert_rows(db, "shops", _SHOP_COLUMNS, [row], update=_SHOP_COLUMNS[1:-1]))
+
+
+async def mark_shop_synced(db: asyncpg.Connection, shop_id: int, *stages: str) -> None:
+    """Record that the given stages ("listings", "receipts", "reviews") were just fetched."""
+    if not stages:
+        return
+    for stage in stages:
+        if stage not in _SYNC_STAGES:
+            raise ValueError(f"unknown sync stage: {stage}")
+    now = int(time.time())
+    columns = [f"{stage}_synced_at" for stage in stages]
+    await db.execute(
+        f"""
+        INSERT INTO shop_sync (shop_id, {", ".join(columns)})
+        VALUES ($1, {", ".join(f"${n + 2}" for n in range(len(columns)))})
+        ON CONFLICT(shop_id) DO UPDATE SET {", ".join(f"{c} = excluded.{c}" for c in columns)}
+        """,
+        shop_id, *([now] * len(columns)),
+    )
+
+
+async def get_shop_sync(db: asyncpg.Connection, shop_id: int) -> asyncpg.Record | None:
+    return await db.fetchrow("SELECT * FROM shop_sync WHERE shop_id = $1", shop_id)
+
+
+async def get_shop(db: asyncpg.Connection, shop_id: int) -> asyncpg.Record | None:
+    return await db.fetchrow("SELECT * FROM shops WHERE shop_id = $1", shop_id)
+
+
+async def get_shop_name(db: asyncpg.Connection, shop_id: int) -> str | None:
+    value: str | None = await db.fetchval("SELECT shop_name FROM shops WHERE shop_id = $1", shop_id)
+    return value
+
+
+async def upsert_listing(db: asyncpg.Connection, listing: dict) -> None:
+    await upsert_listings(db, [listing])
+
+
+async def upsert_listings(db: asyncpg.Connection, listings: list) -> dict[int, asyncpg.Record]:
+    """Upsert a page of listings in one statement per chunk.
+
+    Returns {listing_id: row} for listings that were inserted or whose data
+    changed, each row carrying quantity and prev_quantity (NULL when new).
+    """
+    now = int(time.time())
+    return await _upsert_rows(
+        db,
+        "listings",
+        _LISTING_COLUMNS,
+        [_listing_row(listing, now) for listing in listings],
+        update=_LISTING_COLUMNS[1:-1],
+        track=("quantity",),
+    )
+
+
+async def _upsert_transaction_rows(
+    conn: asyncpg.Connection, rows: list[tuple]
+) -> dict[int, asyncpg.Record]:
+    # Line items are write-once except for the detail fields Etsy fills in later
+    return await _upsert_rows(
+        conn,
+        "transactions",
+        _TRANSACTION_COLUMNS,
+        rows,
+        update=("selected_variations", "personalization_msg", "image_url"),
+        keep_existing=True,
+    )
+
+
+async def upsert_transactions(
+    db: asyncpg.Connection, receipt_id: int, shop_id: int, transactions: list
+) -> dict[int, asyncpg.Record]:
+    """Upsert line-item transactions from a receipt. Returns new/changed transaction IDs."""
+    now = int(time.time())
+    rows = [_transaction_row(t, receipt_id, shop_id, now) for t in transactions]
+    return await _upsert_transaction_rows(db, rows)
+
+
+async def upsert_receipts_transactions(
+    db: asyncpg.Connection, receipts: list
+) -> dict[int, asyncpg.Record]:
+    """Upsert the line items embedded in a page of receipts in one pass."""
+    now = int(time.time())
+    return await _upsert_transaction_rows(
+        db,
+        [
+            _transaction_row(t, receipt["receipt_id"], receipt["shop_id"], now)
+            for receipt in receipts
+            for t in receipt.get("transactions", [])
+        ],
+    )
+
+
+async def get_bestsellers(
+    db: asyncpg.Connection,
+    shop_id: int,
+    period: str,
+    ranked_by: str = "units",
+    limit: int = 5,
+) -> list:
+    """Return top listings by units sold or revenue for a shop in a period.
+
+    period: "all", a year ("2026") or a month ("2026-03"), in UTC.
+    ranked_by: "units" (default) or "revenue".
+    """
+    order_col = "units" if ranked_by == "units" else "revenue_minor_units"
+    rows: list[asyncpg.Record] = await db.fetch(
+        f"""
+        SELECT
+            listing_id,
+            title,
+            image_url,
+            units AS units_sold,
+            revenue_minor_units::float8 / divisor AS total_revenue,
+            currency
+        FROM listing_sales
+        WHERE shop_id = $1 AND period = $2 AND {order_col} > 0
+        ORDER BY {order_col} DESC
+        LIMIT $3
+        """,
+        shop_id, period, limit,
+    )
+    return rows
+
+
+async def upsert_receipts(
+    db: asyncpg.Connection, receipts: list, already_seen: bool = False
+) -> dict[int, asyncpg.Record]:
+    """Upsert a page of receipts in one statement per chunk.
+
+    New rows get notified_at set only when already_seen; existing rows keep their
+    notified_at and only have the mutable fields refreshed. Returns
+    {receipt_id: row} for receipts that were inserted or changed, each row carrying
+    status/is_shipped and prev_status/prev_is_shipped (NULL when new).
+    """
+    now = int(time.time())
+    notified_at = now if already_seen else None
+    return await _upsert_rows(
+        db,
+        "receipts",
+        _RECEIPT_COLUMNS,
+        [_receipt_row(receipt, notified_at, now) for receipt in receipts],
+        update=_RECEIPT_MUTABLE_COLUMNS,
+        track=("status", "is_shipped"),
+    )
+
+
+async def upsert_receipt(
+    db: asyncpg.Connection, receipt: dict, already_seen: bool = False
+) -> bool:
+    """
+    Insert or refresh a single receipt, preserving notified_at.
+    Returns True if a new row was inserted.
+    """
+    changed = await upsert_receipts(db, [receipt], already_seen=already_seen)
+    row = changed.get(receipt["receipt_id"])
+    return row is not None and row["prev_status"] is None
+
+
+async def ingest_shop_page(
+    db: asyncpg.Connection,
+    shop_id: int,
+    shop: dict,
+    listings: list,
+    receipts: list,
+    reviews: list | None = None,
+    already_seen: bool = False,
+) -> tuple[dict[int, asyncpg.Record], dict[int, asyncpg.Record]]:
+    """Store one poll's worth of Etsy data.
+
+    Upserts the shop, listings, receipts with their line items and, when given,
+    reviews, then records the fetched stages in shop_sync. Returns
+    (listing_changes, receipt_changes) as reported by upsert_listings / upsert_receipts.
+    """
+    await upsert_shop(db, shop)
+    listing_changes = await upsert_listings(db, listings)
+    receipt_changes = await upsert_receipts(db, receipts, already_seen)
+    await upsert_receipts_transactions(db, receipts)
+    stages = ["listings", "receipts"]
+    if reviews is not None:
+        await upsert_reviews(db, reviews, already_seen)
+        stages.append("reviews")
+    await mark_shop_synced(db, shop_id, *stages)
+    return listing_changes, receipt_changes
+
+
+async def get_receipt(
+    db: asyncpg.Connection, shop_id: int, receipt_id: int
+) -> asyncpg.Record | None:
+    """Return one of a shop's receipts, or None."""
+    return await db.fetchrow(
+        "SELECT * FROM receipts WHERE receipt_id = $1 AND shop_id = $2", receipt_id, shop_id
+    )
+
+
+async def get_unnotified_receipts(db: asyncpg.Connection, shop_id: int) -> list:
+    """Return receipts awaiting a notification, oldest first.
+
+    Each row also carries `is_returning`: 1 when the buyer had an earlier order.
+    """
+    rows: list[asyncpg.Record] = await db.fetch(
+        """
+        SELECT r.*, (b.first_receipt_id IS NOT NULL
+                     AND b.first_receipt_id != r.receipt_id)::int AS is_returning
+        FROM receipts r
+        LEFT JOIN buyers b ON b.shop_id = r.shop_id AND b.buyer_user_id = r.buyer_user_id
+        WHERE r.shop_id = $1 AND r.notified_at IS NULL
+        ORDER BY r.create_timestamp ASC
+        """,
+        shop_id,
+    )
+    return rows
+
+
+async def get_shop_counters(db: asyncpg.Connection, shop_id: int) -> dict:
+    """Return the trigger-maintained open_orders, unnotified_receipts and unnotified_reviews."""
+    row = await db.fetchrow(
+        """
+        SELECT open_orders, unnotified_receipts, unnotified_reviews
+        FROM shop_counters WHERE shop_id = $1
+        """,
+        shop_id,
+    )
+    if row is None:
+        return {"open_orders": 0, "unnotified_receipts": 0, "unnotified_reviews": 0}
+    return dict(row)
+
+
+async def mark_receipt_notified(db: asyncpg.Connection, receipt_id: int) -> None:
+    await db.execute(
+        "UPDATE receipts SET notified_at = $1 WHERE receipt_id = $2", int(time.time()), receipt_id
+    )
+
+
+# ── Shipping reminder helpers ─────────────────────────────────────────────────
+
+async def get_pending_reminders(
+    db: asyncpg.Connection,
+    shop_id: int,
+    days_before: int,
+    lower: int,
+    upper: int,
+) -> list:
+    """Return unshipped receipts whose ship date falls within [lower, upper) that haven't had this reminder sent."""
+    rows: list[asyncpg.Record] = await db.fetch(
+        """
+        SELECT r.*
+        FROM receipts r
+        WHERE r.shop_id = $1
+          AND r.is_shipped = 0
+          AND r.expected_ship_date IS NOT NULL
+          AND r.expected_ship_date >= $2
+          AND r.expected_ship_date < $3
+          AND NOT EXISTS (
+              SELECT 1 FROM shipping_reminders sr
+              WHERE sr.receipt_id = r.receipt_id
+                AND sr.days_before = $4
+          )
+        ORDER BY r.expected_ship_date ASC
+        """,
+        shop_id, lower, upper, days_before,
+    )
+    return rows
+
+
+async def get_receipt_transactions(
+    db: asyncpg.Connection,
+    receipt_id: int,
+) -> list[dict]:
+    """Return transactions for a receipt with selected_variations parsed from JSON."""
+    rows = await db.fetch(
+        "SELECT * FROM transactions WHERE receipt_id = $1 ORDER BY transaction_id ASC",
+        receipt_id,
+    )
+    result = []
+    for row in rows:
+        d = dict(row)
+        raw = d.get("selected_variations")
+        if raw:
+            try:
+                d["selected_variations"] = json.loads(raw)
+            except Exception:
+                d["selected_variations"] = []
+        else:
+            d["selected_variations"] = []
+        result.append(d)
+    return result
+
+
+async def mark_reminder_sent(
+    db: asyncpg.Connection,
+    receipt_id: int,
+    days_before: int,
+) -> None:
+    await db.execute(
+        """
+        INSERT INTO shipping_reminders (receipt_id, days_before, sent_at)
+        VALUES ($1, $2, $3)
+        ON CONFLICT DO NOTHING
+        """,
+        receipt_id, days_before, int(time.time()),
+    )
+
+
+async def get_guild_reminder_config(
+    db: asyncpg.Connection,
+    guild_id: int,
+) -> dict | None:
+    """Return reminder config for a guild, or None if reminders are not set.
+
+    Returns a dict with keys: days (list[int]), time (str | None), tz (str | None).
+    """
+    row = await db.fetchrow(
+        "SELECT ship_reminder_days, ship_reminder_time, ship_reminder_tz FROM guilds WHERE guild_id = $1",
+        guild_id,
+    )
+    if row is None or row[0] is None:
+        return None
+    return {
+        "days": json.loads(row[0]),
+        "time": row[1],
+        "tz": row[2],
+    }
+
+
+async def set_guild_reminder_days(
+    db: asyncpg.Connection,
+    guild_id: int,
+    days: list[int],
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET ship_reminder_days = $1 WHERE guild_id = $2", json.dumps(days), guild_id
+    )
+
+
+async def set_guild_reminder_time(
+    db: asyncpg.Connection,
+    guild_id: int,
+    time_str: str,
+    tz: str,
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET ship_reminder_time = $1, ship_reminder_tz = $2 WHERE guild_id = $3",
+        time_str, tz, guild_id,
+    )
+
+
+async def disable_guild_reminders(
+    db: asyncpg.Connection,
+    guild_id: int,
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET ship_reminder_days = NULL, ship_reminder_time = NULL, ship_reminder_tz = NULL WHERE guild_id = $1",
+        guild_id,
+    )
+
+
+async def get_active_listings(db: asyncpg.Connection, shop_id: int) -> list:
+    """Return all active listings for a shop, ordered by title."""
+    rows: list[asyncpg.Record] = await db.fetch(
+        """
+        SELECT listing_id, title, quantity, url,
+               price_amount, price_divisor, price_currency_code
+        FROM listings
+        WHERE shop_id = $1 AND state = 'active'
+        ORDER BY title ASC
+        """,
+        shop_id,
+    )
+    return rows
+
+
+def _sales_totals(rows: list) -> dict:
+    rows = [r for r in rows if r["orders"]]
+    return {
+        "orders": sum(r["orders"] for r in rows),
+        "revenue": sum(r["revenue"] for r in rows),
+        "currency": rows[0]["currency"] if rows else None,
+    }
+
+
+async def get_sales_since(
+    db: asyncpg.Connection, shop_id: int, since_timestamp: int
+) -> dict:
+    """Return {"orders", "revenue", "currency"} for non-canceled receipts since since_timestamp.
+
+    Reads the daily_sales rollup, so the window is whole UTC days: since_timestamp
+    is rounded down to midnight. revenue is in major units; currency is the one with
+    the most orders, or None when there were none.
+    """
+    rows = await db.fetch(
+        """
+        SELECT currency, SUM(orders)::bigint AS orders,
+               SUM(revenue_minor_units::float8 / divisor) AS revenue
+        FROM daily_sales
+        WHERE shop_id = $1
+          AND day >= to_char(to_timestamp($2) AT TIME ZONE 'UTC', 'YYYY-MM-DD')
+        GROUP BY currency
+        ORDER BY orders DESC
+        """,
+        shop_id, since_timestamp,
+    )
+    return _sales_totals(rows)
+
+
+async def get_receipt_totals_since(
+    db: asyncpg.Connection, shop_id: int, since_timestamp: int
+) -> dict:
+    """Like get_sales_since, but to the second, for rolling windows such as the last 24h.
+
+    Aggregates receipts directly, so keep the window short.
+    """
+    rows = await db.fetch(
+        """
+        SELECT grandtotal_currency AS currency, COUNT(*) AS orders,
+               SUM(grandtotal_amount::float8 / grandtotal_divisor) AS revenue
+        FROM receipts
+        WHERE shop_id = $1 AND create_timestamp >= $2 AND status_code != $3
+        GROUP BY grandtotal_currency
+        ORDER BY orders DESC
+        """,
+        shop_id, since_timestamp, schema.STATUS_CANCELED,
+    )
+    return _sales_totals(rows)
+
+
+# ── Shipping preset helpers ───────────────────────────────────────────────────
+
+async def add_preset(
+    db: asyncpg.Connection,
+    guild_id: int,
+    name: str,
+    carrier: str,
+    mail_class: str,
+    weight_oz: float,
+    length_in: float,
+    width_in: float,
+    height_in: float,
+    package_type: str = "",
+) -> bool:
+    """Insert a new preset. Returns True if inserted, False if name already exists."""
+    status = await db.execute(
+        """
+        INSERT INTO shipping_presets
+            (guild_id, name, carrier, mail_class, package_type, weight_oz, length_in, width_in, height_in, created_at)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+        ON CONFLICT DO NOTHING
+        """,
+        guild_id, name, carrier, mail_class, package_type, weight_oz, length_in, width_in,
+        height_in, int(time.time()),
+    )
+    return _rowcount(status) == 1
+
+
+async def list_presets(db: asyncpg.Connection, guild_id: int) -> list:
+    """Return all presets for a guild, ordered by name."""
+    rows: list[asyncpg.Record] = await db.fetch(
+        "SELECT * FROM shipping_presets WHERE guild_id = $1 ORDER BY name ASC", guild_id
+    )
+    return rows
+
+
+async def delete_preset(db: asyncpg.Connection, guild_id: int, name: str) -> bool:
+    """Delete a preset by name. Returns True if a row was deleted."""
+    status = await db.execute(
+        "DELETE FROM shipping_presets WHERE guild_id = $1 AND name = $2", guild_id, name
+    )
+    return _rowcount(status) == 1
+
+
+async def get_labelable_receipts(
+    db: asyncpg.Connection, shop_id: int, search: str = ""
+) -> list:
+    """Return paid, unshipped receipts for label autocomplete, newest first.
+
+    With `search`, only receipts whose ID, buyer or items match it (see search_orders).
+    """
+    query = _ts_query(search)
+    rows: list[asyncpg.Record] = await db.fetch(
+        f"""
+        SELECT r.receipt_id, r.name, r.create_timestamp,
+               string_agg(
+                   CASE WHEN t.quantity > 1 THEN t.quantity || 'x ' || t.title ELSE t.title END,
+                   ', ' ORDER BY t.transaction_id
+               ) AS items
+        FROM receipts r
+        LEFT JOIN transactions t ON t.receipt_id = r.receipt_id AND t.shop_id = r.shop_id
+        WHERE r.shop_id = $1 AND r.is_open = 1 AND r.is_paid = 1
+          {'''AND r.receipt_id IN (SELECT receipt_id FROM orders_fts
+                                   WHERE shop_id = $1 AND document @@ to_tsquery('simple', $2))'''
+           if query else ""}
+        GROUP BY r.receipt_id
+        ORDER BY r.create_timestamp DESC
+        LIMIT 25
+        """,
+        *((shop_id, query) if query else (shop_id,)),
+    )
+    return rows
+
+
+async def get_preset_by_name(db: asyncpg.Connection, guild_id: int, name: str):
+    """Return a single preset row by name, or None."""
+    return await db.fetchrow(
+        "SELECT * FROM shipping_presets WHERE guild_id = $1 AND name = $2", guild_id, name
+    )
+
+
+# ── Review helpers ────────────────────────────────────────────────────────────
+
+async def upsert_reviews(
+    db: asyncpg.Connection, reviews: list, already_seen: bool = False
+) -> dict[int, asyncpg.Record]:
+    """Insert a page of reviews, ignoring ones already stored (preserves notified_at).
+
+    Returns {transaction_id: row} for newly inserted reviews.
+    """
+    now = int(time.time())
+    notified_at = now if already_seen else None
+    rows = [_review_row(review, notified_at, now) for review in reviews]
+    return await _upsert_rows(db, "reviews", _REVIEW_COLUMNS, rows, update=())
+
+
+async def upsert_review(
+    db: asyncpg.Connection, review: dict, already_seen: bool = False
+) -> bool:
+    """
+    Insert a new review row, ignoring conflicts to preserve notified_at.
+    Returns True if a new row was inserted.
+    """
+    return bool(await upsert_reviews(db, [review], already_seen=already_seen))
+
+
+async def get_unnotified_reviews(db: asyncpg.Connection, shop_id: int) -> list:
+    rows: list[asyncpg.Record] = await db.fetch(
+        """
+        SELECT r.*, t.title AS listing_title
+        FROM reviews r
+        LEFT JOIN transactions t ON t.transaction_id = r.transaction_id
+        WHERE r.shop_id = $1 AND r.notified_at IS NULL
+        ORDER BY r.create_timestamp ASC
+        """,
+        shop_id,
+    )
+    return rows
+
+
+async def mark_review_notified(db: asyncpg.Connection, transaction_id: int) -> None:
+    await db.execute(
+        "UPDATE reviews SET notified_at = $1 WHERE transaction_id = $2",
+        int(time.time()), transaction_id,
+    )
+
+
+async def get_goal_config(
+    db: asyncpg.Connection, guild_id: int
+) -> dict | None:
+    """Return goal config for a guild, or None if no goal is set.
+
+    Returns a dict with keys: amount_cents (int), milestones_sent (list[int]), month (str).
+    """
+    row = await db.fetchrow(
+        "SELECT goal_amount, goal_milestones_sent, goal_month FROM guilds WHERE guild_id = $1",
+        guild_id,
+    )
+    if row is None or row[0] is None:
+        return None
+    return {
+        "amount_cents": row[0],
+        "milestones_sent": json.loads(row[1]) if row[1] else [],
+        "month": row[2],
+    }
+
+
+async def set_goal_amount(
+    db: asyncpg.Connection, guild_id: int, amount_cents: int
+) -> None:
+    """Set the monthly revenue goal. Resets milestone tracking."""
+    current_month = datetime.date.today().strftime("%Y-%m")
+    await db.execute(
+        """
+        UPDATE guilds
+        SET goal_amount = $1, goal_milestones_sent = $2, goal_month = $3
+        WHERE guild_id = $4
+        """,
+        amount_cents, json.dumps([]), current_month, guild_id,
+    )
+
+
+async def disable_goal(db: asyncpg.Connection, guild_id: int) -> None:
+    await db.execute(
+        "UPDATE guilds SET goal_amount = NULL, goal_milestones_sent = NULL, goal_month = NULL WHERE guild_id = $1",
+        guild_id,
+    )
+
+
+async def update_goal_milestones(
+    db: asyncpg.Connection, guild_id: int, milestones_sent: list[int], month: str
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET goal_milestones_sent = $1, goal_month = $2 WHERE guild_id = $3",
+        json.dumps(milestones_sent), month, guild_id,
+    )
+
+
+async def get_digest_config(
+    db: asyncpg.Connection, guild_id: int
+) -> dict | None:
+    """Return digest config for a guild, or None if disabled.
+
+    Returns a dict with keys: time (str), tz (str), last_sent (int | None).
+    """
+    row = await db.fetchrow(
+        "SELECT digest_time, digest_tz, digest_last_sent FROM guilds WHERE guild_id = $1",
+        guild_id,
+    )
+    if row is None or row[0] is None:
+        return None
+    return {"time": row[0], "tz": row[1], "last_sent": row[2]}
+
+
+async def get_digest_data(
+    db: asyncpg.Connection, shop_id: int, now: int, goal: dict | None = None
+) -> dict:
+    """Collect everything the daily digest shows.
+
+    goal is the guild's get_goal_config(). Returns a dict with keys: sales_24h
+    (get_receipt_totals_since over the last day), currency (str), open_count (int),
+    due_soon (rows due within two days), goal (as passed) and month_sales
+    (get_sales_since for this month, when a goal is set).
+    """
+    sales_24h = await get_receipt_totals_since(db, shop_id, now - 86400)
+    month_sales = None
+    if goal:
+        now_dt = datetime.datetime.fromtimestamp(now, datetime.timezone.utc)
+        month_start = datetime.datetime(now_dt.year, now_dt.month, 1, tzinfo=datetime.timezone.utc)
+        month_sales = await get_sales_since(db, shop_id, int(month_start.timestamp()))
+    return {
+        "sales_24h": sales_24h,
+        "currency": sales_24h["currency"] or await get_shop_currency(db, shop_id),
+        "open_count": await get_open_order_count(db, shop_id),
+        "due_soon": await get_receipts_due_within(db, shop_id, 2 * 86400, now),
+        "goal": goal,
+        "month_sales": month_sales,
+    }
+
+
+async def set_digest_config(
+    db: asyncpg.Connection, guild_id: int, time_str: str, tz: str
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET digest_time = $1, digest_tz = $2 WHERE guild_id = $3",
+        time_str, tz, guild_id,
+    )
+
+
+async def disable_digest(db: asyncpg.Connection, guild_id: int) -> None:
+    await db.execute(
+        "UPDATE guilds SET digest_time = NULL, digest_tz = NULL, digest_last_sent = NULL WHERE guild_id = $1",
+        guild_id,
+    )
+
+
+async def mark_digest_sent(db: asyncpg.Connection, guild_id: int, sent_at: int) -> None:
+    await db.execute(
+        "UPDATE guilds SET digest_last_sent = $1 WHERE guild_id = $2", sent_at, guild_id
+    )
+
+
+async def get_receipts_due_within(
+    db: asyncpg.Connection, shop_id: int, within_seconds: int, now: int
+) -> list:
+    """Return unshipped, non-canceled receipts with a ship deadline in the next within_seconds."""
+    rows: list[asyncpg.Record] = await db.fetch(
+        """
+        SELECT receipt_id, name, grandtotal_amount, grandtotal_divisor,
+               grandtotal_currency, expected_ship_date
+        FROM receipts
+        WHERE shop_id = $1
+          AND is_open = 1
+          AND expected_ship_date IS NOT NULL
+          AND expected_ship_date <= $2
+        ORDER BY expected_ship_date ASC
+        """,
+        shop_id, now + within_seconds,
+    )
+    return rows
+
+
+async def get_shop_currency(db: asyncpg.Connection, shop_id: int) -> str:
+    """Return the currency_code for a shop, defaulting to USD."""
+    currency = await db.fetchval("SELECT currency_code FROM shops WHERE shop_id = $1", shop_id)
+    return currency or "USD"
+
+
+async def get_open_order_count(db: asyncpg.Connection, shop_id: int) -> int:
+    """Return the number of open, unshipped, non-canceled receipts for a shop."""
+    value: int = await db.fetchval(
+        "SELECT COUNT(*) FROM receipts WHERE shop_id = $1 AND is_open = 1", shop_id
+    )
+    return value
+
+
+async def get_backlog_config(
+    db: asyncpg.Connection, guild_id: int
+) -> dict | None:
+    """Return backlog config for a guild, or None if the feature is disabled.
+
+    Returns a dict with keys: threshold (int), warned (bool).
+    """
+    row = await db.fetchrow(
+        "SELECT backlog_threshold, backlog_warned FROM guilds WHERE guild_id = $1", guild_id
+    )
+    if row is None or row[0] is None:
+        return None
+    return {"threshold": row[0], "warned": bool(row[1])}
+
+
+async def set_backlog_threshold(
+    db: asyncpg.Connection, guild_id: int, threshold: int | None
+) -> None:
+    """Set the backlog threshold. Pass None to disable the feature."""
+    await db.execute(
+        "UPDATE guilds SET backlog_threshold = $1, backlog_warned = 0 WHERE guild_id = $2",
+        threshold, guild_id,
+    )
+
+
+async def set_backlog_warned(
+    db: asyncpg.Connection, guild_id: int, warned: bool
+) -> None:
+    await db.execute(
+        "UPDATE guilds SET backlog_warned = $1 WHERE guild_id = $2", 1 if warned else 0, guild_id
+    )
+
+
+async def is_returning_buyer(
+    db: asyncpg.Connection,
+    shop_id: int,
+    buyer_user_id: int | None,
+    current_receipt_id: int,
+) -> bool:
+    """Return True if this buyer's first order with the shop was a different receipt."""
+    if not buyer_user_id:
+        return False
+    first = await db.fetchval(
+        "SELECT first_receipt_id FROM buyers WHERE shop_id = $1 AND buyer_user_id = $2",
+        shop_id, buyer_user_id,
+    )
+    return first is not None and first != current_receipt_id
+
+
+async def disconnect_guild(
+    db: asyncpg.Connection, guild_id: int, new_setup_token: str, new_setup_token_exp: int
+) -> None:
+    """Remove Etsy credentials and clear shop association for a guild."""
+    await db.execute("DELETE FROM etsy_tokens WHERE guild_id = $1", guild_id)
+    await db.execute(
+        """
+        UPDATE guilds
+        SET etsy_shop_id = NULL, order_channel_id = NULL, connected_at = NULL,
+            setup_token = $1, setup_token_exp = $2
+        WHERE guild_id = $3
+        """,
+        new_setup_token, new_setup_token_exp, guild_id,
+    )
+
+
+# ── Shippo helpers ────────────────────────────────────────────────────────────
+
+async def get_shippo_config(db: asyncpg.Connection, guild_id: int):
+    return await db.fetchrow("SELECT * FROM shippo_keys WHERE guild_id = $1", guild_id)
+
+
+async def save_shippo_key(db: asyncpg.Connection, guild_id: int, api_key: str) -> None:
+    await db.execute(
+        """
+        INSERT INTO shippo_keys (guild_id, api_key, created_at)
+        VALUES ($1, $2, $3)
+        ON CONFLICT(guild_id) DO UPDATE SET api_key = excluded.api_key
+        """,
+        guild_id, api_key, int(time.time()),
+    )
+
+
+async def save_shippo_address(
+    db: asyncpg.Connection,
+    guild_id: int,
+    name: str,
+    street1: str,
+    street2: str,
+    city: str,
+    state: str,
+    zip_code: str,
+    country: str,
+    phone: str = "",
+) -> None:
+    await db.execute(
+        """
+        INSERT INTO shippo_keys (guild_id, api_key, addr_name, addr_street1, addr_street2,
+                                 addr_city, addr_state, addr_zip, addr_country, addr_phone, created_at)
+        VALUES ($1, '', $2, $3, $4, $5, $6, $7, $8, $9, $10)
+        ON CONFLICT(guild_id) DO UPDATE SET
+            addr_name    = excluded.addr_name,
+            addr_street1 = excluded.addr_street1,
+            addr_street2 = excluded.addr_street2,
+            addr_city    = excluded.addr_city,
+            addr_state   = excluded.addr_state,
+            addr_zip     = excluded.addr_zip,
+            addr_country = excluded.addr_country,
+            addr_phone   = excluded.addr_phone
+        """,
+        guild_id, name, street1, street2, city, state, zip_code, country, phone, int(time.time()),
+    )
+
+
+async def delete_shippo_config(db: asyncpg.Connection, guild_id: int) -> None:
+    await db.execute("DELETE FROM shippo_keys WHERE guild_id = $1", guild_id)
+
+
+async def mark_receipt_shipped(db: asyncpg.Connection, receipt_id: int) -> None:
+    await db.execute("UPDATE receipts SET is_shipped = 1 WHERE receipt_id = $1", receipt_id)
+
+
+async def get_unshipped_paid_receipt_ids(db: asyncpg.Connection, shop_id: int) -> list[int]:
+    """Return receipt_ids that are locally marked paid+unshipped."""
+    rows = await db.fetch(
+        "SELECT receipt_id FROM receipts WHERE shop_id = $1 AND is_paid = 1 AND is_shipped = 0",
+        shop_id,
+    )
+    return [row["receipt_id"] for row in rows]
+
+
+async def mark_receipts_shipped_bulk(db: asyncpg.Connection, receipt_ids: list[int]) -> None:
+    """Mark multiple receipts as shipped in one statement."""
+    if not receipt_ids:
+        return
+    await db.execute(
+        "UPDATE receipts SET is_shipped = 1 WHERE receipt_id = ANY($1::bigint[])", receipt_ids
+    )
+
+
+async def get_buyer_orders(
+    db: asyncpg.Connection,
+    shop_id: int,
+    buyer_name: str,
+    limit: int = 5,
+    include_archive: bool = False,
+) -> list:
+    """Return recent paid receipts for the buyer(s) with this name (case-insensitive).
+
+    That is every receipt of a buyer whose latest name it is, plus receipts placed
+    under the name itself: older names of a buyer who has since changed it, and
+    guest checkouts, which have no buyer_user_id. With include_archive, receipts
+    moved to the archive schema are searched too.
+    """
+    sources = ["public", "archive"] if include_archive else ["public"]
+    tsquery = _ts_query(buyer_name, weights="A")
+    rows = []
+    for source in sources:
+        # Receipts under the name itself are found through orders_fts in public; the
+        # archive has none, so there the shop's receipts are scanned
+        by_name, args = "r.shop_id = $1", [shop_id, buyer_name, limit]
+        if source == "public" and tsquery is not None:
+            by_name = """r.receipt_id IN (
+                SELECT receipt_id FROM orders_fts
+                WHERE shop_id = $1 AND document @@ to_tsquery('simple', $4)
+            )"""
+            args.append(tsquery)
+        rows += await db.fetch(
+            f"""
+            SELECT r.receipt_id, r.name, r.create_timestamp,
+                   string_agg(t.title, ', ' ORDER BY t.transaction_id) AS items
+            FROM {source}.receipts r
+            LEFT JOIN {source}.transactions t
+              ON t.receipt_id = r.receipt_id AND t.shop_id = r.shop_id
+            WHERE r.receipt_id IN (
+                SELECT r.receipt_id
+                FROM buyers b
+                JOIN {source}.receipts r
+                  ON r.shop_id = b.shop_id AND r.buyer_user_id = b.buyer_user_id
+                WHERE b.shop_id = $1 AND b.name_norm = LOWER(TRIM($2))
+                UNION
+                SELECT r.receipt_id
+                FROM {source}.receipts r
+                WHERE {by_name} AND LOWER(TRIM(r.name)) = LOWER(TRIM($2))
+            ) AND r.is_paid = 1
+            GROUP BY r.receipt_id
+            ORDER BY r.create_timestamp DESC
+            LIMIT $3
+            """,
+            *args,
+        )
+    rows.sort(key=lambda r: r["create_timestamp"], reverse=True)
+    return rows[:limit]
+
+
+async def search_buyers(
+    db: asyncpg.Connection, shop_id: int, current: str, limit: int = 25
+) -> list[str]:
+    """Return up to `limit` distinct buyer names, most recent first.
+
+    With `current`, only buyers whose name has words starting with each of its words.
+    """
+    query = _ts_query(current, weights="A")
+    if query is None:
+        rows = await db.fetch(
+            """
+            SELECT name FROM buyers
+            WHERE shop_id = $1 AND name IS NOT NULL
+            ORDER BY last_order_at DESC
+            LIMIT $2
+            """,
+            shop_id, limit * 2,
+        )
+    else:
+        rows = await db.fetch(
+            """
+            SELECT b.name FROM buyers b
+            WHERE b.shop_id = $1 AND b.name IS NOT NULL AND b.buyer_user_id IN (
+                SELECT r.buyer_user_id FROM orders_fts f
+                JOIN receipts r ON r.receipt_id = f.receipt_id
+                WHERE f.shop_id = $1 AND f.document @@ to_tsquery('simple', $2)
+            )
+            ORDER BY b.last_order_at DESC
+            LIMIT $3
+            """,
+            shop_id, query, limit * 2,
+        )
+    names = list(dict.fromkeys(row["name"] for row in rows))
+    return names[:limit]
+
+
+# ── Retention ─────────────────────────────────────────────────────────────────
+
+async def copy_orders_to_archive(
+    db: asyncpg.Connection, older_than: int, batch_size: int = 500
+) -> list[int]:
+    """Copy up to batch_size finished orders created before older_than into the archive schema.
+
+    Same rules as db.copy_orders_to_archive(): each receipt is copied with its line
+    items, notified reviews and shipping reminders, and the receipt IDs copied are
+    returned for delete_archived_orders(). Copying again is a no-op.
+    """
+    receipt_ids = [
+        row[0]
+        for row in await db.fetch(
+            """
+            SELECT receipt_id FROM receipts
+            WHERE create_timestamp < $1 AND is_open = 0 AND notified_at IS NOT NULL
+              AND status_code = ANY($2::bigint[])
+            LIMIT $3
+            """,
+            older_than, list(_ARCHIVABLE_STATUS_CODES), batch_size,
+        )
+    ]
+    if not receipt_ids:
+        return []
+
+    async def copy(table: str, where: str) -> None:
+        columns = ", ".join(name for name, _ in await schema_pg._stored_columns(db, "archive", table))
+        await db.execute(
+            f"INSERT INTO archive.{table} ({columns}) "
+            f"SELECT {columns} FROM public.{table} WHERE {where} "
+            "ON CONFLICT DO NOTHING",
+            receipt_ids,
+        )
+
+    await copy("receipts", "receipt_id = ANY($1::bigint[])")
+    await copy("transactions", "receipt_id = ANY($1::bigint[])")
+    await copy("shipping_reminders", "receipt_id = ANY($1::bigint[])")
+    await copy(
+        "reviews",
+        "notified_at IS NOT NULL AND transaction_id IN "
+        "(SELECT transaction_id FROM public.transactions WHERE receipt_id = ANY($1::bigint[]))",
+    )
+    return receipt_ids
+
+
+async def delete_archived_orders(db: asyncpg.Connection, receipt_ids: list[int]) -> int:
+    """Remove orders copied by copy_orders_to_archive(); see db.delete_archived_orders().
+
+    Only receipts and reviews already in the archive schema are deleted, and
+    archived_ids keeps the rollups counting them and stops a re-fetch from bringing
+    them back. Returns how many receipts were removed.
+    """
+    receipt_ids = [
+        row[0]
+        for row in await db.fetch(
+            "SELECT receipt_id FROM archive.receipts WHERE receipt_id = ANY($1::bigint[])",
+            receipt_ids,
+        )
+    ]
+    if not receipt_ids:
+        return 0
+    review_ids = [
+        row[0]
+        for row in await db.fetch(
+            """
+            SELECT transaction_id FROM archive.reviews WHERE transaction_id IN (
+                SELECT transaction_id FROM public.transactions WHERE receipt_id = ANY($1::bigint[])
+            )
+            """,
+            receipt_ids,
+        )
+    ]
+
+    await db.execute(
+        """
+        INSERT INTO archived_ids (tbl, id)
+        SELECT 'receipts', unnest($1::bigint[])
+        UNION ALL SELECT 'reviews', unnest($2::bigint[])
+        ON CONFLICT DO NOTHING
+        """,
+        receipt_ids, review_ids,
+    )
+    # Children first: they reference the receipts
+    await db.execute("DELETE FROM reviews WHERE transaction_id = ANY($1::bigint[])", review_ids)
+    await db.execute("DELETE FROM shipping_reminders WHERE receipt_id = ANY($1::bigint[])", receipt_ids)
+    await db.execute("DELETE FROM transactions WHERE receipt_id = ANY($1::bigint[])", receipt_ids)
+    await db.execute("DELETE FROM receipts WHERE receipt_id = ANY($1::bigint[])", receipt_ids)
+    return len(receipt_ids)
+
+
+# ── Order search ──────────────────────────────────────────────────────────────
+
+def _ts_query(text: str, weights: str = "") -> str | None:
+    """Build a to_tsquery() input: every word of `text` as a prefix, all required.
+
+    Only letters and digits are kept, so user input can never inject tsquery syntax.
+    `weights` limits matches to the orders_fts fields with those weights (see
+    src/schema_pg.py). Returns None when `text` has no words.
+    """
+    words = re.findall(r"[^\W_]+", text)
+    if not words:
+        return None
+    return " & ".join(f"{word}:*{weights}" for word in words)
+
+
+async def search_orders(
+    db: asyncpg.Connection, shop_id: int, query: str, limit: int = 10
+) -> list:
+    """Full-text search a shop's orders, best match first.
+
+    Matches receipt ID, buyer name, city, gift message, item titles, variations and
+    personalization, each word of `query` as a prefix. Archived orders aren't searched.
+    Unlike the SQLite index, accents are not folded.
+    """
+    tsquery = _ts_query(query)
+    if tsquery is None:
+        return []
+    rows: list[asyncpg.Record] = await db.fetch(
+        """
+        SELECT r.receipt_id, r.name, r.city, r.status, r.is_shipped, r.create_timestamp,
+               r.grandtotal_amount, r.grandtotal_divisor, r.grandtotal_currency,
+               f.items, f.personalization
+        FROM orders_fts f
+        JOIN receipts r ON r.receipt_id = f.receipt_id
+        WHERE f.shop_id = $1 AND f.document @@ to_tsquery('simple', $2)
+        ORDER BY ts_rank(f.document, to_tsquery('simple', $2)) DESC, r.create_timestamp DESC
+        LIMIT $3
+        """,
+        shop_id, tsquery, limit,
+    )
+    return rows
@@ -0,0 +1,1076 @@
+"""
+Shared SQLite schema and migration runner.
+
+Both the bot (aiosqlite) and the web server (sqlite3) open the same database file,
+so the table definitions live here and each process calls migrate() at startup.
+The schema version is tracked with PRAGMA user_version: migration N brings the
+database to version N, and only pending migrations are applied, each in its own
+transaction. When the schema is current, startup runs no DDL at all.
+"""
+
+import os
+import re
+import sqlite3
+import time
+from collections.abc import Callable
+
+# Etsy receipt status -> receipts.status_code (migration 8). Unknown statuses map
+# to 0. The mapping is baked into the generated column, so only ever append.
+RECEIPT_STATUS_CODES = {
+    "open": 1,
+    "payment processing": 2,
+    "paid": 3,
+    "completed": 4,
+    "partially refunded": 5,
+    "fully refunded": 6,
+    "canceled": 7,
+}
+STATUS_CANCELED = RECEIPT_STATUS_CODES["canceled"]
+
+# Table definitions as of schema version 1. They are frozen: later changes are
+# made by appending a migration, never by editing these strings.
+_CREATE_GUILDS = """
+CREATE TABLE IF NOT EXISTS guilds (
+    guild_id         INTEGER PRIMARY KEY,
+    guild_name       TEXT,
+    etsy_shop_id     INTEGER,
+    order_channel_id INTEGER,
+    setup_token      TEXT    UNIQUE,
+    setup_token_exp  INTEGER,
+    connected_at     INTEGER,
+    created_at       INTEGER NOT NULL,
+    ship_reminder_days   TEXT,
+    ship_reminder_time   TEXT,
+    ship_reminder_tz     TEXT,
+    backlog_threshold    INTEGER,
+    backlog_warned       INTEGER NOT NULL DEFAULT 0,
+    digest_time          TEXT,
+    digest_tz            TEXT,
+    digest_last_sent     INTEGER,
+    goal_amount          INTEGER,
+    goal_milestones_sent TEXT,
+    goal_month           TEXT
+)
+"""
+
+_CREATE_ETSY_TOKENS = """
+CREATE TABLE IF NOT EXISTS etsy_tokens (
+    guild_id      INTEGER PRIMARY KEY REFERENCES guilds(guild_id),
+    access_token  TEXT    NOT NULL,
+    refresh_token TEXT    NOT NULL,
+    expires_at    INTEGER NOT NULL
+)
+"""
+
+_CREATE_PKCE_STATE = """
+CREATE TABLE IF NOT EXISTS pkce_state (
+    state         TEXT    PRIMARY KEY,
+    code_verifier TEXT    NOT NULL,
+    setup_token   TEXT    NOT NULL,
+    guild_id      INTEGER NOT NULL,
+    expires_at    INTEGER NOT NULL
+)
+"""
+
+_CREATE_SHOPS = """
+CREATE TABLE IF NOT EXISTS shops (
+    shop_id                   INTEGER PRIMARY KEY,
+    shop_name                 TEXT    NOT NULL,
+    user_id                   INTEGER NOT NULL,
+    title                     TEXT,
+    announcement              TEXT,
+    currency_code             TEXT    NOT NULL DEFAULT 'USD',
+    is_vacation               INTEGER NOT NULL DEFAULT 0,
+    listing_active_count      INTEGER,
+    digital_listing_count     INTEGER,
+    login_name                TEXT,
+    accepts_custom_requests   INTEGER DEFAULT 0,
+    url                       TEXT,
+    num_favorers              INTEGER DEFAULT 0,
+    languages                 TEXT,
+    shop_location_country_iso TEXT,
+    create_date               INTEGER,
+    fetched_at                INTEGER NOT NULL
+)
+"""
+
+_CREATE_LISTINGS = """
+CREATE TABLE IF NOT EXISTS listings (
+    listing_id              INTEGER PRIMARY KEY,
+    shop_id                 INTEGER NOT NULL REFERENCES shops(shop_id),
+    user_id                 INTEGER NOT NULL,
+    title                   TEXT    NOT NULL,
+    description             TEXT,
+    state                   TEXT    NOT NULL DEFAULT 'active',
+    quantity                INTEGER NOT NULL DEFAULT 0,
+    url                     TEXT,
+    num_favorers            INTEGER DEFAULT 0,
+    is_customizable         INTEGER DEFAULT 0,
+    is_personalizable       INTEGER DEFAULT 0,
+    listing_type            TEXT,
+    tags                    TEXT,
+    materials               TEXT,
+    price_amount            INTEGER NOT NULL,
+    price_divisor           INTEGER NOT NULL DEFAULT 100,
+    price_currency_code     TEXT    NOT NULL DEFAULT 'USD',
+    views                   INTEGER DEFAULT 0,
+    is_digital              INTEGER DEFAULT 0,
+    who_made                TEXT,
+    when_made               TEXT,
+    creation_timestamp      INTEGER,
+    last_modified_timestamp INTEGER,
+    image_url               TEXT,
+    fetched_at              INTEGER NOT NULL
+)
+"""
+
+_CREATE_SHIPPING_PRESETS = """
+CREATE TABLE IF NOT EXISTS shipping_presets (
+    id           INTEGER PRIMARY KEY AUTOINCREMENT,
+    guild_id     INTEGER NOT NULL REFERENCES guilds(guild_id),
+    name         TEXT    NOT NULL,
+    carrier      TEXT    NOT NULL,
+    mail_class   TEXT    NOT NULL,
+    package_type TEXT    NOT NULL DEFAULT '',
+    weight_oz    REAL    NOT NULL,
+    length_in    REAL    NOT NULL,
+    width_in     REAL    NOT NULL,
+    height_in    REAL    NOT NULL,
+    created_at   INTEGER NOT NULL,
+    UNIQUE(guild_id, name)
+)
+"""
+
+_CREATE_SHIPPO_KEYS = """
+CREATE TABLE IF NOT EXISTS shippo_keys (
+    guild_id     INTEGER PRIMARY KEY REFERENCES guilds(guild_id),
+    api_key      TEXT    NOT NULL,
+    addr_name    TEXT,
+    addr_street1 TEXT,
+    addr_street2 TEXT,
+    addr_city    TEXT,
+    addr_state   TEXT,
+    addr_zip     TEXT,
+    addr_country TEXT    NOT NULL DEFAULT 'US',
+    addr_phone   TEXT,
+    created_at   INTEGER NOT NULL
+)
+"""
+
+_CREATE_RECEIPTS = """
+CREATE TABLE IF NOT EXISTS receipts (
+    receipt_id            INTEGER PRIMARY KEY,
+    shop_id               INTEGER NOT NULL REFERENCES shops(shop_id),
+    receipt_type          INTEGER NOT NULL DEFAULT 0,
+    seller_user_id        INTEGER NOT NULL,
+    buyer_user_id         INTEGER,
+    buyer_email           TEXT,
+    name                  TEXT,
+    first_line            TEXT,
+    second_line           TEXT,
+    city                  TEXT,
+    state                 TEXT,
+    zip                   TEXT,
+    country_iso           TEXT,
+    status                TEXT    NOT NULL,
+    payment_method        TEXT,
+    is_paid               INTEGER NOT NULL DEFAULT 0,
+    is_shipped            INTEGER NOT NULL DEFAULT 0,
+    is_gift               INTEGER NOT NULL DEFAULT 0,
+    gift_message          TEXT,
+    grandtotal_amount     INTEGER NOT NULL,
+    grandtotal_divisor    INTEGER NOT NULL DEFAULT 100,
+    grandtotal_currency   TEXT    NOT NULL DEFAULT 'USD',
+    subtotal_amount       INTEGER,
+    total_shipping_amount INTEGER,
+    total_tax_amount      INTEGER,
+    discount_amount       INTEGER DEFAULT 0,
+    create_timestamp      INTEGER NOT NULL,
+    update_timestamp      INTEGER,
+    expected_ship_date    INTEGER,
+    fetched_at            INTEGER NOT NULL,
+    notified_at           INTEGER
+)
+"""
+
+_CREATE_SHIPPING_REMINDERS = """
+CREATE TABLE IF NOT EXISTS shipping_reminders (
+    receipt_id  INTEGER NOT NULL REFERENCES receipts(receipt_id),
+    days_before INTEGER NOT NULL,
+    sent_at     INTEGER NOT NULL,
+    PRIMARY KEY (receipt_id, days_before)
+)
+"""
+
+_CREATE_TRANSACTIONS = """
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id      INTEGER PRIMARY KEY,
+    receipt_id          INTEGER NOT NULL REFERENCES receipts(receipt_id),
+    shop_id             INTEGER NOT NULL REFERENCES shops(shop_id),
+    listing_id          INTEGER,
+    title               TEXT,
+    quantity            INTEGER NOT NULL DEFAULT 1,
+    price_amount        INTEGER NOT NULL DEFAULT 0,
+    price_divisor       INTEGER NOT NULL DEFAULT 100,
+    price_currency      TEXT    NOT NULL DEFAULT 'USD',
+    create_timestamp    INTEGER NOT NULL,
+    image_url           TEXT,
+    selected_variations  TEXT,
+    personalization_msg  TEXT,
+    fetched_at           INTEGER NOT NULL
+)
+"""
+
+_CREATE_REVIEWS = """
+CREATE TABLE IF NOT EXISTS reviews (
+    transaction_id   INTEGER PRIMARY KEY,
+    shop_id          INTEGER NOT NULL REFERENCES shops(shop_id),
+    listing_id       INTEGER,
+    buyer_user_id    INTEGER,
+    rating           INTEGER NOT NULL,
+    review           TEXT,
+    language         TEXT,
+    image_url        TEXT,
+    create_timestamp INTEGER NOT NULL,
+    update_timestamp INTEGER,
+    fetched_at       INTEGER NOT NULL,
+    notified_at      INTEGER
+)
+"""
+
+_CREATE_BOT_STATE = """
+CREATE TABLE IF NOT EXISTS bot_state (
+    key        TEXT    PRIMARY KEY,
+    value      TEXT,
+    updated_at INTEGER NOT NULL
+)
+"""
+
+
+# Columns that older databases gained via ALTER TABLE before migrations existed.
+# The baseline adds any that are missing so legacy files converge on the CREATE
+# definitions above.
+_LEGACY_COLUMNS = [
+    ("shippo_keys", "addr_phone", "TEXT"),
+    ("listings", "image_url", "TEXT"),
+    ("receipts", "expected_ship_date", "INTEGER"),
+    ("guilds", "ship_reminder_days", "TEXT"),
+    ("guilds", "ship_reminder_time", "TEXT"),
+    ("guilds", "ship_reminder_tz", "TEXT"),
+    ("guilds", "backlog_threshold", "INTEGER"),
+    ("guilds", "backlog_warned", "INTEGER NOT NULL DEFAULT 0"),
+    ("guilds", "digest_time", "TEXT"),
+    ("guilds", "digest_tz", "TEXT"),
+    ("guilds", "digest_last_sent", "INTEGER"),
+    ("guilds", "goal_amount", "INTEGER"),
+    ("guilds", "goal_milestones_sent", "TEXT"),
+    ("guilds", "goal_month", "TEXT"),
+    ("transactions", "selected_variations", "TEXT"),
+    ("transactions", "personalization_msg", "TEXT"),
+    ("receipts", "first_line", "TEXT"),
+    ("receipts", "second_line", "TEXT"),
+    ("shipping_presets", "package_type", "TEXT NOT NULL DEFAULT ''"),
+]
+
+
+def _columns(conn: sqlite3.Connection, table: str) -> set[str]:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+# ── Migrations ────────────────────────────────────────────────────────────────
+
+def _m001_baseline(conn: sqlite3.Connection) -> None:
+    """Create every table, and add columns missing from pre-migration databases."""
+    for ddl in (
+        _CREATE_GUILDS,
+        _CREATE_ETSY_TOKENS,
+        _CREATE_PKCE_STATE,
+        _CREATE_SHOPS,
+        _CREATE_LISTINGS,
+        _CREATE_RECEIPTS,
+        _CREATE_SHIPPING_PRESETS,
+        _CREATE_SHIPPING_REMINDERS,
+        _CREATE_TRANSACTIONS,
+        _CREATE_REVIEWS,
+        _CREATE_SHIPPO_KEYS,
+        _CREATE_BOT_STATE,
+    ):
+        conn.execute(ddl)
+    for table, column, decl in _LEGACY_COLUMNS:
+        if column not in _columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+def _m002_hot_query_indexes(conn: sqlite3.Connection) -> None:
+    """Secondary indexes for the per-shop queries the poller and commands run."""
+    for ddl in (
+        # Poller: new orders awaiting notification (partial, stays tiny)
+        """CREATE INDEX IF NOT EXISTS idx_receipts_unnotified
+           ON receipts(shop_id, create_timestamp) WHERE notified_at IS NULL""",
+        # Revenue/goal windows, digests, /label autocomplete ordering
+        """CREATE INDEX IF NOT EXISTS idx_receipts_shop_created
+           ON receipts(shop_id, create_timestamp)""",
+        # Returning-buyer check
+        """CREATE INDEX IF NOT EXISTS idx_receipts_shop_buyer
+           ON receipts(shop_id, buyer_user_id)""",
+        # Shipping reminders, due-soon digest, backlog count, shipped sync
+        """CREATE INDEX IF NOT EXISTS idx_receipts_unshipped
+           ON receipts(shop_id, expected_ship_date) WHERE is_shipped = 0""",
+        """CREATE INDEX IF NOT EXISTS idx_transactions_receipt
+           ON transactions(receipt_id)""",
+        # Bestsellers window
+        """CREATE INDEX IF NOT EXISTS idx_transactions_shop_created
+           ON transactions(shop_id, create_timestamp)""",
+        """CREATE INDEX IF NOT EXISTS idx_reviews_unnotified
+           ON reviews(shop_id, create_timestamp) WHERE notified_at IS NULL""",
+        """CREATE INDEX IF NOT EXISTS idx_listings_shop_state
+           ON listings(shop_id, state)""",
+        # Expired-state cleanup in the web server
+        """CREATE INDEX IF NOT EXISTS idx_pkce_state_expires
+           ON pkce_state(expires_at)""",
+    ):
+        conn.execute(ddl)
+
+
+def _m003_upsert_change_tracking(conn: sqlite3.Connection) -> None:
+    """prev_* columns the upserts fill with the old value so RETURNING can report diffs."""
+    conn.execute("ALTER TABLE receipts ADD COLUMN prev_status TEXT")
+    conn.execute("ALTER TABLE receipts ADD COLUMN prev_is_shipped INTEGER")
+    conn.execute("ALTER TABLE listings ADD COLUMN prev_quantity INTEGER")
+
+
+def _m004_shop_sync(conn: sqlite3.Connection) -> None:
+    """Per-shop fetch freshness, so unchanged rows no longer need rewriting."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shop_sync (
+            shop_id            INTEGER PRIMARY KEY,
+            listings_synced_at INTEGER,
+            receipts_synced_at INTEGER,
+            reviews_synced_at  INTEGER
+        )
+    """)
+
+# A receipt counts toward sales unless it was canceled. The rollup triggers take
+# this predicate as a parameter so _m008 can recreate them on status_code; the
+# backfills keep the text form, which works before that column exists.
+def _counts_as_sale(ref: str) -> str:
+    return f"LOWER({ref}.status) != 'canceled'"
+
+
+def _daily_sales_add(ref: str, sign: str, counts: Callable[[str], str]) -> str:
+    """Trigger statement folding receipt `ref` (NEW or OLD) into daily_sales with `sign`."""
+    return f"""
+        INSERT INTO daily_sales (shop_id, day, currency, divisor, orders, revenue_minor_units)
+        SELECT {ref}.shop_id, date({ref}.create_timestamp, 'unixepoch'),
+               {ref}.grandtotal_currency, {ref}.grandtotal_divisor,
+               {sign}1, {sign}{ref}.grandtotal_amount
+        WHERE {counts(ref)}
+        ON CONFLICT (shop_id, day, currency) DO UPDATE SET
+            orders = orders + excluded.orders,
+            revenue_minor_units = revenue_minor_units + excluded.revenue_minor_units;
+    """
+
+
+def _daily_sales_triggers(counts: Callable[[str], str]) -> list[str]:
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_daily_sales_insert
+        AFTER INSERT ON receipts
+        BEGIN {_daily_sales_add("NEW", "+", counts)} END
+        """,
+        # Only fires when something the rollup depends on changed, e.g. a cancellation.
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_daily_sales_update
+        AFTER UPDATE OF status, create_timestamp, grandtotal_amount, grandtotal_divisor,
+                        grandtotal_currency, shop_id ON receipts
+        WHEN (OLD.status, OLD.create_timestamp, OLD.grandtotal_amount, OLD.grandtotal_divisor,
+              OLD.grandtotal_currency, OLD.shop_id)
+          IS NOT (NEW.status, NEW.create_timestamp, NEW.grandtotal_amount, NEW.grandtotal_divisor,
+                  NEW.grandtotal_currency, NEW.shop_id)
+        BEGIN {_daily_sales_add("OLD", "-", counts)} {_daily_sales_add("NEW", "+", counts)} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_daily_sales_delete
+        AFTER DELETE ON receipts
+        BEGIN {_daily_sales_add("OLD", "-", counts)} END
+        """,
+    ]
+
+
+def _m005_daily_sales(conn: sqlite3.Connection) -> None:
+    """Per-shop, per-UTC-day sales totals kept current by triggers on receipts."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            shop_id             INTEGER NOT NULL,
+            day                 TEXT    NOT NULL,  -- YYYY-MM-DD (UTC)
+            currency            TEXT    NOT NULL,
+            divisor             INTEGER NOT NULL,
+            orders              INTEGER NOT NULL,
+            revenue_minor_units INTEGER NOT NULL,
+            PRIMARY KEY (shop_id, day, currency)
+        ) WITHOUT ROWID
+    """)
+    for ddl in _daily_sales_triggers(_counts_as_sale):
+        conn.execute(ddl)
+    conn.execute(f"""
+        INSERT INTO daily_sales (shop_id, day, currency, divisor, orders, revenue_minor_units)
+        SELECT shop_id, date(create_timestamp, 'unixepoch'), grandtotal_currency,
+               MAX(grandtotal_divisor), COUNT(*), SUM(grandtotal_amount)
+        FROM receipts r
+        WHERE {_counts_as_sale("r")}
+        GROUP BY shop_id, date(create_timestamp, 'unixepoch'), grandtotal_currency
+    """)
+
+
+# Bestseller periods: every sale lands in its month, its year and all-time.
+_LISTING_SALES_PERIODS = """
+    (SELECT 'all' AS fmt UNION ALL SELECT '%Y' UNION ALL SELECT '%Y-%m') p
+"""
+
+
+def _listing_sales_add(
+    match: str, sign: str, counts: Callable[[str], str] | None = None
+) -> str:
+    """Trigger statement folding the line items `t` matching `match` into listing_sales with `sign`.
+
+    Only items with a listing count; with `counts`, only those on a receipt it
+    accepts (status-change triggers check the receipt in WHEN instead).
+    """
+    counted = (
+        f"""AND EXISTS (SELECT 1 FROM receipts r
+                        WHERE r.receipt_id = t.receipt_id AND {counts("r")})"""
+        if counts
+        else ""
+    )
+    return f"""
+        INSERT INTO listing_sales (shop_id, period, listing_id, title, image_url,
+                                   currency, divisor, units, revenue_minor_units)
+        SELECT t.shop_id,
+               CASE p.fmt WHEN 'all' THEN 'all'
+                          ELSE strftime(p.fmt, t.create_timestamp, 'unixepoch') END,
+               t.listing_id, t.title, t.image_url, t.price_currency, t.price_divisor,
+               {sign}t.quantity, {sign}t.quantity * t.price_amount
+        FROM transactions t, {_LISTING_SALES_PERIODS}
+        WHERE {match} AND t.listing_id IS NOT NULL {counted}
+        ON CONFLICT (shop_id, period, listing_id) DO UPDATE SET
+            title = COALESCE(excluded.title, title),
+            image_url = COALESCE(excluded.image_url, image_url),
+            units = units + excluded.units,
+            revenue_minor_units = revenue_minor_units + excluded.revenue_minor_units;
+    """
+
+
+def _listing_sales_triggers(counts: Callable[[str], str]) -> list[str]:
+    return [
+        # Line items are written after their receipt, so the receipt's status is known.
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_listing_sales_insert
+        AFTER INSERT ON transactions
+        BEGIN
+            {_listing_sales_add("t.transaction_id = NEW.transaction_id", "+", counts)}
+        END
+        """,
+        # BEFORE, so the line item and its receipt are still there to be backed out
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_listing_sales_delete
+        BEFORE DELETE ON transactions
+        BEGIN
+            {_listing_sales_add("t.transaction_id = OLD.transaction_id", "-", counts)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_listing_sales_cancel
+        AFTER UPDATE OF status ON receipts
+        WHEN ({counts("OLD")}) AND NOT ({counts("NEW")})
+        BEGIN
+            {_listing_sales_add("t.receipt_id = NEW.receipt_id", "-")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_listing_sales_uncancel
+        AFTER UPDATE OF status ON receipts
+        WHEN NOT ({counts("OLD")}) AND ({counts("NEW")})
+        BEGIN
+            {_listing_sales_add("t.receipt_id = NEW.receipt_id", "+")}
+        END
+        """,
+    ]
+
+
+def _m006_listing_sales(conn: sqlite3.Connection) -> None:
+    """Per-listing month/year/all-time sales totals, kept current by triggers, for /bestsellers."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS listing_sales (
+            shop_id             INTEGER NOT NULL,
+            period              TEXT    NOT NULL,  -- 'all', 'YYYY' or 'YYYY-MM' (UTC)
+            listing_id          INTEGER NOT NULL,
+            title               TEXT,
+            image_url           TEXT,
+            currency            TEXT    NOT NULL,
+            divisor             INTEGER NOT NULL,
+            units               INTEGER NOT NULL,
+            revenue_minor_units INTEGER NOT NULL,
+            PRIMARY KEY (shop_id, period, listing_id)
+        ) WITHOUT ROWID
+    """)
+    # A top-N list is the first N entries of one of these
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listing_sales_units "
+        "ON listing_sales (shop_id, period, units DESC)"
+    )
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listing_sales_revenue "
+        "ON listing_sales (shop_id, period, revenue_minor_units DESC)"
+    )
+    for ddl in _listing_sales_triggers(_counts_as_sale):
+        conn.execute(ddl)
+    conn.execute(f"""
+        INSERT INTO listing_sales (shop_id, period, listing_id, title, image_url,
+                                   currency, divisor, units, revenue_minor_units)
+        SELECT t.shop_id,
+               CASE p.fmt WHEN 'all' THEN 'all'
+                          ELSE strftime(p.fmt, t.create_timestamp, 'unixepoch') END AS period,
+               t.listing_id, MAX(t.title), MAX(t.image_url), MAX(t.price_currency),
+               MAX(t.price_divisor), SUM(t.quantity), SUM(t.quantity * t.price_amount)
+        FROM transactions t
+        JOIN receipts r ON r.receipt_id = t.receipt_id, {_LISTING_SALES_PERIODS}
+        WHERE t.listing_id IS NOT NULL AND {_counts_as_sale("r")}
+        GROUP BY t.shop_id, period, t.listing_id
+    """)
+
+
+def _buyers_triggers(counts: Callable[[str], str]) -> list[str]:
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_buyers_insert
+        AFTER INSERT ON receipts
+        WHEN NEW.buyer_user_id IS NOT NULL
+        BEGIN
+            INSERT INTO buyers (shop_id, buyer_user_id, name, name_norm, first_receipt_id,
+                                first_order_at, last_order_at, order_count, lifetime_spend_minor)
+            VALUES (NEW.shop_id, NEW.buyer_user_id, NEW.name, LOWER(TRIM(NEW.name)), NEW.receipt_id,
+                    NEW.create_timestamp, NEW.create_timestamp,
+                    ({counts("NEW")}),
+                    ({counts("NEW")}) * NEW.grandtotal_amount)
+            ON CONFLICT (shop_id, buyer_user_id) DO UPDATE SET
+                name = CASE WHEN excluded.last_order_at >= last_order_at
+                            THEN COALESCE(excluded.name, name) ELSE name END,
+                name_norm = CASE WHEN excluded.last_order_at >= last_order_at
+                                 THEN COALESCE(excluded.name_norm, name_norm) ELSE name_norm END,
+                first_receipt_id = CASE WHEN excluded.first_order_at < first_order_at
+                                        THEN excluded.first_receipt_id ELSE first_receipt_id END,
+                first_order_at = MIN(first_order_at, excluded.first_order_at),
+                last_order_at = MAX(last_order_at, excluded.last_order_at),
+                order_count = order_count + excluded.order_count,
+                lifetime_spend_minor = lifetime_spend_minor + excluded.lifetime_spend_minor;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_buyers_update
+        AFTER UPDATE OF status, grandtotal_amount ON receipts
+        WHEN NEW.buyer_user_id IS NOT NULL
+         AND (OLD.status, OLD.grandtotal_amount) IS NOT (NEW.status, NEW.grandtotal_amount)
+        BEGIN
+            UPDATE buyers SET
+                order_count = order_count - ({counts("OLD")}) + ({counts("NEW")}),
+                lifetime_spend_minor = lifetime_spend_minor
+                    - ({counts("OLD")}) * OLD.grandtotal_amount
+                    + ({counts("NEW")}) * NEW.grandtotal_amount
+            WHERE shop_id = NEW.shop_id AND buyer_user_id = NEW.buyer_user_id;
+        END
+        """,
+    ]
+
+
+def _m007_buyers(conn: sqlite3.Connection) -> None:
+    """One row per shop customer, kept current by triggers on receipts.
+
+    first_receipt_id/first_order_at cover every receipt; order_count and
+    lifetime_spend_minor only non-canceled ones.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS buyers (
+            shop_id              INTEGER NOT NULL,
+            buyer_user_id        INTEGER NOT NULL,
+            name                 TEXT,
+            name_norm            TEXT,     -- LOWER(TRIM(name)), for lookups by name
+            first_receipt_id     INTEGER NOT NULL,
+            first_order_at       INTEGER NOT NULL,
+            last_order_at        INTEGER NOT NULL,
+            order_count          INTEGER NOT NULL,
+            lifetime_spend_minor INTEGER NOT NULL,
+            PRIMARY KEY (shop_id, buyer_user_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_buyers_name ON buyers (shop_id, name_norm)")
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_buyers_recent ON buyers (shop_id, last_order_at DESC)"
+    )
+    for ddl in _buyers_triggers(_counts_as_sale):
+        conn.execute(ddl)
+    conn.execute(f"""
+        INSERT INTO buyers (shop_id, buyer_user_id, name, name_norm, first_receipt_id,
+                            first_order_at, last_order_at, order_count, lifetime_spend_minor)
+        SELECT shop_id, buyer_user_id,
+               (SELECT name FROM receipts l WHERE l.shop_id = r.shop_id
+                  AND l.buyer_user_id = r.buyer_user_id ORDER BY create_timestamp DESC LIMIT 1),
+               NULL,
+               (SELECT receipt_id FROM receipts f WHERE f.shop_id = r.shop_id
+                  AND f.buyer_user_id = r.buyer_user_id ORDER BY create_timestamp, receipt_id LIMIT 1),
+               MIN(create_timestamp), MAX(create_timestamp),
+               SUM({_counts_as_sale("r")}),
+               SUM(({_counts_as_sale("r")}) * grandtotal_amount)
+        FROM receipts r
+        WHERE buyer_user_id IS NOT NULL
+        GROUP BY shop_id, buyer_user_id
+    """)
+    conn.execute("UPDATE buyers SET name_norm = LOWER(TRIM(name))")
+
+
+def _counts_as_sale_by_code(ref: str) -> str:
+    return f"{ref}.status_code != {STATUS_CANCELED}"
+
+
+def _m008_receipt_status_code(conn: sqlite3.Connection) -> None:
+    """Integer status and is_open flag on receipts, so open-order filters can use indexes.
+
+    Both are VIRTUAL generated columns: always consistent with status/is_shipped,
+    computed at write time into the partial indexes that filter on them. The rollup
+    triggers are recreated to test status_code instead of LOWER(status).
+    """
+    cases = " ".join(f"WHEN '{status}' THEN {code}" for status, code in RECEIPT_STATUS_CODES.items())
+    conn.execute(
+        "ALTER TABLE receipts ADD COLUMN status_code INTEGER "
+        f"GENERATED ALWAYS AS (CASE LOWER(status) {cases} ELSE 0 END) VIRTUAL"
+    )
+    conn.execute(
+        "ALTER TABLE receipts ADD COLUMN is_open INTEGER "
+        f"GENERATED ALWAYS AS (is_shipped = 0 AND status_code != {STATUS_CANCELED}) VIRTUAL"
+    )
+    for ddl in (
+        # Backlog count, due-soon digest
+        """CREATE INDEX IF NOT EXISTS idx_receipts_open
+           ON receipts(shop_id, expected_ship_date) WHERE is_open = 1""",
+        # /label picker, newest first
+        """CREATE INDEX IF NOT EXISTS idx_receipts_labelable
+           ON receipts(shop_id, create_timestamp) WHERE is_open = 1 AND is_paid = 1""",
+        # Sales windows filter on status_code; keep it in the index to skip table reads
+        "DROP INDEX IF EXISTS idx_receipts_shop_created",
+        """CREATE INDEX IF NOT EXISTS idx_receipts_shop_created
+           ON receipts(shop_id, create_timestamp, status_code)""",
+    ):
+        conn.execute(ddl)
+
+    triggers = conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall()
+    for (name,) in triggers:
+        conn.execute(f"DROP TRIGGER {name}")
+    for ddl in (
+        *_daily_sales_triggers(_counts_as_sale_by_code),
+        *_listing_sales_triggers(_counts_as_sale_by_code),
+        *_buyers_triggers(_counts_as_sale_by_code),
+    ):
+        conn.execute(ddl)
+
+
+def _shop_counters_add(shop: str, open_orders: str, receipts: str, reviews: str) -> str:
+    """Trigger statement adding the given deltas to shop `shop`'s counters."""
+    return f"""
+        INSERT INTO shop_counters (shop_id, open_orders, unnotified_receipts, unnotified_reviews)
+        VALUES ({shop}, {open_orders}, {receipts}, {reviews})
+        ON CONFLICT (shop_id) DO UPDATE SET
+            open_orders = open_orders + excluded.open_orders,
+            unnotified_receipts = unnotified_receipts + excluded.unnotified_receipts,
+            unnotified_reviews = unnotified_reviews + excluded.unnotified_reviews;
+    """
+
+
+def _m009_shop_counters(conn: sqlite3.Connection) -> None:
+    """Per-shop open/unnotified counts kept exact by triggers, so idle shops skip whole poll stages."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shop_counters (
+            shop_id             INTEGER PRIMARY KEY,
+            open_orders         INTEGER NOT NULL DEFAULT 0,
+            unnotified_receipts INTEGER NOT NULL DEFAULT 0,
+            unnotified_reviews  INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    for ddl in (
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_counters_insert
+        AFTER INSERT ON receipts
+        BEGIN {_shop_counters_add("NEW.shop_id", "NEW.is_open", "NEW.notified_at IS NULL", "0")} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_counters_update
+        AFTER UPDATE OF status, is_shipped, notified_at, shop_id ON receipts
+        WHEN (OLD.shop_id, OLD.is_open, OLD.notified_at IS NULL)
+          IS NOT (NEW.shop_id, NEW.is_open, NEW.notified_at IS NULL)
+        BEGIN
+            {_shop_counters_add("OLD.shop_id", "-OLD.is_open", "-(OLD.notified_at IS NULL)", "0")}
+            {_shop_counters_add("NEW.shop_id", "NEW.is_open", "NEW.notified_at IS NULL", "0")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_counters_delete
+        AFTER DELETE ON receipts
+        BEGIN {_shop_counters_add("OLD.shop_id", "-OLD.is_open", "-(OLD.notified_at IS NULL)", "0")} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_reviews_counters_insert
+        AFTER INSERT ON reviews
+        BEGIN {_shop_counters_add("NEW.shop_id", "0", "0", "NEW.notified_at IS NULL")} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_reviews_counters_update
+        AFTER UPDATE OF notified_at, shop_id ON reviews
+        WHEN (OLD.shop_id, OLD.notified_at IS NULL) IS NOT (NEW.shop_id, NEW.notified_at IS NULL)
+        BEGIN
+            {_shop_counters_add("OLD.shop_id", "0", "0", "-(OLD.notified_at IS NULL)")}
+            {_shop_counters_add("NEW.shop_id", "0", "0", "NEW.notified_at IS NULL")}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_reviews_counters_delete
+        AFTER DELETE ON reviews
+        BEGIN {_shop_counters_add("OLD.shop_id", "0", "0", "-(OLD.notified_at IS NULL)")} END
+        """,
+    ):
+        conn.execute(ddl)
+    conn.execute("""
+        INSERT INTO shop_counters (shop_id, open_orders, unnotified_receipts, unnotified_reviews)
+        SELECT shop_id, SUM(open_orders), SUM(unnotified_receipts), SUM(unnotified_reviews)
+        FROM (
+            SELECT shop_id, SUM(is_open) AS open_orders,
+                   SUM(notified_at IS NULL) AS unnotified_receipts, 0 AS unnotified_reviews
+            FROM receipts GROUP BY shop_id
+            UNION ALL
+            SELECT shop_id, 0, 0, SUM(notified_at IS NULL) FROM reviews GROUP BY shop_id
+        )
+        GROUP BY shop_id
+    """)
+
+
+def _m010_archive_tombstones(conn: sqlite3.Connection) -> None:
+    """Support for moving old orders into the archive database (see attach_archive()).
+
+    archived_ids records every receipt and review that has been moved out. Deletes
+    of those rows leave the rollups alone, and a later re-fetch of the same row
+    from Etsy is silently ignored instead of resurrecting it.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_ids (
+            tbl TEXT    NOT NULL,  -- 'receipts' or 'reviews'
+            id  INTEGER NOT NULL,
+            PRIMARY KEY (tbl, id)
+        ) WITHOUT ROWID
+    """)
+    archived_receipt = "EXISTS (SELECT 1 FROM archived_ids WHERE tbl = 'receipts' AND id = {})"
+    archived_review = "EXISTS (SELECT 1 FROM archived_ids WHERE tbl = 'reviews' AND id = {})"
+    conn.execute("DROP TRIGGER IF EXISTS trg_receipts_daily_sales_delete")
+    conn.execute("DROP TRIGGER IF EXISTS trg_transactions_listing_sales_delete")
+    for ddl in (
+        f"""
+        CREATE TRIGGER trg_receipts_daily_sales_delete
+        AFTER DELETE ON receipts
+        WHEN NOT {archived_receipt.format("OLD.receipt_id")}
+        BEGIN {_daily_sales_add("OLD", "-", _counts_as_sale_by_code)} END
+        """,
+        f"""
+        CREATE TRIGGER trg_transactions_listing_sales_delete
+        BEFORE DELETE ON transactions
+        WHEN NOT {archived_receipt.format("OLD.receipt_id")}
+        BEGIN
+            {_listing_sales_add("t.transaction_id = OLD.transaction_id", "-", _counts_as_sale_by_code)}
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_skip_archived
+        BEFORE INSERT ON receipts
+        WHEN {archived_receipt.format("NEW.receipt_id")}
+        BEGIN SELECT RAISE(IGNORE); END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_skip_archived
+        BEFORE INSERT ON transactions
+        WHEN {archived_receipt.format("NEW.receipt_id")}
+        BEGIN SELECT RAISE(IGNORE); END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_reviews_skip_archived
+        BEFORE INSERT ON reviews
+        WHEN {archived_review.format("NEW.transaction_id")}
+        BEGIN SELECT RAISE(IGNORE); END
+        """,
+    ):
+        conn.execute(ddl)
+
+
+# Line-item text for one receipt, as stored in orders_fts
+def _orders_fts_variations(receipt: str) -> str:
+    # selected_variations is JSON with \u escapes; index the decoded values only
+    return f"""
+        (SELECT group_concat(json_extract(v.value, '$.formatted_value'), ' ')
+         FROM transactions t,
+              json_each(CASE WHEN json_valid(t.selected_variations) THEN t.selected_variations END) v
+         WHERE t.receipt_id = {receipt})
+    """
+
+
+def _orders_fts_items(receipt: str) -> str:
+    return f"""
+        UPDATE orders_fts SET
+            items = (SELECT group_concat(title, ' ') FROM transactions
+                     WHERE receipt_id = {receipt}),
+            variations = {_orders_fts_variations(receipt)},
+            personalization = (SELECT group_concat(personalization_msg, ' ') FROM transactions
+                               WHERE receipt_id = {receipt})
+        WHERE rowid = {receipt};
+    """
+
+
+def _m011_orders_fts(conn: sqlite3.Connection) -> None:
+    """Full-text index over orders (rowid = receipt_id), kept in sync by triggers.
+
+    `shop` holds "s<shop_id>" so a search can be limited to one shop inside the
+    index, and `receipt` the receipt ID so IDs can be prefix-matched too.
+    """
+    conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS orders_fts USING fts5(
+            shop, receipt, name, city, gift_message, items, variations, personalization,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+    """)
+    for ddl in (
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_fts_insert
+        AFTER INSERT ON receipts
+        BEGIN
+            INSERT INTO orders_fts (rowid, shop, receipt, name, city, gift_message)
+            VALUES (NEW.receipt_id, 's' || NEW.shop_id, NEW.receipt_id, NEW.name, NEW.city,
+                    NEW.gift_message);
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_fts_update
+        AFTER UPDATE OF shop_id, name, city, gift_message ON receipts
+        WHEN (OLD.shop_id, OLD.name, OLD.city, OLD.gift_message)
+          IS NOT (NEW.shop_id, NEW.name, NEW.city, NEW.gift_message)
+        BEGIN
+            UPDATE orders_fts
+            SET shop = 's' || NEW.shop_id, name = NEW.name, city = NEW.city,
+                gift_message = NEW.gift_message
+            WHERE rowid = NEW.receipt_id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS trg_receipts_fts_delete
+        AFTER DELETE ON receipts
+        BEGIN
+            DELETE FROM orders_fts WHERE rowid = OLD.receipt_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_insert
+        AFTER INSERT ON transactions
+        BEGIN {_orders_fts_items("NEW.receipt_id")} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_update
+        AFTER UPDATE OF title, selected_variations, personalization_msg ON transactions
+        BEGIN {_orders_fts_items("NEW.receipt_id")} END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS trg_transactions_fts_delete
+        AFTER DELETE ON transactions
+        BEGIN {_orders_fts_items("OLD.receipt_id")} END
+        """,
+    ):
+        conn.execute(ddl)
+    conn.execute(f"""
+        INSERT INTO orders_fts (rowid, shop, receipt, name, city, gift_message,
+                                items, variations, personalization)
+        SELECT r.receipt_id, 's' || r.shop_id, r.receipt_id, r.name, r.city, r.gift_message,
+               group_concat(t.title, ' '), {_orders_fts_variations("r.receipt_id")},
+               group_concat(t.personalization_msg, ' ')
+        FROM receipts r
+        LEFT JOIN transactions t ON t.receipt_id = r.receipt_id
+        GROUP BY r.receipt_id
+    """)
+
+
+def _m012_guild_events(conn: sqlite3.Connection) -> None:
+    """Outbox of guilds connected by the web server, read by the bot (get_guild_events()).
+
+    AUTOINCREMENT so pruned IDs are never handed out again: the bot reads by
+    event_id > last seen.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS guild_events (
+            event_id   INTEGER PRIMARY KEY AUTOINCREMENT,
+            guild_id   INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+    """)
+
+
+# Append only: a migration's position is its version number, so never reorder,
+# edit or remove one that has shipped.
+MIGRATIONS: list[Callable[[sqlite3.Connection], None]] = [
+    _m001_baseline,
+    _m002_hot_query_indexes,
+    _m003_upsert_change_tracking,
+    _m004_shop_sync,
+    _m005_daily_sales,
+    _m006_listing_sales,
+    _m007_buyers,
+    _m008_receipt_status_code,
+    _m009_shop_counters,
+    _m010_archive_tombstones,
+    _m011_orders_fts,
+    _m012_guild_events,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Apply pending migrations and return how many ran.
+
+    Each migration runs inside BEGIN IMMEDIATE together with its user_version bump,
+    so a failure rolls back cleanly and the bot and web processes starting at the
+    same time can't both apply the same step.
+    """
+    if get_version(conn) >= SCHEMA_VERSION:
+        return 0
+
+    if not conn.execute("SELECT 1 FROM sqlite_master").fetchone():
+        # Only settable on an empty database; existing ones are converted by
+        # enable_incremental_vacuum()
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None  # manage transactions explicitly
+    applied = 0
+    try:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Re-check under the write lock; another process may have got here first.
+                if get_version(conn) >= version:
+                    conn.execute("ROLLBACK")
+                    continue
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            applied += 1
+            print(f"[schema] Applied migration {version}: {migration.__name__}")
+    finally:
+        conn.isolation_level = isolation_level
+    return applied
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection) -> bool:
+    """Switch a database created without auto_vacuum to INCREMENTAL; True if it was.
+
+    That takes one full VACUUM, which rewrites the file and holds the write lock
+    throughout, so the bot only calls it from its daily maintenance run, and only
+    when the run's remaining budget covers the file. Databases
+    created by migrate() already have it. Must be called outside a transaction.
+    """
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+    start = time.monotonic()
+    size = os.path.getsize(conn.execute("PRAGMA database_list").fetchone()[2])
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("VACUUM")
+    print(
+        f"[schema] Enabled incremental vacuum ({size / 1024 / 1024:.1f} MB rewritten "
+        f"in {time.monotonic() - start:.1f}s)"
+    )
+    return True
+
+
+# ── Connection settings ───────────────────────────────────────────────────────
+
+# PRAGMAs every bot and web connection applies when it opens. WAL with
+# synchronous=NORMAL never corrupts the database; a power cut can lose the last
+# commits before a checkpoint. cache_size is in KiB when negative.
+PRAGMA_PROFILE: dict[str, int | str] = {
+    "journal_mode": "WAL",
+    "foreign_keys": "ON",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "temp_store": "MEMORY",
+    "cache_size": -16000,
+    "mmap_size": 128 * 1024 * 1024,
+}
+
+
+def configure_pragmas(overrides: str) -> None:
+    """Update PRAGMA_PROFILE from a "name=value,name=value" string (SQLITE_PRAGMAS)."""
+    for item in overrides.split(","):
+        name, sep, value = item.partition("=")
+        name, value = name.strip().lower(), value.strip()
+        if not name:
+            continue
+        if not sep or not re.fullmatch(r"[a-z_]+", name) or not re.fullmatch(r"-?\w+", value):
+            raise ValueError(f"bad SQLite PRAGMA override: {item!r}")
+        PRAGMA_PROFILE[name] = int(value) if value.lstrip("-").isdigit() else value
+
+
+def apply_pragmas(conn: sqlite3.Connection) -> None:
+    """Apply PRAGMA_PROFILE to a freshly opened connection."""
+    for name, value in PRAGMA_PROFILE.items():
+        conn.execute(f"PRAGMA {name}={value}")
+
+
+# ── Archive database ──────────────────────────────────────────────────────────
+
+# Tables whose old rows are moved into the archive, with their primary keys
+ARCHIVED_TABLES = {
+    "receipts": ("receipt_id",),
+    "transactions": ("transaction_id",),
+    "reviews": ("transaction_id",),
+    "shipping_reminders": ("receipt_id", "days_before"),
+}
+
+
+def attach_archive(conn: sqlite3.Connection, path: str, alias: str = "archive") -> None:
+    """ATTACH the cold archive database at `path` and bring its tables up to date.
+
+    Archive tables mirror the stored (non-generated) columns of their main-database
+    counterparts and gain any column added there since. There are no triggers or
+    rollups in the archive; it is only read for explicit history lookups. Must be
+    called outside a transaction.
+    """
+    if alias not in {row[1] for row in conn.execute("PRAGMA database_list")}:
+        conn.execute("ATTACH DATABASE ? AS " + alias, (path,))
+        conn.execute(f"PRAGMA {alias}.journal_mode=WAL")
+    for table, key in ARCHIVED_TABLES.items():
+        columns = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+        existing = {row[1] for row in conn.execute(f"PRAGMA {alias}.table_info({table})")}
+        if not existing:
+            defs = ", ".join(f"{row[1]} {row[2]}" for row in columns)
+            conn.execute(
+                f"CREATE TABLE {alias}.{table} ({defs}, PRIMARY KEY ({', '.join(key)}))"
+            )
+        else:
+            for row in columns:
+                if row[1] not in existing:
+                    conn.execute(f"ALTER TABLE {alias}.{table} ADD COLUMN {row[1]} {row[2]}")
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {alias}.idx_receipts_shop_buyer "
+        "ON receipts(shop_id, buyer_user_id)"
+    )
+    conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {alias}.idx_transactions_receipt ON transactions(receipt_id)"
+    )
+    conn.commit()
@@ -0,0 +1,860 @@
+"""
+PostgreSQL schema and migration runner, the counterpart of src/schema.py.
+
+Used instead of the SQLite schema when DATABASE_URL points at PostgreSQL (see
+src/bot/pg.py). Migration N here brings a database to the same shape as SQLite
+migration N, so the two lists are extended together and never diverge in length.
+The version is kept in schema_version; each migration runs in its own transaction
+under an advisory lock, so bot shards and web replicas starting together apply it
+once. When the schema is current, startup runs no DDL at all.
+
+Dialect notes: SQLite INTEGER is 64-bit, so it maps to BIGINT throughout. Trigger
+bodies are PL/pgSQL functions, generated columns are STORED, and the full-text
+index is a tsvector column instead of an FTS5 table. Requires PostgreSQL 14+.
+Migrations 5-11 carry no backfills: every PostgreSQL database was created at
+version 11 or later, so their tables start out empty. Later migrations must backfill.
+"""
+
+from collections.abc import Awaitable, Callable
+
+import asyncpg
+
+from src.schema import ARCHIVED_TABLES, RECEIPT_STATUS_CODES, STATUS_CANCELED
+
+# Table definitions as of schema version 1. Frozen like their SQLite twins.
+_CREATE_GUILDS = """
+CREATE TABLE IF NOT EXISTS guilds (
+    guild_id         BIGINT PRIMARY KEY,
+    guild_name       TEXT,
+    etsy_shop_id     BIGINT,
+    order_channel_id BIGINT,
+    setup_token      TEXT    UNIQUE,
+    setup_token_exp  BIGINT,
+    connected_at     BIGINT,
+    created_at       BIGINT NOT NULL,
+    ship_reminder_days   TEXT,
+    ship_reminder_time   TEXT,
+    ship_reminder_tz     TEXT,
+    backlog_threshold    BIGINT,
+    backlog_warned       BIGINT NOT NULL DEFAULT 0,
+    digest_time          TEXT,
+    digest_tz            TEXT,
+    digest_last_sent     BIGINT,
+    goal_amount          BIGINT,
+    goal_milestones_sent TEXT,
+    goal_month           TEXT
+)
+"""
+
+_CREATE_ETSY_TOKENS = """
+CREATE TABLE IF NOT EXISTS etsy_tokens (
+    guild_id      BIGINT PRIMARY KEY REFERENCES guilds(guild_id),
+    access_token  TEXT   NOT NULL,
+    refresh_token TEXT   NOT NULL,
+    expires_at    BIGINT NOT NULL
+)
+"""
+
+_CREATE_PKCE_STATE = """
+CREATE TABLE IF NOT EXISTS pkce_state (
+    state         TEXT   PRIMARY KEY,
+    code_verifier TEXT   NOT NULL,
+    setup_token   TEXT   NOT NULL,
+    guild_id      BIGINT NOT NULL,
+    expires_at    BIGINT NOT NULL
+)
+"""
+
+_CREATE_SHOPS = """
+CREATE TABLE IF NOT EXISTS shops (
+    shop_id                   BIGINT PRIMARY KEY,
+    shop_name                 TEXT   NOT NULL,
+    user_id                   BIGINT NOT NULL,
+    title                     TEXT,
+    announcement              TEXT,
+    currency_code             TEXT   NOT NULL DEFAULT 'USD',
+    is_vacation               BIGINT NOT NULL DEFAULT 0,
+    listing_active_count      BIGINT,
+    digital_listing_count     BIGINT,
+    login_name                TEXT,
+    accepts_custom_requests   BIGINT DEFAULT 0,
+    url                       TEXT,
+    num_favorers              BIGINT DEFAULT 0,
+    languages                 TEXT,
+    shop_location_country_iso TEXT,
+    create_date               BIGINT,
+    fetched_at                BIGINT NOT NULL
+)
+"""
+
+_CREATE_LISTINGS = """
+CREATE TABLE IF NOT EXISTS listings (
+    listing_id              BIGINT PRIMARY KEY,
+    shop_id                 BIGINT NOT NULL REFERENCES shops(shop_id),
+    user_id                 BIGINT NOT NULL,
+    title                   TEXT   NOT NULL,
+    description             TEXT,
+    state                   TEXT   NOT NULL DEFAULT 'active',
+    quantity                BIGINT NOT NULL DEFAULT 0,
+    url                     TEXT,
+    num_favorers            BIGINT DEFAULT 0,
+    is_customizable         BIGINT DEFAULT 0,
+    is_personalizable       BIGINT DEFAULT 0,
+    listing_type            TEXT,
+    tags                    TEXT,
+    materials               TEXT,
+    price_amount            BIGINT NOT NULL,
+    price_divisor           BIGINT NOT NULL DEFAULT 100,
+    price_currency_code     TEXT   NOT NULL DEFAULT 'USD',
+    views                   BIGINT DEFAULT 0,
+    is_digital              BIGINT DEFAULT 0,
+    who_made                TEXT,
+    when_made               TEXT,
+    creation_timestamp      BIGINT,
+    last_modified_timestamp BIGINT,
+    image_url               TEXT,
+    fetched_at              BIGINT NOT NULL
+)
+"""
+
+_CREATE_SHIPPING_PRESETS = """
+CREATE TABLE IF NOT EXISTS shipping_presets (
+    id           BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    guild_id     BIGINT NOT NULL REFERENCES guilds(guild_id),
+    name         TEXT   NOT NULL,
+    carrier      TEXT   NOT NULL,
+    mail_class   TEXT   NOT NULL,
+    package_type TEXT   NOT NULL DEFAULT '',
+    weight_oz    DOUBLE PRECISION NOT NULL,
+    length_in    DOUBLE PRECISION NOT NULL,
+    width_in     DOUBLE PRECISION NOT NULL,
+    height_in    DOUBLE PRECISION NOT NULL,
+    created_at   BIGINT NOT NULL,
+    UNIQUE(guild_id, name)
+)
+"""
+
+_CREATE_SHIPPO_KEYS = """
+CREATE TABLE IF NOT EXISTS shippo_keys (
+    guild_id     BIGINT PRIMARY KEY REFERENCES guilds(guild_id),
+    api_key      TEXT   NOT NULL,
+    addr_name    TEXT,
+    addr_street1 TEXT,
+    addr_street2 TEXT,
+    addr_city    TEXT,
+    addr_state   TEXT,
+    addr_zip     TEXT,
+    addr_country TEXT   NOT NULL DEFAULT 'US',
+    addr_phone   TEXT,
+    created_at   BIGINT NOT NULL
+)
+"""
+
+_CREATE_RECEIPTS = """
+CREATE TABLE IF NOT EXISTS receipts (
+    receipt_id            BIGINT PRIMARY KEY,
+    shop_id               BIGINT NOT NULL REFERENCES shops(shop_id),
+    receipt_type          BIGINT NOT NULL DEFAULT 0,
+    seller_user_id        BIGINT NOT NULL,
+    buyer_user_id         BIGINT,
+    buyer_email           TEXT,
+    name                  TEXT,
+    first_line            TEXT,
+    second_line           TEXT,
+    city                  TEXT,
+    state                 TEXT,
+    zip                   TEXT,
+    country_iso           TEXT,
+    status                TEXT   NOT NULL,
+    payment_method        TEXT,
+    is_paid               BIGINT NOT NULL DEFAULT 0,
+    is_shipped            BIGINT NOT NULL DEFAULT 0,
+    is_gift               BIGINT NOT NULL DEFAULT 0,
+    gift_message          TEXT,
+    grandtotal_amount     BIGINT NOT NULL,
+    grandtotal_divisor    BIGINT NOT NULL DEFAULT 100,
+    grandtotal_currency   TEXT   NOT NULL DEFAULT 'USD',
+    subtotal_amount       BIGINT,
+    total_shipping_amount BIGINT,
+    total_tax_amount      BIGINT,
+    discount_amount       BIGINT DEFAULT 0,
+    create_timestamp      BIGINT NOT NULL,
+    update_timestamp      BIGINT,
+    expected_ship_date    BIGINT,
+    fetched_at            BIGINT NOT NULL,
+    notified_at           BIGINT
+)
+"""
+
+_CREATE_SHIPPING_REMINDERS = """
+CREATE TABLE IF NOT EXISTS shipping_reminders (
+    receipt_id  BIGINT NOT NULL REFERENCES receipts(receipt_id),
+    days_before BIGINT NOT NULL,
+    sent_at     BIGINT NOT NULL,
+    PRIMARY KEY (receipt_id, days_before)
+)
+"""
+
+_CREATE_TRANSACTIONS = """
+CREATE TABLE IF NOT EXISTS transactions (
+    transaction_id      BIGINT PRIMARY KEY,
+    receipt_id          BIGINT NOT NULL REFERENCES receipts(receipt_id),
+    shop_id             BIGINT NOT NULL REFERENCES shops(shop_id),
+    listing_id          BIGINT,
+    title               TEXT,
+    quantity            BIGINT NOT NULL DEFAULT 1,
+    price_amount        BIGINT NOT NULL DEFAULT 0,
+    price_divisor       BIGINT NOT NULL DEFAULT 100,
+    price_currency      TEXT   NOT NULL DEFAULT 'USD',
+    create_timestamp    BIGINT NOT NULL,
+    image_url           TEXT,
+    selected_variations TEXT,
+    personalization_msg TEXT,
+    fetched_at          BIGINT NOT NULL
+)
+"""
+
+_CREATE_REVIEWS = """
+CREATE TABLE IF NOT EXISTS reviews (
+    transaction_id   BIGINT PRIMARY KEY,
+    shop_id          BIGINT NOT NULL REFERENCES shops(shop_id),
+    listing_id       BIGINT,
+    buyer_user_id    BIGINT,
+    rating           BIGINT NOT NULL,
+    review           TEXT,
+    language         TEXT,
+    image_url        TEXT,
+    create_timestamp BIGINT NOT NULL,
+    update_timestamp BIGINT,
+    fetched_at       BIGINT NOT NULL,
+    notified_at      BIGINT
+)
+"""
+
+_CREATE_BOT_STATE = """
+CREATE TABLE IF NOT EXISTS bot_state (
+    key        TEXT   PRIMARY KEY,
+    value      TEXT,
+    updated_at BIGINT NOT NULL
+)
+"""
+
+
+def _trigger(
+    name: str, timing: str, table: str, body: str, when: str | None = None, returns: str = "NULL"
+) -> list[str]:
+    """DDL for a row trigger `name` on `table` whose function runs the PL/pgSQL `body`.
+
+    timing is e.g. "AFTER INSERT" or "AFTER UPDATE OF status"; `returns` is what the
+    function returns (NULL for AFTER triggers, NEW/OLD to let a BEFORE one proceed).
+    Both statements replace an existing definition, so a later migration can redefine
+    a trigger just by building it again.
+    """
+    return [
+        f"""
+        CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $fn$
+        BEGIN
+            {body}
+            RETURN {returns};
+        END
+        $fn$
+        """,
+        f"""
+        CREATE OR REPLACE TRIGGER {name} {timing} ON {table}
+        FOR EACH ROW {f"WHEN ({when})" if when else ""} EXECUTE FUNCTION {name}()
+        """,
+    ]
+
+
+def _utc(fmt: str, timestamp: str) -> str:
+    """SQL formatting a unix timestamp expression in UTC with to_char() pattern `fmt`."""
+    return f"to_char(to_timestamp({timestamp}) AT TIME ZONE 'UTC', {fmt})"
+
+
+# ── Migrations ────────────────────────────────────────────────────────────────
+
+async def _m001_baseline(conn: asyncpg.Connection) -> None:
+    """Create every table. PostgreSQL databases never predate migrations, so there
+    are no legacy columns to add."""
+    for ddl in (
+        _CREATE_GUILDS,
+        _CREATE_ETSY_TOKENS,
+        _CREATE_PKCE_STATE,
+        _CREATE_SHOPS,
+        _CREATE_LISTINGS,
+        _CREATE_RECEIPTS,
+        _CREATE_SHIPPING_PRESETS,
+        _CREATE_SHIPPING_REMINDERS,
+        _CREATE_TRANSACTIONS,
+        _CREATE_REVIEWS,
+        _CREATE_SHIPPO_KEYS,
+        _CREATE_BOT_STATE,
+    ):
+        await conn.execute(ddl)
+
+
+async def _m002_hot_query_indexes(conn: asyncpg.Connection) -> None:
+    """Secondary indexes for the per-shop queries the poller and commands run."""
+    for ddl in (
+        """CREATE INDEX IF NOT EXISTS idx_receipts_unnotified
+           ON receipts(shop_id, create_timestamp) WHERE notified_at IS NULL""",
+        """CREATE INDEX IF NOT EXISTS idx_receipts_shop_created
+           ON receipts(shop_id, create_timestamp)""",
+        """CREATE INDEX IF NOT EXISTS idx_receipts_shop_buyer
+           ON receipts(shop_id, buyer_user_id)""",
+        """CREATE INDEX IF NOT EXISTS idx_receipts_unshipped
+           ON receipts(shop_id, expected_ship_date) WHERE is_shipped = 0""",
+        """CREATE INDEX IF NOT EXISTS idx_transactions_receipt
+           ON transactions(receipt_id)""",
+        """CREATE INDEX IF NOT EXISTS idx_transactions_shop_created
+           ON transactions(shop_id, create_timestamp)""",
+        """CREATE INDEX IF NOT EXISTS idx_reviews_unnotified
+           ON reviews(shop_id, create_timestamp) WHERE notified_at IS NULL""",
+        """CREATE INDEX IF NOT EXISTS idx_listings_shop_state
+           ON listings(shop_id, state)""",
+        """CREATE INDEX IF NOT EXISTS idx_pkce_state_expires
+           ON pkce_state(expires_at)""",
+    ):
+        await conn.execute(ddl)
+
+
+async def _m003_upsert_change_tracking(conn: asyncpg.Connection) -> None:
+    """prev_* columns the upserts fill with the old value so RETURNING can report diffs."""
+    await conn.execute("ALTER TABLE receipts ADD COLUMN prev_status TEXT")
+    await conn.execute("ALTER TABLE receipts ADD COLUMN prev_is_shipped BIGINT")
+    await conn.execute("ALTER TABLE listings ADD COLUMN prev_quantity BIGINT")
+
+
+async def _m004_shop_sync(conn: asyncpg.Connection) -> None:
+    """Per-shop fetch freshness, so unchanged rows no longer need rewriting."""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS shop_sync (
+            shop_id            BIGINT PRIMARY KEY,
+            listings_synced_at BIGINT,
+            receipts_synced_at BIGINT,
+            reviews_synced_at  BIGINT
+        )
+    """)
+
+
+# Sales predicates, as in src/schema.py: the text form until _m008 adds status_code.
+def _counts_as_sale(ref: str) -> str:
+    return f"LOWER({ref}.status) != 'canceled'"
+
+
+def _counts_as_sale_by_code(ref: str) -> str:
+    return f"{ref}.status_code != {STATUS_CANCELED}"
+
+
+def _daily_sales_add(ref: str, sign: str, counts: Callable[[str], str]) -> str:
+    """Statement folding receipt `ref` (NEW or OLD) into daily_sales with `sign`."""
+    return f"""
+        INSERT INTO daily_sales AS d (shop_id, day, currency, divisor, orders, revenue_minor_units)
+        SELECT {ref}.shop_id, {_utc("'YYYY-MM-DD'", f"{ref}.create_timestamp")},
+               {ref}.grandtotal_currency, {ref}.grandtotal_divisor,
+               {sign}1, {sign}{ref}.grandtotal_amount
+        WHERE {counts(ref)}
+        ON CONFLICT (shop_id, day, currency) DO UPDATE SET
+            orders = d.orders + excluded.orders,
+            revenue_minor_units = d.revenue_minor_units + excluded.revenue_minor_units;
+    """
+
+
+def _daily_sales_triggers(counts: Callable[[str], str]) -> list[str]:
+    rollup = ("status", "create_timestamp", "grandtotal_amount", "grandtotal_divisor",
+              "grandtotal_currency", "shop_id")
+    return [
+        *_trigger("trg_receipts_daily_sales_insert", "AFTER INSERT", "receipts",
+                  _daily_sales_add("NEW", "+", counts)),
+        *_trigger(
+            "trg_receipts_daily_sales_update",
+            f"AFTER UPDATE OF {', '.join(rollup)}",
+            "receipts",
+            _daily_sales_add("OLD", "-", counts) + _daily_sales_add("NEW", "+", counts),
+            when=f"({', '.join(f'OLD.{c}' for c in rollup)}) "
+                 f"IS DISTINCT FROM ({', '.join(f'NEW.{c}' for c in rollup)})",
+        ),
+        *_trigger("trg_receipts_daily_sales_delete", "AFTER DELETE", "receipts",
+                  _daily_sales_add("OLD", "-", counts)),
+    ]
+
+
+async def _m005_daily_sales(conn: asyncpg.Connection) -> None:
+    """Per-shop, per-UTC-day sales totals kept current by triggers on receipts."""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS daily_sales (
+            shop_id             BIGINT NOT NULL,
+            day                 TEXT   NOT NULL,  -- YYYY-MM-DD (UTC)
+            currency            TEXT   NOT NULL,
+            divisor             BIGINT NOT NULL,
+            orders              BIGINT NOT NULL,
+            revenue_minor_units BIGINT NOT NULL,
+            PRIMARY KEY (shop_id, day, currency)
+        )
+    """)
+    for ddl in _daily_sales_triggers(_counts_as_sale):
+        await conn.execute(ddl)
+
+
+# Bestseller periods: every sale lands in its month, its year and all-time.
+_LISTING_SALES_PERIODS = "(VALUES ('all'), ('YYYY'), ('YYYY-MM')) AS p(fmt)"
+_LISTING_SALES_PERIOD = (
+    f"CASE p.fmt WHEN 'all' THEN 'all' ELSE {_utc('p.fmt', 't.create_timestamp')} END"
+)
+
+
+def _listing_sales_add(
+    match: str, sign: str, counts: Callable[[str], str] | None = None
+) -> str:
+    """Statement folding the line items `t` matching `match` into listing_sales with `sign`.
+
+    Items are summed per listing first: one ON CONFLICT statement may not update the
+    same row twice, which a receipt with two lines for one listing would otherwise do.
+    """
+    counted = (
+        f"""AND EXISTS (SELECT 1 FROM receipts r
+                        WHERE r.receipt_id = t.receipt_id AND {counts("r")})"""
+        if counts
+        else ""
+    )
+    return f"""
+        INSERT INTO listing_sales AS l (shop_id, period, listing_id, title, image_url,
+                                        currency, divisor, units, revenue_minor_units)
+        SELECT t.shop_id, {_LISTING_SALES_PERIOD}, t.listing_id,
+               MAX(t.title), MAX(t.image_url), MAX(t.price_currency), MAX(t.price_divisor),
+               {sign}SUM(t.quantity), {sign}SUM(t.quantity * t.price_amount)
+        FROM transactions t CROSS JOIN {_LISTING_SALES_PERIODS}
+        WHERE {match} AND t.listing_id IS NOT NULL {counted}
+        GROUP BY 1, 2, 3
+        ON CONFLICT (shop_id, period, listing_id) DO UPDATE SET
+            title = COALESCE(excluded.title, l.title),
+            image_url = COALESCE(excluded.image_url, l.image_url),
+            units = l.units + excluded.units,
+            revenue_minor_units = l.revenue_minor_units + excluded.revenue_minor_units;
+    """
+
+
+def _listing_sales_triggers(counts: Callable[[str], str]) -> list[str]:
+    return [
+        *_trigger("trg_transactions_listing_sales_insert", "AFTER INSERT", "transactions",
+                  _listing_sales_add("t.transaction_id = NEW.transaction_id", "+", counts)),
+        # BEFORE, so the line item and its receipt are still there to be backed out
+        *_trigger("trg_transactions_listing_sales_delete", "BEFORE DELETE", "transactions",
+                  _listing_sales_add("t.transaction_id = OLD.transaction_id", "-", counts),
+                  returns="OLD"),
+        *_trigger("trg_receipts_listing_sales_cancel", "AFTER UPDATE OF status", "receipts",
+                  _listing_sales_add("t.receipt_id = NEW.receipt_id", "-"),
+                  when=f"({counts('OLD')}) AND NOT ({counts('NEW')})"),
+        *_trigger("trg_receipts_listing_sales_uncancel", "AFTER UPDATE OF status", "receipts",
+                  _listing_sales_add("t.receipt_id = NEW.receipt_id", "+"),
+                  when=f"NOT ({counts('OLD')}) AND ({counts('NEW')})"),
+    ]
+
+
+async def _m006_listing_sales(conn: asyncpg.Connection) -> None:
+    """Per-listing month/year/all-time sales totals, kept current by triggers, for /bestsellers."""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS listing_sales (
+            shop_id             BIGINT NOT NULL,
+            period              TEXT   NOT NULL,  -- 'all', 'YYYY' or 'YYYY-MM' (UTC)
+            listing_id          BIGINT NOT NULL,
+            title               TEXT,
+            image_url           TEXT,
+            currency            TEXT   NOT NULL,
+            divisor             BIGINT NOT NULL,
+            units               BIGINT NOT NULL,
+            revenue_minor_units BIGINT NOT NULL,
+            PRIMARY KEY (shop_id, period, listing_id)
+        )
+    """)
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listing_sales_units "
+        "ON listing_sales (shop_id, period, units DESC)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_listing_sales_revenue "
+        "ON listing_sales (shop_id, period, revenue_minor_units DESC)"
+    )
+    for ddl in _listing_sales_triggers(_counts_as_sale):
+        await conn.execute(ddl)
+
+
+def _buyers_triggers(counts: Callable[[str], str]) -> list[str]:
+    return [
+        *_trigger("trg_receipts_buyers_insert", "AFTER INSERT", "receipts", f"""
+            INSERT INTO buyers AS b (shop_id, buyer_user_id, name, name_norm, first_receipt_id,
+                                     first_order_at, last_order_at, order_count,
+                                     lifetime_spend_minor)
+            VALUES (NEW.shop_id, NEW.buyer_user_id, NEW.name, LOWER(TRIM(NEW.name)),
+                    NEW.receipt_id, NEW.create_timestamp, NEW.create_timestamp,
+                    ({counts("NEW")})::int,
+                    ({counts("NEW")})::int * NEW.grandtotal_amount)
+            ON CONFLICT (shop_id, buyer_user_id) DO UPDATE SET
+                name = CASE WHEN excluded.last_order_at >= b.last_order_at
+                            THEN COALESCE(excluded.name, b.name) ELSE b.name END,
+                name_norm = CASE WHEN excluded.last_order_at >= b.last_order_at
+                                 THEN COALESCE(excluded.name_norm, b.name_norm) ELSE b.name_norm END,
+                first_receipt_id = CASE WHEN excluded.first_order_at < b.first_order_at
+                                        THEN excluded.first_receipt_id ELSE b.first_receipt_id END,
+                first_order_at = LEAST(b.first_order_at, excluded.first_order_at),
+                last_order_at = GREATEST(b.last_order_at, excluded.last_order_at),
+                order_count = b.order_count + excluded.order_count,
+                lifetime_spend_minor = b.lifetime_spend_minor + excluded.lifetime_spend_minor;
+        """, when="NEW.buyer_user_id IS NOT NULL"),
+        *_trigger("trg_receipts_buyers_update", "AFTER UPDATE OF status, grandtotal_amount",
+                  "receipts", f"""
+            UPDATE buyers SET
+                order_count = order_count - ({counts("OLD")})::int + ({counts("NEW")})::int,
+                lifetime_spend_minor = lifetime_spend_minor
+                    - ({counts("OLD")})::int * OLD.grandtotal_amount
+                    + ({counts("NEW")})::int * NEW.grandtotal_amount
+            WHERE shop_id = NEW.shop_id AND buyer_user_id = NEW.buyer_user_id;
+        """, when="NEW.buyer_user_id IS NOT NULL AND (OLD.status, OLD.grandtotal_amount) "
+                  "IS DISTINCT FROM (NEW.status, NEW.grandtotal_amount)"),
+    ]
+
+
+async def _m007_buyers(conn: asyncpg.Connection) -> None:
+    """One row per shop customer, kept current by triggers on receipts.
+
+    first_receipt_id/first_order_at cover every receipt; order_count and
+    lifetime_spend_minor only non-canceled ones.
+    """
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS buyers (
+            shop_id              BIGINT NOT NULL,
+            buyer_user_id        BIGINT NOT NULL,
+            name                 TEXT,
+            name_norm            TEXT,     -- LOWER(TRIM(name)), for lookups by name
+            first_receipt_id     BIGINT NOT NULL,
+            first_order_at       BIGINT NOT NULL,
+            last_order_at        BIGINT NOT NULL,
+            order_count          BIGINT NOT NULL,
+            lifetime_spend_minor BIGINT NOT NULL,
+            PRIMARY KEY (shop_id, buyer_user_id)
+        )
+    """)
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_buyers_name ON buyers (shop_id, name_norm)")
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_buyers_recent ON buyers (shop_id, last_order_at DESC)"
+    )
+    for ddl in _buyers_triggers(_counts_as_sale):
+        await conn.execute(ddl)
+
+
+async def _m008_receipt_status_code(conn: asyncpg.Connection) -> None:
+    """Integer status and is_open flag on receipts, so open-order filters can use indexes.
+
+    STORED generated columns (PostgreSQL has no VIRTUAL ones before 18). A generated
+    column can't read another, so is_open repeats the status_code expression. The
+    rollup triggers are rebuilt to test status_code instead of LOWER(status).
+    """
+    cases = " ".join(f"WHEN '{status}' THEN {code}" for status, code in RECEIPT_STATUS_CODES.items())
+    status_code = f"CASE LOWER(status) {cases} ELSE 0 END"
+    await conn.execute(
+        f"ALTER TABLE receipts ADD COLUMN status_code BIGINT GENERATED ALWAYS AS ({status_code}) STORED"
+    )
+    await conn.execute(
+        "ALTER TABLE receipts ADD COLUMN is_open BIGINT GENERATED ALWAYS AS "
+        f"((is_shipped = 0 AND {status_code} != {STATUS_CANCELED})::int) STORED"
+    )
+    for ddl in (
+        """CREATE INDEX IF NOT EXISTS idx_receipts_open
+           ON receipts(shop_id, expected_ship_date) WHERE is_open = 1""",
+        """CREATE INDEX IF NOT EXISTS idx_receipts_labelable
+           ON receipts(shop_id, create_timestamp) WHERE is_open = 1 AND is_paid = 1""",
+        "DROP INDEX IF EXISTS idx_receipts_shop_created",
+        """CREATE INDEX IF NOT EXISTS idx_receipts_shop_created
+           ON receipts(shop_id, create_timestamp, status_code)""",
+        *_daily_sales_triggers(_counts_as_sale_by_code),
+        *_listing_sales_triggers(_counts_as_sale_by_code),
+        *_buyers_triggers(_counts_as_sale_by_code),
+    ):
+        await conn.execute(ddl)
+
+
+def _shop_counters_add(shop: str, open_orders: str, receipts: str, reviews: str) -> str:
+    """Statement adding the given deltas to shop `shop`'s counters."""
+    return f"""
+        INSERT INTO shop_counters AS c (shop_id, open_orders, unnotified_receipts, unnotified_reviews)
+        VALUES ({shop}, {open_orders}, {receipts}, {reviews})
+        ON CONFLICT (shop_id) DO UPDATE SET
+            open_orders = c.open_orders + excluded.open_orders,
+            unnotified_receipts = c.unnotified_receipts + excluded.unnotified_receipts,
+            unnotified_reviews = c.unnotified_reviews + excluded.unnotified_reviews;
+    """
+
+
+async def _m009_shop_counters(conn: asyncpg.Connection) -> None:
+    """Per-shop open/unnotified counts kept exact by triggers, so idle shops skip whole poll stages."""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS shop_counters (
+            shop_id             BIGINT PRIMARY KEY,
+            open_orders         BIGINT NOT NULL DEFAULT 0,
+            unnotified_receipts BIGINT NOT NULL DEFAULT 0,
+            unnotified_reviews  BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    new_pending = "(NEW.notified_at IS NULL)::int"
+    old_pending = "(OLD.notified_at IS NULL)::int"
+    for ddl in (
+        *_trigger("trg_receipts_counters_insert", "AFTER INSERT", "receipts",
+                  _shop_counters_add("NEW.shop_id", "NEW.is_open", new_pending, "0")),
+        *_trigger(
+            "trg_receipts_counters_update",
+            "AFTER UPDATE OF status, is_shipped, notified_at, shop_id",
+            "receipts",
+            _shop_counters_add("OLD.shop_id", "-OLD.is_open", f"-{old_pending}", "0")
+            + _shop_counters_add("NEW.shop_id", "NEW.is_open", new_pending, "0"),
+            when="(OLD.shop_id, OLD.is_open, OLD.notified_at IS NULL) "
+                 "IS DISTINCT FROM (NEW.shop_id, NEW.is_open, NEW.notified_at IS NULL)",
+        ),
+        *_trigger("trg_receipts_counters_delete", "AFTER DELETE", "receipts",
+                  _shop_counters_add("OLD.shop_id", "-OLD.is_open", f"-{old_pending}", "0")),
+        *_trigger("trg_reviews_counters_insert", "AFTER INSERT", "reviews",
+                  _shop_counters_add("NEW.shop_id", "0", "0", new_pending)),
+        *_trigger(
+            "trg_reviews_counters_update",
+            "AFTER UPDATE OF notified_at, shop_id",
+            "reviews",
+            _shop_counters_add("OLD.shop_id", "0", "0", f"-{old_pending}")
+            + _shop_counters_add("NEW.shop_id", "0", "0", new_pending),
+            when="(OLD.shop_id, OLD.notified_at IS NULL) "
+                 "IS DISTINCT FROM (NEW.shop_id, NEW.notified_at IS NULL)",
+        ),
+        *_trigger("trg_reviews_counters_delete", "AFTER DELETE", "reviews",
+                  _shop_counters_add("OLD.shop_id", "0", "0", f"-{old_pending}")),
+    ):
+        await conn.execute(ddl)
+
+
+async def _m010_archive_tombstones(conn: asyncpg.Connection) -> None:
+    """Support for moving old orders into the archive schema (see ensure_archive()).
+
+    archived_ids records every receipt and review that has been moved out. Deletes
+    of those rows leave the rollups alone, and a later re-fetch of the same row
+    from Etsy is silently skipped instead of resurrecting it. Trigger WHEN clauses
+    can't hold subqueries here, so the checks live in the function bodies.
+    """
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS archived_ids (
+            tbl TEXT   NOT NULL,  -- 'receipts' or 'reviews'
+            id  BIGINT NOT NULL,
+            PRIMARY KEY (tbl, id)
+        )
+    """)
+    archived_receipt = "EXISTS (SELECT 1 FROM archived_ids WHERE tbl = 'receipts' AND id = {})"
+    archived_review = "EXISTS (SELECT 1 FROM archived_ids WHERE tbl = 'reviews' AND id = {})"
+    skip = "IF {} THEN RETURN NULL; END IF;"
+    for ddl in (
+        *_trigger("trg_receipts_daily_sales_delete", "AFTER DELETE", "receipts", f"""
+            IF NOT {archived_receipt.format("OLD.receipt_id")} THEN
+                {_daily_sales_add("OLD", "-", _counts_as_sale_by_code)}
+            END IF;
+        """),
+        *_trigger("trg_transactions_listing_sales_delete", "BEFORE DELETE", "transactions", f"""
+            IF NOT {archived_receipt.format("OLD.receipt_id")} THEN
+                {_listing_sales_add("t.transaction_id = OLD.transaction_id", "-",
+                                    _counts_as_sale_by_code)}
+            END IF;
+        """, returns="OLD"),
+        *_trigger("trg_receipts_skip_archived", "BEFORE INSERT", "receipts",
+                  skip.format(archived_receipt.format("NEW.receipt_id")), returns="NEW"),
+        *_trigger("trg_transactions_skip_archived", "BEFORE INSERT", "transactions",
+                  skip.format(archived_receipt.format("NEW.receipt_id")), returns="NEW"),
+        *_trigger("trg_reviews_skip_archived", "BEFORE INSERT", "reviews",
+                  skip.format(archived_review.format("NEW.transaction_id")), returns="NEW"),
+    ):
+        await conn.execute(ddl)
+
+
+# Line-item text for one receipt, as stored in orders_fts
+def _orders_fts_items(receipt: str) -> str:
+    return f"""
+        UPDATE orders_fts SET
+            items = (SELECT string_agg(title, ' ') FROM transactions
+                     WHERE receipt_id = {receipt}),
+            variations = (SELECT string_agg(v #>> '{{}}', ' ')
+                          FROM transactions t,
+                               jsonb_path_query(t.selected_variations::jsonb,
+                                                'lax $[*].formatted_value') v
+                          WHERE t.receipt_id = {receipt}),
+            personalization = (SELECT string_agg(personalization_msg, ' ') FROM transactions
+                               WHERE receipt_id = {receipt})
+        WHERE receipt_id = {receipt};
+    """
+
+
+# Weights let a search be limited to one field: the buyer name is A, the receipt
+# ID B, line-item text C and the rest D.
+_ORDERS_FTS_DOCUMENT = """
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A')
+    || setweight(to_tsvector('simple', receipt_id::text), 'B')
+    || setweight(to_tsvector('simple', coalesce(items, '') || ' ' || coalesce(variations, '')
+                                      || ' ' || coalesce(personalization, '')), 'C')
+    || setweight(to_tsvector('simple', coalesce(city, '') || ' ' || coalesce(gift_message, '')), 'D')
+"""
+
+
+async def _m011_orders_fts(conn: asyncpg.Connection) -> None:
+    """Full-text index over orders, one row per receipt, kept in sync by triggers.
+
+    The text columns mirror the FTS5 table's; `document` is the tsvector built from
+    them and is what searches match, through a GIN index.
+    """
+    await conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS orders_fts (
+            receipt_id      BIGINT PRIMARY KEY,
+            shop_id         BIGINT NOT NULL,
+            name            TEXT,
+            city            TEXT,
+            gift_message    TEXT,
+            items           TEXT,
+            variations      TEXT,
+            personalization TEXT,
+            document        tsvector GENERATED ALWAYS AS ({_ORDERS_FTS_DOCUMENT}) STORED
+        )
+    """)
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_orders_fts_document ON orders_fts USING gin (document)"
+    )
+    for ddl in (
+        *_trigger("trg_receipts_fts_insert", "AFTER INSERT", "receipts", """
+            INSERT INTO orders_fts (receipt_id, shop_id, name, city, gift_message)
+            VALUES (NEW.receipt_id, NEW.shop_id, NEW.name, NEW.city, NEW.gift_message);
+        """),
+        *_trigger("trg_receipts_fts_update", "AFTER UPDATE OF shop_id, name, city, gift_message",
+                  "receipts", """
+            UPDATE orders_fts
+            SET shop_id = NEW.shop_id, name = NEW.name, city = NEW.city,
+                gift_message = NEW.gift_message
+            WHERE receipt_id = NEW.receipt_id;
+        """, when="(OLD.shop_id, OLD.name, OLD.city, OLD.gift_message) "
+                  "IS DISTINCT FROM (NEW.shop_id, NEW.name, NEW.city, NEW.gift_message)"),
+        *_trigger("trg_receipts_fts_delete", "AFTER DELETE", "receipts",
+                  "DELETE FROM orders_fts WHERE receipt_id = OLD.receipt_id;"),
+        *_trigger("trg_transactions_fts_insert", "AFTER INSERT", "transactions",
+                  _orders_fts_items("NEW.receipt_id")),
+        *_trigger("trg_transactions_fts_update",
+                  "AFTER UPDATE OF title, selected_variations, personalization_msg",
+                  "transactions", _orders_fts_items("NEW.receipt_id")),
+        *_trigger("trg_transactions_fts_delete", "AFTER DELETE", "transactions",
+                  _orders_fts_items("OLD.receipt_id")),
+    ):
+        await conn.execute(ddl)
+
+
+async def _m012_guild_events(conn: asyncpg.Connection) -> None:
+    """Outbox of guilds connected by the web server, read by the bot (get_guild_events())."""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS guild_events (
+            event_id   BIGSERIAL PRIMARY KEY,
+            guild_id   BIGINT NOT NULL,
+            created_at BIGINT NOT NULL
+        )
+    """)
+
+
+# Append only, in step with src/schema.py's MIGRATIONS.
+MIGRATIONS: list[Callable[[asyncpg.Connection], Awaitable[None]]] = [
+    _m001_baseline,
+    _m002_hot_query_indexes,
+    _m003_upsert_change_tracking,
+    _m004_shop_sync,
+    _m005_daily_sales,
+    _m006_listing_sales,
+    _m007_buyers,
+    _m008_receipt_status_code,
+    _m009_shop_counters,
+    _m010_archive_tombstones,
+    _m011_orders_fts,
+    _m012_guild_events,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# pg_advisory_xact_lock key serializing migrations across processes ("shopkeep")
+_MIGRATION_LOCK = 0x73686F706B656570
+
+
+async def get_version(conn: asyncpg.Connection) -> int:
+    if await conn.fetchval("SELECT to_regclass('schema_version')") is None:
+        return 0
+    return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+
+
+async def migrate(conn: asyncpg.Connection) -> int:
+    """Apply pending migrations and return how many ran.
+
+    Each migration runs in one transaction with its version bump, after taking an
+    advisory lock and re-checking the version, so concurrent processes can't both
+    apply the same step.
+    """
+    if await get_version(conn) >= SCHEMA_VERSION:
+        return 0
+
+    applied = 0
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        async with conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", _MIGRATION_LOCK)
+            await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version BIGINT NOT NULL)")
+            if await get_version(conn) >= version:
+                continue
+            await migration(conn)
+            await conn.execute("DELETE FROM schema_version")
+            await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", version)
+        applied += 1
+        print(f"[schema] Applied migration {version}: {migration.__name__}")
+    return applied
+
+
+# ── Archive schema ────────────────────────────────────────────────────────────
+
+async def ensure_archive(conn: asyncpg.Connection, schema: str = "archive") -> None:
+    """Create the archive schema's tables and bring them up to date.
+
+    The counterpart of src.schema.attach_archive(): archive tables mirror the stored
+    (non-generated) columns of their public counterparts and gain any column added
+    there since. They have no triggers and are only read for history lookups.
+    """
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", _MIGRATION_LOCK)
+        await conn.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
+        for table, key in ARCHIVED_TABLES.items():
+            columns = await _stored_columns(conn, "public", table)
+            existing = {name for name, _ in await _stored_columns(conn, schema, table)}
+            if not existing:
+                defs = ", ".join(f"{name} {decl}" for name, decl in columns)
+                await conn.execute(
+                    f"CREATE TABLE {schema}.{table} ({defs}, PRIMARY KEY ({', '.join(key)}))"
+                )
+            else:
+                for name, decl in columns:
+                    if name not in existing:
+                        await conn.execute(f"ALTER TABLE {schema}.{table} ADD COLUMN {name} {decl}")
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_receipts_shop_buyer "
+            f"ON {schema}.receipts(shop_id, buyer_user_id)"
+        )
+        await conn.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_transactions_receipt "
+            f"ON {schema}.transactions(receipt_id)"
+        )
+
+
+async def _stored_columns(conn: asyncpg.Connection, schema: str, table: str) -> list[tuple[str, str]]:
+    """(name, type) of a table's non-generated columns in order; empty if it doesn't exist."""
+    rows = await conn.fetch(
+        """
+        SELECT a.attname, format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        JOIN pg_class c ON c.oid = a.attrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = $1 AND c.relname = $2
+          AND a.attnum > 0 AND NOT a.attisdropped AND a.attgenerated = ''
+        ORDER BY a.attnum
+        """,
+        schema,
+        table,
+    )
+    return [(row[0], row[1]) for row in rows]
@@ -44,7 +44,7 @@ ETSY_SCOPES = "transactions_r transactions_w listings_r shops_r profile_r"
 
 PKCE_STATE_TTL = 600  # 10 minutes
 
-webdb.init_pkce_table()
+webdb.init_db()
 
 
 # ── PKCE helpers ──────────────────────────────────────────────────────────────
@@ -118,12 +118,10 @@ def etsy_callback():
     if error:
         return render_template("error.html", message=f"Etsy authorization denied: {error}")
 
-    pkce = webdb.get_pkce_state(state) if state else None
-    if not code or not pkce:
+    pkce = webdb.consume_pkce_state(state) if state and code else None
+    if not pkce:
         return render_template("error.html", message="Invalid OAuth callback. Please try again.")
 
-    webdb.delete_pkce_state(state)
-
     # Exchange code for tokens
     resp = requests.post(
         ETSY_TOKEN_URL,
@@ -167,8 +165,7 @@ def etsy_callback():
     shop_id = shop["shop_id"]
 
     # Persist to DB
-    webdb.save_guild_tokens(pkce["guild_id"], access_token, refresh_token, expires_at)
-    webdb.update_guild_etsy(pkce["guild_id"], shop_id)
+    webdb.connect_guild(pkce["guild_id"], shop_id, access_token, refresh_token, expires_at)
 
     return render_template("success.html", shop_name=shop["shop_name"])
 
@@ -2,63 +2,149 @@
 Synchronous SQLite helpers for the web server.
 The web server runs in Flask (sync), so it uses the standard sqlite3 module
 rather than aiosqlite. Both processes share the same WAL-mode SQLite file.
+Connections are opened once and reused across requests (see _transaction()).
+When DATABASE_URL is set, every helper goes to PostgreSQL via src/bot/pg.py instead.
 """
 
+import asyncio
+import os
 import sqlite3
+import threading
 import time
-import os
+from contextlib import contextmanager
+from typing import Any
+
+from src import schema
 
 DB_PATH: str = os.getenv("DB_PATH", "./shopkeep.db")
+DATABASE_URL: str = os.getenv("DATABASE_URL", "")
+schema.configure_pragmas(os.getenv("SQLITE_PRAGMAS", ""))
 
-_CREATE_PKCE_STATE = """
-CREATE TABLE IF NOT EXISTS pkce_state (
-    state         TEXT    PRIMARY KEY,
-    code_verifier TEXT    NOT NULL,
-    setup_token   TEXT    NOT NULL,
-    guild_id      INTEGER NOT NULL,
-    expires_at    INTEGER NOT NULL
-)
-"""
+
+def _pg(helper: str, *args) -> Any:
+    """Run src.bot.pg.<helper>(conn, *args) on a one-off connection and commit.
+
+    The web server makes a handful of queries per OAuth flow, so a connection per
+    call is cheap enough and keeps Flask free of an event loop.
+    """
+    import asyncpg
+
+    from src.bot import pg
+
+    async def main():
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            async with conn.transaction():
+                return await getattr(pg, helper)(conn, *args)
+        finally:
+            await conn.close()
+
+    return asyncio.run(main())
+
+
+# Idle connections kept open for the next request, and the prepared statements each
+# one caches (sqlite3's default is 128)
+POOL_SIZE = 8
+STATEMENT_CACHE_SIZE = 256
+
+_idle: list[tuple[str, sqlite3.Connection]] = []
+_idle_lock = threading.Lock()
 
 
 def get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
+    """Open a new connection with the shared settings applied."""
+    conn = sqlite3.connect(
+        DB_PATH, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False
+    )
     conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA journal_mode=WAL")
-    conn.execute("PRAGMA foreign_keys=ON")
+    schema.apply_pragmas(conn)
     return conn
 
 
-def init_pkce_table() -> None:
-    with get_db() as conn:
-        conn.execute(_CREATE_PKCE_STATE)
-        conn.commit()
+@contextmanager
+def _transaction():
+    """Borrow a persistent connection and run one transaction on it.
+
+    Commits when the block exits cleanly and rolls back if it raises. The connection
+    then goes back to the idle list for the next request, so requests skip the
+    connect and PRAGMA round trips and keep their prepared statements. Each thread
+    holds its own connection for the duration of the block.
+    """
+    path = DB_PATH
+    conn = None
+    with _idle_lock:
+        while _idle and conn is None:
+            idle_path, idle = _idle.pop()
+            if idle_path == path:
+                conn = idle
+            else:
+                idle.close()  # DB_PATH changed (tests)
+    if conn is None:
+        conn = get_db()
+    try:
+        with conn:
+            yield conn
+    except BaseException:
+        conn.close()
+        raise
+    with _idle_lock:
+        if len(_idle) < POOL_SIZE:
+            _idle.append((path, conn))
+            return
+    conn.close()
+
+
+def init_db() -> None:
+    """Bring the shared schema up to date; a no-op when the bot already has."""
+    if DATABASE_URL:
+        from src.bot import pg
+
+        pg.DATABASE_URL = DATABASE_URL
+        asyncio.run(pg.init_db())
+        return
+    conn = get_db()
+    try:
+        schema.migrate(conn)
+    finally:
+        conn.close()
 
 
 def get_guild_by_setup_token(setup_token: str) -> sqlite3.Row | None:
-    with get_db() as conn:
+    if DATABASE_URL:
+        row: sqlite3.Row | None = _pg("get_guild_by_setup_token", setup_token)
+        return row
+    with _transaction() as conn:
         return conn.execute(
             "SELECT * FROM guilds WHERE setup_token = ?", (setup_token,)
         ).fetchone()
 
 
 def update_guild_etsy(guild_id: int, etsy_shop_id: int) -> None:
-    with get_db() as conn:
-        conn.execute(
-            """
-            UPDATE guilds
-            SET etsy_shop_id = ?, connected_at = ?, setup_token = NULL, setup_token_exp = NULL
-            WHERE guild_id = ?
-            """,
-            (etsy_shop_id, int(time.time()), guild_id),
-        )
-        conn.commit()
+    if DATABASE_URL:
+        _pg("update_guild_etsy", guild_id, etsy_shop_id)
+        return
+    with _transaction() as conn:
+        _update_guild_etsy(conn, guild_id, etsy_shop_id)
+
+
+def _update_guild_etsy(conn: sqlite3.Connection, guild_id: int, etsy_shop_id: int) -> None:
+    conn.execute(
+        """
+        UPDATE guilds
+        SET etsy_shop_id = ?, connected_at = ?, setup_token = NULL, setup_token_exp = NULL
+        WHERE guild_id = ?
+        """,
+        (etsy_shop_id, int(time.time()), guild_id),
+    )
 
 
 def save_pkce_state(
     state: str, code_verifier: str, setup_token: str, guild_id: int, expires_at: int
 ) -> None:
-    with get_db() as conn:
+    if DATABASE_URL:
+        _pg("save_pkce_state", state, code_verifier, setup_token, guild_id, expires_at)
+        return
+    with _transaction() as conn:
         conn.execute(
             """
             INSERT OR REPLACE INTO pkce_state (state, code_verifier, setup_token, guild_id, expires_at)
@@ -67,11 +153,13 @@ def save_pkce_state(
             (state, code_verifier, setup_token, guild_id, expires_at),
         )
         conn.execute("DELETE FROM pkce_state WHERE expires_at <= ?", (int(time.time()),))
-        conn.commit()
 
 
 def get_pkce_state(state: str) -> sqlite3.Row | None:
-    with get_db() as conn:
+    if DATABASE_URL:
+        row: sqlite3.Row | None = _pg("get_pkce_state", state)
+        return row
+    with _transaction() as conn:
         return conn.execute(
             "SELECT * FROM pkce_state WHERE state = ? AND expires_at > ?",
             (state, int(time.time())),
@@ -79,20 +167,63 @@ def get_pkce_state(state: str) -> sqlite3.Row | None:
 
 
 def delete_pkce_state(state: str) -> None:
-    with get_db() as conn:
+    if DATABASE_URL:
+        _pg("delete_pkce_state", state)
+        return
+    with _transaction() as conn:
         conn.execute("DELETE FROM pkce_state WHERE state = ?", (state,))
-        conn.commit()
+
+
+def consume_pkce_state(state: str) -> sqlite3.Row | None:
+    """Delete an unexpired PKCE state and return it, in one statement.
+
+    A state can only be consumed once, even by two callbacks racing on it.
+    """
+    if DATABASE_URL:
+        row: sqlite3.Row | None = _pg("consume_pkce_state", state)
+        return row
+    with _transaction() as conn:
+        return conn.execute(
+            "DELETE FROM pkce_state WHERE state = ? AND expires_at > ? RETURNING *",
+            (state, int(time.time())),
+        ).fetchone()
 
 
 def save_guild_tokens(
     guild_id: int, access_token: str, refresh_token: str, expires_at: int
 ) -> None:
-    with get_db() as conn:
+    if DATABASE_URL:
+        _pg("save_guild_tokens", guild_id, access_token, refresh_token, expires_at)
+        return
+    with _transaction() as conn:
+        _save_guild_tokens(conn, guild_id, access_token, refresh_token, expires_at)
+
+
+def _save_guild_tokens(
+    conn: sqlite3.Connection, guild_id: int, access_token: str, refresh_token: str, expires_at: int
+) -> None:
+    conn.execute(
+        """
+        INSERT OR REPLACE INTO etsy_tokens (guild_id, access_token, refresh_token, expires_at)
+        VALUES (?, ?, ?, ?)
+        """,
+        (guild_id, access_token, refresh_token, expires_at),
+    )
+
+
+def connect_guild(
+    guild_id: int, etsy_shop_id: int, access_token: str, refresh_token: str, expires_at: int
+) -> None:
+    """Store the tokens and shop from a finished OAuth flow in one transaction,
+    and let the bot know."""
+    if DATABASE_URL:
+        _pg("connect_guild", guild_id, etsy_shop_id, access_token, refresh_token, expires_at)
+        return
+    with _transaction() as conn:
+        _save_guild_tokens(conn, guild_id, access_token, refresh_token, expires_at)
+        _update_guild_etsy(conn, guild_id, etsy_shop_id)
+        # Tells the bot (see get_guild_events() in src/bot/db.py)
         conn.execute(
-            """
-            INSERT OR REPLACE INTO etsy_tokens (guild_id, access_token, refresh_token, expires_at)
-            VALUES (?, ?, ?, ?)
-            """,
-            (guild_id, access_token, refresh_token, expires_at),
+            "INSERT INTO guild_events (guild_id, created_at) VALUES (?, ?)",
+            (guild_id, int(time.time())),
         )
-        conn.commit()
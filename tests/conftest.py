@@ -11,45 +11,22 @@ import time
 
 import pytest
 
+from src.schema import migrate
+
 # Must be set before src.web.app is imported
 os.environ.setdefault("ETSY_API_KEY", "test_api_key")
 os.environ.setdefault("ETSY_SHARED_SECRET", "test_shared_secret")
 os.environ.setdefault("ETSY_WEB_REDIRECT_URI", "http://localhost/callback/etsy")
 os.environ.setdefault("DISCORD_CLIENT_ID", "123456789")
 os.environ.setdefault("WEB_BASE_URL", "http://localhost:8080")
-# Prevent init_pkce_table() (called at app import time) from writing to ./shopkeep.db
+# Prevent init_db() (called at app import time) from writing to ./shopkeep.db
 os.environ.setdefault("DB_PATH", "/tmp/shopkeep_pytest_init.db")
 
 
 def _create_web_schema(path: str) -> None:
-    """Create the tables that the web server reads/writes."""
+    """Create the full shared schema the web server reads/writes."""
     conn = sqlite3.connect(path)
-    conn.executescript("""
-        CREATE TABLE IF NOT EXISTS guilds (
-            guild_id         INTEGER PRIMARY KEY,
-            guild_name       TEXT,
-            etsy_shop_id     INTEGER,
-            order_channel_id INTEGER,
-            setup_token      TEXT UNIQUE,
-            setup_token_exp  INTEGER,
-            connected_at     INTEGER,
-            created_at       INTEGER NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS etsy_tokens (
-            guild_id      INTEGER PRIMARY KEY,
-            access_token  TEXT    NOT NULL,
-            refresh_token TEXT    NOT NULL,
-            expires_at    INTEGER NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS pkce_state (
-            state         TEXT    PRIMARY KEY,
-            code_verifier TEXT    NOT NULL,
-            setup_token   TEXT    NOT NULL,
-            guild_id      INTEGER NOT NULL,
-            expires_at    INTEGER NOT NULL
-        );
-    """)
-    conn.commit()
+    migrate(conn)
     conn.close()
 
 
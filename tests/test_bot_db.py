@@ -1,11 +1,34 @@
 """Basic tests for the async SQLite layer."""
 
+import asyncio
+import os
+import sqlite3
 import time
 
 import pytest
 
 import src.bot.db as botdb
-from src.bot.db import create_guild, get_guild, get_unnotified_receipts, get_unnotified_reviews, init_db, upsert_receipt, upsert_review, upsert_shop
+from src.bot.db import (
+    create_guild,
+    create_guilds,
+    get_bot_state,
+    get_connected_guilds,
+    get_guild,
+    get_guild_ids,
+    get_receipt_transactions,
+    get_shop_sync,
+    get_unnotified_receipts,
+    get_unnotified_reviews,
+    init_db,
+    mark_shop_synced,
+    set_bot_state,
+    upsert_listings,
+    upsert_receipt,
+    upsert_receipts,
+    upsert_receipts_transactions,
+    upsert_review,
+    upsert_shop,
+)
 
 
 @pytest.fixture(autouse=True)
@@ -108,3 +131,599 @@ async def test_get_unnotified_reviews(db):
 
     rows = await get_unnotified_reviews(db, shop_id=1)
     assert [r["transaction_id"] for r in rows] == [10]
+
+
+async def test_get_connected_guilds_filters_by_shard(db):
+    # Guild IDs whose (id >> 22) % 2 is 0 and 1 respectively
+    even, odd = 2 << 22, 3 << 22
+    for gid in (even, odd):
+        await create_guild(db, gid, f"g{gid}", f"tok{gid}", int(time.time()) + 3600)
+        await db.execute(
+            "UPDATE guilds SET etsy_shop_id = 1, order_channel_id = 1 WHERE guild_id = ?", (gid,)
+        )
+    await db.commit()
+
+    assert {r["guild_id"] for r in await get_connected_guilds(db)} == {even, odd}
+    rows = await get_connected_guilds(db, shard_count=2, shard_ids=[1])
+    assert [r["guild_id"] for r in rows] == [odd]
+
+
+async def test_create_guilds_skips_existing(db):
+    exp = int(time.time()) + 3600
+    await create_guild(db, 1, "Old Name", "tok1", exp)
+    await create_guilds(db, [(1, "New Name", "tok2", exp), (2, "Second", "tok3", exp)])
+    await db.commit()
+    assert await get_guild_ids(db) == {1, 2}
+    assert (await get_guild(db, 1))["guild_name"] == "Old Name"
+
+
+async def test_bot_state_round_trip(db):
+    assert await get_bot_state(db, "command_tree_hash") is None
+    await set_bot_state(db, "command_tree_hash", "abc")
+    await set_bot_state(db, "command_tree_hash", "def")
+    await db.commit()
+    assert await get_bot_state(db, "command_tree_hash") == "def"
+
+
+async def test_pool_reuses_configured_connections(db):
+    await botdb.open_pool(1)
+    try:
+        async with botdb.get_db() as first:
+            pass
+        async with botdb.get_db() as second:
+            busy = await (await second.execute("PRAGMA busy_timeout")).fetchone()
+        assert first is second
+        assert busy[0] == botdb.schema.PRAGMA_PROFILE["busy_timeout"]
+    finally:
+        await botdb.close_pool()
+
+
+async def test_pool_overflows_instead_of_blocking(db):
+    await botdb.open_pool(1)
+    try:
+        async with botdb.get_db() as outer:
+            async with botdb.get_db() as inner:
+                assert inner is not outer
+    finally:
+        await botdb.close_pool()
+
+
+async def test_pool_bounds_overflow_connections(db, monkeypatch):
+    monkeypatch.setattr(botdb, "POOL_OVERFLOW", 1)
+    monkeypatch.setattr(botdb, "POOL_TIMEOUT_SECS", 0.1)
+    await botdb.open_pool(1)
+    try:
+        async with botdb.get_db(), botdb.get_db():
+            with pytest.raises(RuntimeError):
+                async with botdb.get_db():
+                    pass
+        async with botdb.get_db(), botdb.get_db():
+            pass
+    finally:
+        await botdb.close_pool()
+
+
+async def test_pool_discards_uncommitted_writes_on_release(db):
+    await botdb.open_pool(1)
+    try:
+        async with botdb.get_db() as conn:
+            await create_guild(conn, 9, "Uncommitted", "tok9", int(time.time()) + 3600)
+        async with botdb.get_db() as conn:
+            assert await get_guild(conn, 9) is None
+    finally:
+        await botdb.close_pool()
+
+
+async def test_write_groups_concurrent_jobs_into_one_commit(db):
+    await botdb.open_pool(1)
+    try:
+        statements = []
+        await botdb._pool.writer.conn.set_trace_callback(statements.append)
+        exp = int(time.time()) + 3600
+        await asyncio.gather(*(
+            botdb.write(create_guild, gid, f"Guild {gid}", f"tok{gid}", exp) for gid in range(1, 11)
+        ))
+        assert statements.count("COMMIT") == 1
+        async with botdb.get_db() as conn:
+            assert await get_guild_ids(conn) == set(range(1, 11))
+    finally:
+        await botdb.close_pool()
+
+
+async def test_write_failure_only_rolls_back_its_own_job(db):
+    async def broken(conn):
+        await create_guild(conn, 2, "Half done", "tok2", 0)
+        raise RuntimeError("boom")
+
+    await botdb.open_pool(1)
+    try:
+        results = await asyncio.gather(
+            botdb.write(create_guild, 1, "Kept", "tok1", 0),
+            botdb.write(broken),
+            botdb.write(set_bot_state, "k", "v"),
+            return_exceptions=True,
+        )
+        assert isinstance(results[1], RuntimeError)
+        async with botdb.get_db() as conn:
+            assert await get_guild_ids(conn) == {1}
+            assert await get_bot_state(conn, "k") == "v"
+    finally:
+        await botdb.close_pool()
+
+
+async def test_writer_survives_failed_commit_and_rollback(db, monkeypatch):
+    await botdb.open_pool(1)
+    try:
+        conn = botdb._pool.writer.conn
+
+        async def broken():
+            raise sqlite3.OperationalError("disk I/O error")
+
+        commit, rollback = conn.commit, conn.rollback
+        monkeypatch.setattr(conn, "commit", broken)
+        monkeypatch.setattr(conn, "rollback", broken)
+        with pytest.raises(sqlite3.OperationalError):
+            await botdb.write(set_bot_state, "k", "lost")
+        monkeypatch.setattr(conn, "commit", commit)
+        monkeypatch.setattr(conn, "rollback", rollback)
+
+        await asyncio.wait_for(botdb.write(set_bot_state, "k", "v"), timeout=5)
+        async with botdb.get_db() as reader:
+            assert await get_bot_state(reader, "k") == "v"
+    finally:
+        await botdb.close_pool()
+
+
+def _receipt(receipt_id: int, **overrides) -> dict:
+    return {
+        "receipt_id": receipt_id,
+        "shop_id": 1,
+        "seller_user_id": 9,
+        "status": "paid",
+        "grandtotal": {"amount": 1000, "divisor": 100, "currency_code": "USD"},
+        "create_timestamp": int(time.time()),
+        **overrides,
+    }
+
+
+async def test_upsert_receipts_returns_new_and_changed_ids(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    assert (await upsert_receipts(db, [_receipt(1), _receipt(2)], already_seen=True)).keys() == {1, 2}
+    await db.commit()
+
+    changed = await upsert_receipts(
+        db, [_receipt(1), _receipt(2, is_shipped=True, status="canceled"), _receipt(3)]
+    )
+    await db.commit()
+    assert changed.keys() == {2, 3}
+    assert (changed[2]["prev_status"], changed[2]["status"]) == ("paid", "canceled")
+    assert (changed[2]["prev_is_shipped"], changed[2]["is_shipped"]) == (0, 1)
+    assert changed[3]["prev_status"] is None  # new
+
+    # notified_at survives the refresh; only the brand-new receipt is pending
+    assert [r["receipt_id"] for r in await get_unnotified_receipts(db, 1)] == [3]
+
+
+async def test_upsert_listings_returns_only_changed(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    base = {"shop_id": 1, "user_id": 9, "title": "Mug", "price": {"amount": 1200}}
+    listings = [{**base, "listing_id": 10, "quantity": 3}, {**base, "listing_id": 11, "quantity": 1}]
+    assert (await upsert_listings(db, listings)).keys() == {10, 11}
+    await db.commit()
+    listings[1]["quantity"] = 0
+    changed = await upsert_listings(db, listings)
+    assert changed.keys() == {11}
+    assert (changed[11]["prev_quantity"], changed[11]["quantity"]) == (1, 0)
+
+
+async def test_upsert_receipts_transactions_fills_details_later(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    line = {"transaction_id": 500, "title": "Mug", "create_timestamp": 1}
+    receipts = [_receipt(1, transactions=[line])]
+    await upsert_receipts(db, receipts)
+    assert (await upsert_receipts_transactions(db, receipts)).keys() == {500}
+    assert not await upsert_receipts_transactions(db, receipts)
+
+    line["personalization_message"] = "For Sam"
+    assert (await upsert_receipts_transactions(db, receipts)).keys() == {500}
+    line.pop("personalization_message")
+    assert not await upsert_receipts_transactions(db, receipts)
+    rows = await get_receipt_transactions(db, 1)
+    assert rows[0]["personalization_msg"] == "For Sam"
+
+
+async def test_upsert_shop_skips_unchanged_rows(db):
+    shop = {"shop_id": 1, "shop_name": "Shop", "user_id": 9, "num_favorers": 3}
+    assert await upsert_shop(db, shop) is True
+    await db.commit()
+    changes_before = db.total_changes
+    assert await upsert_shop(db, shop) is False
+    assert db.total_changes == changes_before
+    assert await upsert_shop(db, {**shop, "num_favorers": 4}) is True
+
+
+async def test_mark_shop_synced_tracks_stages(db):
+    await mark_shop_synced(db, 1, "listings", "receipts")
+    row = await get_shop_sync(db, 1)
+    assert row["listings_synced_at"] and row["receipts_synced_at"]
+    assert row["reviews_synced_at"] is None
+    await mark_shop_synced(db, 1, "reviews")
+    assert (await get_shop_sync(db, 1))["reviews_synced_at"]
+    with pytest.raises(ValueError):
+        await mark_shop_synced(db, 1, "bogus")
+
+
+async def test_run_executes_sync_callable_on_connection(db):
+    def _count(conn, table):
+        conn.execute("INSERT INTO bot_state (key, value, updated_at) VALUES ('k', 'v', 0)")
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    assert await botdb.run(db, _count, "bot_state") == 1
+    assert await get_bot_state(db, "k") == "v"
+
+
+async def test_ingest_shop_page_stores_everything_in_one_call(db):
+    shop = {"shop_id": 1, "shop_name": "Shop", "user_id": 9}
+    listing = {"listing_id": 10, "shop_id": 1, "user_id": 9, "title": "Mug", "quantity": 2}
+    review = {"shop_id": 1, "listing_id": 10, "transaction_id": 500, "rating": 5, "create_timestamp": 1}
+    receipts = [_receipt(1, transactions=[{"transaction_id": 500, "title": "Mug"}])]
+
+    listing_changes, receipt_changes = await botdb.ingest_shop_page(
+        db, 1, shop, [listing], receipts, [review], already_seen=True
+    )
+    assert listing_changes.keys() == {10}
+    assert receipt_changes.keys() == {1}
+    assert (await get_receipt_transactions(db, 1))[0]["transaction_id"] == 500
+    assert not await get_unnotified_receipts(db, 1)
+    assert (await get_shop_sync(db, 1))["reviews_synced_at"]
+
+
+async def test_get_guild_overview(db):
+    assert await botdb.get_guild_overview(db, 1) is None
+    await create_guild(db, 1, "My Server", "tok", int(time.time()) + 3600)
+    overview = await botdb.get_guild_overview(db, 1)
+    assert overview["guild"]["guild_name"] == "My Server"
+    assert overview["goal"] is None
+
+
+async def test_daily_sales_rollup_follows_receipt_changes(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    receipts = [_receipt(1), _receipt(2)]
+    await upsert_receipts(db, receipts)
+    sales = await botdb.get_sales_since(db, 1, 0)
+    assert sales["orders"] == 2 and sales["currency"] == "USD"
+    revenue = sales["revenue"]
+
+    await upsert_receipts(db, [_receipt(2, status="canceled")])
+    sales = await botdb.get_sales_since(db, 1, 0)
+    assert sales["orders"] == 1
+    assert sales["revenue"] == pytest.approx(revenue / 2)
+    assert sales == await botdb.get_receipt_totals_since(db, 1, 0)
+
+
+async def test_bestsellers_rollup_follows_cancellations(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    ts = int(time.time())
+    month = time.strftime("%Y-%m", time.gmtime(ts))
+
+    def line(transaction_id, listing_id, quantity):
+        return {
+            "transaction_id": transaction_id, "listing_id": listing_id, "title": f"Item {listing_id}",
+            "quantity": quantity, "price": {"amount": 500, "divisor": 100, "currency_code": "USD"},
+            "create_timestamp": ts,
+        }
+
+    receipts = [
+        _receipt(1, transactions=[line(500, 10, 1), line(501, 11, 2)]),
+        _receipt(2, transactions=[line(502, 10, 3)]),
+    ]
+    await upsert_receipts(db, receipts)
+    await upsert_receipts_transactions(db, receipts)
+
+    top = await botdb.get_bestsellers(db, 1, month)
+    assert [(r["listing_id"], r["units_sold"]) for r in top] == [(10, 4), (11, 2)]
+    assert top[0]["total_revenue"] == pytest.approx(20.0)
+
+    await upsert_receipts(db, [_receipt(2, status="canceled")])
+    top = await botdb.get_bestsellers(db, 1, "all", ranked_by="revenue")
+    assert [(r["listing_id"], r["units_sold"]) for r in top] == [(11, 2), (10, 1)]
+
+
+async def test_buyers_table_tracks_returning_customers(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    first = _receipt(1, buyer_user_id=42, name="Sam Lee", is_paid=True, create_timestamp=100)
+    await upsert_receipts(db, [first, _receipt(2, buyer_user_id=42, name=" sam lee", create_timestamp=200)])
+    await upsert_receipts(db, [_receipt(3, buyer_user_id=7, name="Alex", status="canceled")])
+
+    assert not await botdb.is_returning_buyer(db, 1, 42, 1)
+    assert await botdb.is_returning_buyer(db, 1, 42, 2)
+    returning = {r["receipt_id"]: r["is_returning"] for r in await get_unnotified_receipts(db, 1)}
+    assert returning == {1: 0, 2: 1, 3: 0}
+
+    assert [r["receipt_id"] for r in await botdb.get_buyer_orders(db, 1, "SAM LEE")] == [1]
+    assert await botdb.search_buyers(db, 1, "") == ["Alex", " sam lee"]
+    assert await botdb.search_buyers(db, 1, "LE") == [" sam lee"]  # word prefixes, not substrings
+
+    row = await (await db.execute("SELECT * FROM buyers WHERE buyer_user_id = 7")).fetchone()
+    assert (row["order_count"], row["lifetime_spend_minor"]) == (0, 0)
+    await upsert_receipts(db, [_receipt(3, buyer_user_id=7, name="Alex")])
+    row = await (await db.execute("SELECT * FROM buyers WHERE buyer_user_id = 7")).fetchone()
+    assert (row["order_count"], row["lifetime_spend_minor"]) == (1, 1000)
+
+
+async def test_buyer_orders_include_guest_checkouts(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    await upsert_receipts(db, [
+        _receipt(1, name="Sam Lee", is_paid=True, create_timestamp=100),
+        _receipt(2, buyer_user_id=42, name="sam lee", is_paid=True, create_timestamp=200),
+        _receipt(3, name="Sam Leeson", is_paid=True, create_timestamp=300),
+    ])
+    assert [r["receipt_id"] for r in await botdb.get_buyer_orders(db, 1, "Sam Lee")] == [2, 1]
+
+
+async def test_buyer_orders_follow_name_changes(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    await upsert_receipts(db, [
+        _receipt(1, buyer_user_id=42, name="Sam Lee", is_paid=True, create_timestamp=100),
+        _receipt(2, buyer_user_id=42, name="Sam Fox", is_paid=True, create_timestamp=200),
+    ])
+
+    async def ids(name):
+        return [r["receipt_id"] for r in await botdb.get_buyer_orders(db, 1, name)]
+
+    assert await ids("Sam Fox") == [2, 1]  # the buyer's current name finds all their orders
+    assert await ids("Sam Lee") == [1]  # an old name still finds the orders placed under it
+
+
+async def test_search_orders_matches_buyers_items_and_personalization(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    await upsert_shop(db, {"shop_id": 2, "shop_name": "Other", "user_id": 8})
+    line = {"transaction_id": 500, "listing_id": 10, "title": "Brass Ring", "create_timestamp": 1,
+            "variations": [{"formatted_name": "Personalization", "formatted_value": "Für Zoë"}]}
+    receipts = [
+        _receipt(1, name="Ada Lovelace", city="London", is_paid=True, transactions=[line]),
+        _receipt(2, name="Grace Hopper", city="Arlington", is_paid=True),
+    ]
+    await upsert_receipts(db, receipts + [_receipt(3, shop_id=2, name="Ada Other")])
+    await upsert_receipts_transactions(db, receipts)
+
+    async def ids(query):
+        return [r["receipt_id"] for r in await botdb.search_orders(db, 1, query)]
+
+    assert await ids("ada") == [1]
+    assert await ids("lond") == [1]
+    assert await ids("brass") == [1]
+    assert await ids("zoe") == [1]  # diacritics folded
+    assert await ids("2") == [2]
+    assert await ids('ada" OR shop : *') == []  # FTS syntax is stripped, not parsed
+    assert await ids("--") == []
+
+    assert [r["receipt_id"] for r in await botdb.get_labelable_receipts(db, 1, search="grace")] == [2]
+    await upsert_receipts(db, [_receipt(2, name="Grace Hopper", city="Arlington", is_paid=True, is_shipped=True)])
+    assert await botdb.get_labelable_receipts(db, 1, search="grace") == []
+
+
+async def test_open_order_queries_exclude_canceled_and_shipped(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    await upsert_receipts(db, [
+        _receipt(1, is_paid=True),
+        _receipt(2, is_paid=True, status="Canceled"),
+        _receipt(3, is_paid=True, is_shipped=True, status="completed"),
+        _receipt(4),
+    ])
+    assert await botdb.get_open_order_count(db, 1) == 2
+    assert [r["receipt_id"] for r in await botdb.get_labelable_receipts(db, 1)] == [1]
+    row = await (await db.execute("SELECT status_code, is_open FROM receipts WHERE receipt_id = 2")).fetchone()
+    assert tuple(row) == (botdb.schema.STATUS_CANCELED, 0)
+
+
+async def test_shop_counters_track_open_and_unnotified_rows(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    assert await botdb.get_shop_counters(db, 1) == {
+        "open_orders": 0, "unnotified_receipts": 0, "unnotified_reviews": 0
+    }
+    await upsert_receipts(db, [_receipt(1), _receipt(2), _receipt(3, status="canceled")])
+    await upsert_review(db, {"transaction_id": 500, "shop_id": 1, "rating": 5, "create_timestamp": 1})
+    assert await botdb.get_shop_counters(db, 1) == {
+        "open_orders": 2, "unnotified_receipts": 3, "unnotified_reviews": 1
+    }
+
+    await botdb.mark_receipt_notified(db, 1)
+    await botdb.mark_review_notified(db, 500)
+    await upsert_receipts(db, [_receipt(2, is_shipped=True), _receipt(1, status="canceled")])
+    assert await botdb.get_shop_counters(db, 1) == {
+        "open_orders": 0, "unnotified_receipts": 2, "unnotified_reviews": 0
+    }
+    assert await botdb.get_open_order_count(db, 1) == 0
+
+
+async def test_archive_orders_moves_finished_receipts(tmp_path, monkeypatch):
+    monkeypatch.setattr(botdb, "ARCHIVE_DB_PATH", str(tmp_path / "archive.db"))
+    await init_db()
+    async with botdb.get_db() as db:
+        await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+        old = {"buyer_user_id": 42, "name": "Sam", "is_paid": True, "is_shipped": True,
+               "status": "completed", "create_timestamp": 1000}
+        line = {"transaction_id": 500, "listing_id": 10, "title": "Mug", "create_timestamp": 1000}
+        receipts = [_receipt(1, **old, transactions=[line]), _receipt(2, **old), _receipt(3, create_timestamp=1000)]
+        await upsert_receipts(db, receipts, already_seen=True)
+        await upsert_receipts_transactions(db, receipts)
+        await db.commit()
+        sales_before = await botdb.get_sales_since(db, 1, 0)
+        top_before = [tuple(r) for r in await botdb.get_bestsellers(db, 1, "all")]
+
+        async def archive(batch_size: int) -> int:
+            receipt_ids = await botdb.write(botdb.copy_orders_to_archive, 2000, batch_size)
+            return await botdb.write(botdb.delete_archived_orders, receipt_ids)
+
+        # A copy whose delete never ran is copied again and then removed
+        assert len(await botdb.write(botdb.copy_orders_to_archive, 2000, 1)) == 1
+        assert len(await db.execute_fetchall("SELECT receipt_id FROM receipts")) == 3
+        assert await archive(1) == 1
+        assert await archive(10) == 1
+        assert await archive(10) == 0  # 3 is still open
+
+        ids = [r["receipt_id"] for r in await db.execute_fetchall("SELECT receipt_id FROM receipts")]
+        assert ids == [3]
+        assert await botdb.get_sales_since(db, 1, 0) == sales_before
+        assert [tuple(r) for r in await botdb.get_bestsellers(db, 1, "all")] == top_before
+
+        # A re-fetch from Etsy doesn't resurrect archived rows
+        await upsert_receipts(db, receipts[:1])
+        await upsert_receipts_transactions(db, receipts[:1])
+        assert await botdb.get_sales_since(db, 1, 0) == sales_before
+
+        assert not await botdb.get_buyer_orders(db, 1, "Sam")
+        archived = await botdb.get_buyer_orders(db, 1, "Sam", include_archive=True)
+        assert {r["receipt_id"]: r["items"] for r in archived} == {1: "Mug", 2: None}
+
+
+async def test_digest_config_round_trip(db):
+    await create_guild(db, 1, "G", "tok", 0)
+    assert await botdb.get_digest_config(db, 1) is None
+    await botdb.set_digest_config(db, 1, "09:00", "UTC")
+    assert await botdb.get_digest_config(db, 1) == {"time": "09:00", "tz": "UTC", "last_sent": None}
+    await botdb.disable_digest(db, 1)
+    assert await botdb.get_digest_config(db, 1) is None
+
+
+async def test_pinned_shop_pools_are_not_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(botdb, "DB_LAYOUT", "per_shop")
+    monkeypatch.setattr(botdb, "SHOP_DB_DIR", str(tmp_path / "shops"))
+    monkeypatch.setattr(botdb, "SHOP_DB_CACHE_SIZE", 1)
+    monkeypatch.setattr(botdb, "_migrated_shops", set())
+    monkeypatch.setattr(botdb, "_pinned_shops", set())
+    await init_db()
+    await botdb.open_pool(1)
+    try:
+        botdb.pin_shops([1, 2])
+        for shop_id in (1, 2, 3, 4):
+            async with botdb.get_shop_db(shop_id):
+                pass
+        assert sorted(botdb._shop_pools) == [1, 2, 4]
+    finally:
+        await botdb.close_pool()
+
+
+async def test_per_shop_layout_isolates_shops(tmp_path, monkeypatch):
+    monkeypatch.setattr(botdb, "DB_LAYOUT", "per_shop")
+    monkeypatch.setattr(botdb, "SHOP_DB_DIR", str(tmp_path / "shops"))
+    monkeypatch.setattr(botdb, "SHOP_DB_CACHE_SIZE", 1)
+    monkeypatch.setattr(botdb, "_migrated_shops", set())
+    await init_db()
+    await botdb.open_pool(1)
+    try:
+        for shop_id in (1, 2):
+            shop = {"shop_id": shop_id, "shop_name": f"Shop {shop_id}", "user_id": 9}
+            await botdb.write_shop(shop_id, botdb.ingest_shop_page, shop_id, shop, [], [_receipt(shop_id, shop_id=shop_id)])
+        await botdb.write(create_guild, 1, "G", "tok", 0)
+        await botdb.write(botdb.update_guild_etsy, 1, 2)
+
+        async with botdb.get_shop_db(1) as conn:  # reopens shop 1, evicting shop 2
+            assert [r["receipt_id"] for r in await get_unnotified_receipts(conn, 1)] == [1]
+            assert await botdb.get_shop_name(conn, 2) is None
+        async with botdb.get_db() as conn:
+            assert await botdb.get_shop_name(conn, 1) is None  # control db holds no shop data
+        assert sorted(p.name for p in (tmp_path / "shops").glob("*.db")) == ["1.db", "2.db"]
+        async with botdb.get_read_db(2) as conn:
+            assert [r["receipt_id"] for r in await get_unnotified_receipts(conn, 2)] == [2]
+
+        assert await botdb.drop_shop_database(1) is True
+        assert await botdb.drop_shop_database(2) is False  # guild 1 is still connected
+        assert not (tmp_path / "shops" / "1.db").exists()
+    finally:
+        await botdb.close_pool()
+
+
+async def test_checkpoint_truncates_large_wal(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    await db.commit()
+    [result] = await botdb.checkpoint_databases(truncate_above=1 << 30)
+    assert (result["mode"], result["busy"]) == ("PASSIVE", False)
+    assert result["wal_bytes"] > 0
+
+    [result] = await botdb.checkpoint_databases(truncate_above=0)
+    assert result["mode"] == "TRUNCATE"
+    assert os.path.getsize(botdb.DB_PATH + "-wal") == 0
+
+
+async def test_read_db_is_read_only_and_pooled(db):
+    await create_guild(db, 1, "G", "tok", 0)
+    await db.commit()
+    await botdb.open_pool(1, readers=1)
+    try:
+        async with botdb.get_read_db() as first:
+            assert (await get_guild(first, 1))["guild_name"] == "G"
+            await botdb.write(create_guild, 2, "H", "tok2", 0)
+            assert await get_guild(first, 2) is None  # still on its snapshot
+            with pytest.raises(sqlite3.OperationalError, match="readonly"):
+                await first.execute("DELETE FROM guilds")
+        async with botdb.get_read_db() as second:
+            assert await get_guild(second, 2) is not None
+        assert first is second
+    finally:
+        await botdb.close_pool()
+
+
+async def test_maintenance_analyzes_and_reclaims_free_pages(db):
+    await upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    await upsert_receipts(db, [_receipt(n, name="x" * 2000) for n in range(1, 200)])
+    await db.commit()
+    await db.execute("DELETE FROM receipts")
+    await db.commit()
+
+    [result] = await botdb.maintain_databases([], budget_secs=10, vacuum_pages=8)
+    assert result["free_bytes_before"] > 0 and result["free_bytes_after"] == 0
+    assert result["bytes_after"] < result["bytes_before"]
+    assert await (await db.execute("SELECT 1 FROM sqlite_stat1 LIMIT 1")).fetchone()
+
+    [result] = await botdb.maintain_databases([], budget_secs=10)
+    assert result["bytes_after"] == result["bytes_before"]
+    assert await botdb.maintain_databases([], budget_secs=0) == []
+
+
+async def test_maintenance_converts_legacy_databases_instead_of_startup():
+    legacy = sqlite3.connect(botdb.DB_PATH)
+    legacy.execute("CREATE TABLE legacy (x)")
+    legacy.close()
+    await init_db()
+
+    def auto_vacuum() -> int:
+        conn = sqlite3.connect(botdb.DB_PATH)
+        try:
+            return conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        finally:
+            conn.close()
+
+    assert auto_vacuum() == 0
+    await botdb.maintain_databases([], budget_secs=10)
+    assert auto_vacuum() == 2
+
+
+async def test_maintenance_skips_conversions_that_dont_fit_the_budget(monkeypatch):
+    legacy = sqlite3.connect(botdb.DB_PATH)
+    legacy.execute("CREATE TABLE legacy (x)")
+    legacy.close()
+    await init_db()
+    monkeypatch.setattr(botdb, "VACUUM_BYTES_PER_SEC", 1)
+
+    assert len(await botdb.maintain_databases([], budget_secs=10)) == 1  # still analyzed
+    conn = sqlite3.connect(botdb.DB_PATH)
+    try:
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+async def test_guild_events_are_read_in_order_after_a_cursor(db):
+    assert await botdb.get_last_guild_event_id(db) == 0
+    for guild_id in (1, 2, 3):
+        await botdb.add_guild_event(db, guild_id)
+    await db.commit()
+    assert [e["guild_id"] for e in await botdb.get_guild_events(db, 1)] == [2, 3]
+    assert await botdb.get_last_guild_event_id(db) == 3
+
+    assert await botdb.delete_guild_events(db, int(time.time()) + 1) == 3
+    await botdb.add_guild_event(db, 4)
+    await db.commit()
+    assert [e["event_id"] for e in await botdb.get_guild_events(db, 3)] == [4]  # IDs aren't reused
@@ -0,0 +1,41 @@
+"""Basic tests for the bounded in-process caches."""
+
+from src.bot.cache import LRUDict
+
+
+def test_evicts_least_recently_used():
+    evicted = []
+    cache = LRUDict(maxsize=2, on_evict=lambda k, v: evicted.append(k))
+    cache[1] = "a"
+    cache[2] = "b"
+    cache.get(1)  # touch 1 so 2 becomes the oldest
+    cache[3] = "c"
+    assert list(cache) == [1, 3]
+    assert evicted == [2]
+
+
+def test_unbounded_by_default():
+    cache = LRUDict()
+    for i in range(1000):
+        cache[i] = i
+    assert len(cache) == 1000
+
+
+def test_pop_and_contains():
+    cache = LRUDict(maxsize=5)
+    cache["x"] = 1
+    assert "x" in cache
+    assert cache.pop("x") == 1
+    assert cache.pop("x", None) is None
+    assert "x" not in cache
+
+
+def test_pinned_keys_are_never_evicted():
+    pinned = {1, 2}
+    cache = LRUDict(maxsize=2, pinned=pinned.__contains__)
+    for i in (1, 2, 3, 4):
+        cache[i] = i
+    assert sorted(cache) == [1, 2, 4]  # over maxsize while everything else is pinned
+    pinned.discard(1)
+    cache[5] = 5
+    assert sorted(cache) == [2, 5]
@@ -2,7 +2,12 @@
 
 import discord
 
-from src.bot.notifier import build_order_embed, build_review_embed, build_shop_embed
+from src.bot.notifier import (
+    build_order_embed,
+    build_review_embed,
+    build_search_results_embed,
+    build_shop_embed,
+)
 
 
 def test_shop_embed_title():
@@ -117,3 +122,22 @@ def test_review_embed_thumbnail_from_image_url():
     review = {"transaction_id": 5, "rating": 5, "image_url": "https://example.com/img.jpg", "create_timestamp": 1700000000}
     embed = build_review_embed(review, "My Shop")
     assert embed.thumbnail.url == "https://example.com/img.jpg"
+
+
+def test_search_results_embed_fields():
+    row = {
+        "receipt_id": 42, "name": "Ada Lovelace", "city": "London", "status": "paid",
+        "is_shipped": 0, "create_timestamp": 1700000000, "grandtotal_amount": 1850,
+        "grandtotal_divisor": 100, "grandtotal_currency": "USD",
+        "items": "Brass Ring", "personalization": "Engrave: AL",
+    }
+    embed = build_search_results_embed([row], "ada", "My Shop")
+    assert embed.fields[0].name == "#42 — Ada Lovelace (London)"
+    assert "$18.50 USD" in embed.fields[0].value
+    assert "Engrave: AL" in embed.fields[0].value
+
+
+def test_search_results_embed_no_matches():
+    embed = build_search_results_embed([], "zzz", "My Shop")
+    assert embed.description == "No orders matched."
+    assert embed.footer.text == "My Shop"
@@ -0,0 +1,226 @@
+"""Tests for the PostgreSQL backend.
+
+The parity tests always run; the rest need a scratch database they may wipe, e.g.
+TEST_DATABASE_URL=postgresql://postgres@127.0.0.1:5432/shopkeep_test
+"""
+
+import inspect
+import os
+import time
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+
+import src.bot.db as botdb  # noqa: E402
+import src.bot.pg as pgdb  # noqa: E402
+from src import schema, schema_pg  # noqa: E402
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL", "")
+
+needs_postgres = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+
+def _helpers(module) -> dict:
+    return {
+        name: inspect.signature(fn)
+        for name, fn in vars(module).items()
+        if inspect.iscoroutinefunction(fn) and not name.startswith("_") and fn.__module__ == module.__name__
+    }
+
+
+def test_pg_helpers_mirror_sqlite_helpers():
+    sqlite_helpers, pg_helpers = _helpers(botdb), _helpers(pgdb)
+    assert set(sqlite_helpers) - set(pg_helpers) == {"run"}  # sync callables are SQLite-only
+    for name, signature in pg_helpers.items():
+        assert list(signature.parameters) == list(sqlite_helpers[name].parameters), name
+
+
+def test_pg_migrations_mirror_sqlite_migrations():
+    assert [m.__name__ for m in schema_pg.MIGRATIONS] == [m.__name__ for m in schema.MIGRATIONS]
+
+
+def test_ts_query_keeps_only_words():
+    assert pgdb._ts_query('ada" | !shop:*') == "ada:* & shop:*"
+    assert pgdb._ts_query("sam", weights="A") == "sam:*A"
+    assert pgdb._ts_query("--") is None
+
+
+@pytest.fixture()
+async def db(monkeypatch):
+    monkeypatch.setattr(pgdb, "DATABASE_URL", TEST_DATABASE_URL)
+    conn = await asyncpg.connect(TEST_DATABASE_URL)
+    await conn.execute(
+        "DROP SCHEMA IF EXISTS archive CASCADE; DROP SCHEMA public CASCADE; CREATE SCHEMA public"
+    )
+    await conn.close()
+    await pgdb.init_db()
+    async with pgdb.get_db() as conn:
+        yield conn
+
+
+def _receipt(receipt_id: int, **overrides) -> dict:
+    return {
+        "receipt_id": receipt_id,
+        "shop_id": 1,
+        "seller_user_id": 9,
+        "status": "paid",
+        "grandtotal": {"amount": 1000, "divisor": 100, "currency_code": "USD"},
+        "create_timestamp": int(time.time()),
+        **overrides,
+    }
+
+
+@needs_postgres
+async def test_migrate_is_idempotent(db):
+    assert await schema_pg.migrate(db) == 0
+    assert await schema_pg.get_version(db) == len(schema_pg.MIGRATIONS)
+
+
+@needs_postgres
+async def test_upserts_report_new_and_changed_rows(db):
+    assert await pgdb.upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9}) is True
+    assert await pgdb.upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9}) is False
+    assert (await pgdb.upsert_receipts(db, [_receipt(1), _receipt(2)], already_seen=True)).keys() == {1, 2}
+
+    changed = await pgdb.upsert_receipts(
+        db, [_receipt(1), _receipt(2, is_shipped=True, status="canceled"), _receipt(3), _receipt(3)]
+    )
+    assert changed.keys() == {2, 3}
+    assert (changed[2]["prev_status"], changed[2]["status"]) == ("paid", "canceled")
+    assert (changed[2]["prev_is_shipped"], changed[2]["is_shipped"]) == (0, 1)
+    assert changed[3]["prev_status"] is None
+    assert [r["receipt_id"] for r in await pgdb.get_unnotified_receipts(db, 1)] == [3]
+    assert (await pgdb.get_receipt(db, 1, 2))["status_code"] == schema.STATUS_CANCELED
+
+    line = {"transaction_id": 500, "title": "Mug", "create_timestamp": 1}
+    receipts = [_receipt(1, transactions=[line])]
+    assert (await pgdb.upsert_receipts_transactions(db, receipts)).keys() == {500}
+    line["personalization_message"] = "For Sam"
+    assert (await pgdb.upsert_receipts_transactions(db, receipts)).keys() == {500}
+    line.pop("personalization_message")
+    assert not await pgdb.upsert_receipts_transactions(db, receipts)
+
+
+@needs_postgres
+async def test_rollups_and_counters_follow_receipt_changes(db):
+    await pgdb.upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    line = {"transaction_id": 500, "listing_id": 10, "title": "Mug", "quantity": 2,
+            "price": {"amount": 500, "divisor": 100, "currency_code": "USD"}, "create_timestamp": 1}
+    receipts = [_receipt(1, transactions=[line]), _receipt(2)]
+    await pgdb.upsert_receipts(db, receipts)
+    await pgdb.upsert_receipts_transactions(db, receipts)
+    assert (await pgdb.get_sales_since(db, 1, 0))["orders"] == 2
+    top = await pgdb.get_bestsellers(db, 1, "all")
+    assert [(r["listing_id"], r["units_sold"], r["total_revenue"]) for r in top] == [(10, 2, 10.0)]
+    assert await pgdb.get_shop_counters(db, 1) == {
+        "open_orders": 2, "unnotified_receipts": 2, "unnotified_reviews": 0
+    }
+
+    await pgdb.upsert_receipts(db, [_receipt(1, status="canceled")])
+    sales = await pgdb.get_sales_since(db, 1, 0)
+    assert sales == {"orders": 1, "revenue": 10.0, "currency": "USD"}
+    assert sales == await pgdb.get_receipt_totals_since(db, 1, 0)
+    assert await pgdb.get_bestsellers(db, 1, "all") == []
+    assert (await pgdb.get_shop_counters(db, 1))["open_orders"] == 1
+
+
+@needs_postgres
+async def test_buyers_and_search(db):
+    await pgdb.upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    line = {"transaction_id": 500, "listing_id": 10, "title": "Brass Ring", "create_timestamp": 1,
+            "variations": [{"formatted_name": "Personalization", "formatted_value": "For Zoe"}]}
+    receipts = [
+        _receipt(1, buyer_user_id=42, name="Ada Lovelace", city="London", is_paid=True,
+                 create_timestamp=100, transactions=[line]),
+        _receipt(2, buyer_user_id=42, name="ada lovelace", is_paid=True, create_timestamp=200),
+        _receipt(3, buyer_user_id=7, name="Grace Hopper", is_paid=True, create_timestamp=300),
+    ]
+    await pgdb.upsert_receipts(db, receipts)
+    await pgdb.upsert_receipts_transactions(db, receipts)
+
+    assert await pgdb.is_returning_buyer(db, 1, 42, 2)
+    assert [r["receipt_id"] for r in await pgdb.get_buyer_orders(db, 1, "ADA LOVELACE")] == [2, 1]
+    assert await pgdb.search_buyers(db, 1, "") == ["Grace Hopper", "ada lovelace"]
+    assert await pgdb.search_buyers(db, 1, "hop") == ["Grace Hopper"]
+    assert await pgdb.search_buyers(db, 1, "brass") == []  # names only
+
+    async def ids(query):
+        return [r["receipt_id"] for r in await pgdb.search_orders(db, 1, query)]
+
+    assert await ids("lond") == [1]
+    assert await ids("brass zoe") == [1]
+    assert await ids("3") == [3]
+    assert await ids("--") == []
+    assert [r["receipt_id"] for r in await pgdb.get_labelable_receipts(db, 1, search="grace")] == [3]
+
+    # A guest checkout, and the same buyer under a new name
+    renamed_and_guest = [
+        _receipt(4, buyer_user_id=42, name="Ada King", is_paid=True, create_timestamp=400),
+        _receipt(5, name="Ada Lovelace", is_paid=True, create_timestamp=500),
+    ]
+    await pgdb.upsert_receipts(db, renamed_and_guest)
+    assert [r["receipt_id"] for r in await pgdb.get_buyer_orders(db, 1, "Ada Lovelace")] == [5, 2, 1]
+    assert [r["receipt_id"] for r in await pgdb.get_buyer_orders(db, 1, "ada king")] == [4, 2, 1]
+
+
+@needs_postgres
+async def test_archive_orders_moves_finished_receipts(db):
+    await pgdb.upsert_shop(db, {"shop_id": 1, "shop_name": "Shop", "user_id": 9})
+    old = {"buyer_user_id": 42, "name": "Sam", "is_paid": True, "is_shipped": True,
+           "status": "completed", "create_timestamp": 1000}
+    line = {"transaction_id": 500, "listing_id": 10, "title": "Mug", "create_timestamp": 1000}
+    receipts = [_receipt(1, **old, transactions=[line]), _receipt(2, **old), _receipt(3, create_timestamp=1000)]
+    await pgdb.upsert_receipts(db, receipts, already_seen=True)
+    await pgdb.upsert_receipts_transactions(db, receipts)
+    sales_before = await pgdb.get_sales_since(db, 1, 0)
+
+    async def archive(batch_size: int) -> int:
+        receipt_ids = await pgdb.write(pgdb.copy_orders_to_archive, 2000, batch_size)
+        return await pgdb.write(pgdb.delete_archived_orders, receipt_ids)
+
+    assert len(await pgdb.write(pgdb.copy_orders_to_archive, 2000, 1)) == 1
+    assert await archive(1) == 1
+    assert await archive(10) == 1
+    assert await archive(10) == 0
+
+    assert [r[0] for r in await db.fetch("SELECT receipt_id FROM receipts")] == [3]
+    await pgdb.upsert_receipts(db, receipts[:1])
+    await pgdb.upsert_receipts_transactions(db, receipts[:1])
+    assert await pgdb.get_sales_since(db, 1, 0) == sales_before
+
+    assert not await pgdb.get_buyer_orders(db, 1, "Sam")
+    archived = await pgdb.get_buyer_orders(db, 1, "Sam", include_archive=True)
+    assert {r["receipt_id"]: r["items"] for r in archived} == {1: "Mug", 2: None}
+
+
+@needs_postgres
+async def test_write_rolls_back_failed_jobs(db):
+    async def fail(conn):
+        await pgdb.set_bot_state(conn, "k", "v")
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        await pgdb.write(fail)
+    assert await pgdb.get_bot_state(db, "k") is None
+    await pgdb.write(pgdb.set_bot_state, "k", "v")
+    assert await pgdb.get_bot_state(db, "k") == "v"
+
+
+@needs_postgres
+async def test_read_db_rejects_writes(db):
+    await pgdb.write(pgdb.set_bot_state, "k", "v")
+    async with pgdb.get_read_db() as conn:
+        assert await pgdb.get_bot_state(conn, "k") == "v"
+        with pytest.raises(asyncpg.ReadOnlySQLTransactionError):
+            await pgdb.set_bot_state(conn, "k", "w")
+
+
+@needs_postgres
+async def test_connect_guild_records_guild_event(db):
+    await pgdb.create_guild(db, 7, "G", "tok", 0)
+    await pgdb.write(pgdb.connect_guild, 7, 99, "access", "refresh", 123)
+    [event] = await pgdb.get_guild_events(db, 0)
+    assert event["guild_id"] == 7
+    assert await pgdb.get_last_guild_event_id(db) == event["event_id"]
+    assert await pgdb.delete_guild_events(db, int(time.time()) + 1) == 1
@@ -0,0 +1,64 @@
+"""Query-plan regression tests: hot per-shop queries must stay on their indexes."""
+
+import pytest
+
+import src.bot.db as botdb
+
+
+@pytest.fixture(autouse=True)
+def patch_db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(botdb, "DB_PATH", str(tmp_path / "test.db"))
+
+
+@pytest.fixture()
+async def db():
+    await botdb.init_db()
+    async with botdb.get_db() as conn:
+        yield conn
+
+
+async def _plans(db, call) -> list[str]:
+    """Run a helper, capturing its SQL, and return the EXPLAIN QUERY PLAN details."""
+    statements = []
+    await db.set_trace_callback(statements.append)
+    await call(db)
+    await db.set_trace_callback(None)
+    plans = []
+    for sql in statements:
+        if "'orders_fts_" in sql:
+            continue  # FTS5 reading its own shadow tables
+        if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            rows = await db.execute_fetchall(f"EXPLAIN QUERY PLAN {sql}")
+            plans.extend(row[3] for row in rows)
+    assert plans, "helper ran no queries"
+    return plans
+
+
+@pytest.mark.parametrize(
+    "call, index",
+    [
+        (lambda db: botdb.get_unnotified_receipts(db, 1), "idx_receipts_unnotified"),
+        (lambda db: botdb.get_unnotified_reviews(db, 1), "idx_reviews_unnotified"),
+        (lambda db: botdb.get_receipt_transactions(db, 1), "idx_transactions_receipt"),
+        (lambda db: botdb.get_bestsellers(db, 1, "all"), "idx_listing_sales_units"),
+        (lambda db: botdb.get_bestsellers(db, 1, "all", "revenue"), "idx_listing_sales_revenue"),
+        (lambda db: botdb.get_receipt_totals_since(db, 1, 0), "idx_receipts_shop_created"),
+        (lambda db: botdb.get_sales_since(db, 1, 0), "PRIMARY KEY"),
+        (lambda db: botdb.get_labelable_receipts(db, 1), "idx_receipts_labelable"),
+        (lambda db: botdb.is_returning_buyer(db, 1, 42, 7), "PRIMARY KEY"),
+        (lambda db: botdb.get_buyer_orders(db, 1, "Sam"), "idx_buyers_name"),
+        (lambda db: botdb.search_buyers(db, 1, ""), "idx_buyers_recent"),
+        (lambda db: botdb.get_pending_reminders(db, 1, 1, 0, 10), "idx_receipts_unshipped"),
+        (lambda db: botdb.get_open_order_count(db, 1), "idx_receipts_open"),
+        (lambda db: botdb.get_receipts_due_within(db, 1, 86400, 0), "idx_receipts_open"),
+        (lambda db: botdb.get_active_listings(db, 1), "idx_listings_shop_state"),
+    ],
+)
+async def test_hot_query_uses_index(db, call, index):
+    plans = await _plans(db, call)
+    assert any(index in p for p in plans), plans
+    # A MATCH on the full-text table shows up as a SCAN of the virtual table
+    full_scans = [
+        p for p in plans if p.startswith("SCAN") and "USING" not in p and "VIRTUAL TABLE" not in p
+    ]
+    assert not full_scans, plans
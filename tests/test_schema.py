@@ -0,0 +1,111 @@
+"""Tests for the shared schema migration runner."""
+
+import sqlite3
+
+import pytest
+
+from src import schema
+
+
+@pytest.fixture()
+def conn(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "test.db"))
+    yield conn
+    conn.close()
+
+
+def test_migrate_fresh_database(conn):
+    assert schema.migrate(conn) == len(schema.MIGRATIONS)
+    assert schema.get_version(conn) == schema.SCHEMA_VERSION
+    assert "goal_month" in schema._columns(conn, "guilds")
+
+
+def test_migrate_is_noop_when_current(conn):
+    schema.migrate(conn)
+    statements = []
+    conn.set_trace_callback(statements.append)
+    assert schema.migrate(conn) == 0
+    assert statements == ["PRAGMA user_version"]
+
+
+def test_migrate_upgrades_legacy_database(conn):
+    # A pre-migration database: user_version 0 and tables missing later columns
+    conn.execute("""
+        CREATE TABLE guilds (
+            guild_id INTEGER PRIMARY KEY, guild_name TEXT, etsy_shop_id INTEGER,
+            order_channel_id INTEGER, setup_token TEXT UNIQUE, setup_token_exp INTEGER,
+            connected_at INTEGER, created_at INTEGER NOT NULL, digest_time TEXT
+        )
+    """)
+    conn.execute("INSERT INTO guilds (guild_id, created_at, digest_time) VALUES (1, 0, '09:00')")
+    conn.commit()
+
+    schema.migrate(conn)
+
+    assert {"ship_reminder_days", "backlog_warned", "goal_month"} <= schema._columns(conn, "guilds")
+    row = conn.execute("SELECT digest_time, backlog_warned FROM guilds").fetchone()
+    assert row == ("09:00", 0)
+
+
+def test_failed_migration_rolls_back(conn, monkeypatch):
+    def broken(c):
+        c.execute("CREATE TABLE half_done (id INTEGER)")
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(schema, "MIGRATIONS", [*schema.MIGRATIONS, broken])
+    monkeypatch.setattr(schema, "SCHEMA_VERSION", len(schema.MIGRATIONS))
+    with pytest.raises(RuntimeError):
+        schema.migrate(conn)
+
+    assert schema.get_version(conn) == len(schema.MIGRATIONS) - 1
+    tables = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert "half_done" not in tables
+
+
+def test_daily_sales_backfilled_from_existing_receipts(conn, monkeypatch):
+    monkeypatch.setattr(schema, "SCHEMA_VERSION", 4)
+    monkeypatch.setattr(schema, "MIGRATIONS", schema.MIGRATIONS[:4])
+    schema.migrate(conn)
+    conn.execute("INSERT INTO shops (shop_id, shop_name, user_id, fetched_at) VALUES (1, 'S', 9, 0)")
+    for receipt_id, status in ((1, "paid"), (2, "completed"), (3, "Canceled")):
+        conn.execute(
+            """
+            INSERT INTO receipts (receipt_id, shop_id, seller_user_id, status,
+                                  grandtotal_amount, create_timestamp, fetched_at)
+            VALUES (?, 1, 9, ?, 1500, 86400, 0)
+            """,
+            (receipt_id, status),
+        )
+    conn.commit()
+    monkeypatch.undo()
+
+    schema.migrate(conn)
+
+    row = conn.execute("SELECT day, orders, revenue_minor_units FROM daily_sales").fetchone()
+    assert row == ("1970-01-02", 2, 3000)
+
+
+def test_configure_pragmas_overrides_profile(conn, monkeypatch):
+    monkeypatch.setattr(schema, "PRAGMA_PROFILE", dict(schema.PRAGMA_PROFILE))
+    schema.configure_pragmas(" cache_size=-4000, MMAP_SIZE=0,,")
+    schema.apply_pragmas(conn)
+    assert conn.execute("PRAGMA cache_size").fetchone()[0] == -4000
+    assert conn.execute("PRAGMA mmap_size").fetchone()[0] == 0
+    assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    for bad in ("cache_size", "cache_size=1;DROP TABLE guilds", "a b=1"):
+        with pytest.raises(ValueError):
+            schema.configure_pragmas(bad)
+
+
+def test_incremental_vacuum_on_new_and_existing_databases(conn, tmp_path):
+    schema.migrate(conn)
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert schema.enable_incremental_vacuum(conn) is False
+
+    legacy = sqlite3.connect(str(tmp_path / "legacy.db"))
+    legacy.execute("CREATE TABLE t (x)")
+    schema.migrate(legacy)
+    assert legacy.execute("PRAGMA auto_vacuum").fetchone()[0] == 0
+    assert schema.enable_incremental_vacuum(legacy) is True
+    assert legacy.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    legacy.close()
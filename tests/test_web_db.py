@@ -1,8 +1,17 @@
 """Basic tests for the sync web SQLite helpers."""
 
+import sqlite3
 import time
 
-from src.web.db import delete_pkce_state, get_pkce_state, save_pkce_state
+import src.web.db as webdb
+from src.web.db import (
+    connect_guild,
+    consume_pkce_state,
+    delete_pkce_state,
+    get_pkce_state,
+    save_pkce_state,
+)
+from tests.conftest import insert_guild
 
 
 def test_save_and_get_pkce_state(web_db):
@@ -22,3 +31,29 @@ def test_delete_pkce_state(web_db):
     save_pkce_state("del_me", "v", "t", 1, int(time.time()) + 600)
     delete_pkce_state("del_me")
     assert get_pkce_state("del_me") is None
+
+
+def test_consume_pkce_state_only_succeeds_once(web_db):
+    save_pkce_state("once", "v", "t", 1, int(time.time()) + 600)
+    save_pkce_state("stale", "v", "t", 1, int(time.time()) - 1)
+    assert consume_pkce_state("once")["code_verifier"] == "v"
+    assert consume_pkce_state("once") is None
+    assert consume_pkce_state("stale") is None
+
+
+def test_connect_guild_stores_tokens_and_shop(web_db):
+    insert_guild(web_db, guild_id=7)
+    connect_guild(7, 99, "access", "refresh", 123)
+    conn = sqlite3.connect(web_db)
+    assert conn.execute("SELECT etsy_shop_id, setup_token FROM guilds WHERE guild_id = 7").fetchone() == (99, None)
+    assert conn.execute("SELECT access_token FROM etsy_tokens WHERE guild_id = 7").fetchone() == ("access",)
+    assert conn.execute("SELECT event_id, guild_id FROM guild_events").fetchall() == [(1, 7)]
+
+
+def test_helpers_reuse_connections(web_db):
+    save_pkce_state("s", "v", "t", 1, int(time.time()) + 600)
+    with webdb._transaction() as first:
+        pass
+    get_pkce_state("s")
+    with webdb._transaction() as again:
+        assert again is first